@@ -0,0 +1,102 @@
+from flask import g, request, current_app, Response
+
+# For counting the requests in progress across the threads or greenlets of the worker
+import threading
+
+# For timing the requests
+from time import perf_counter
+
+
+# Weight of the latest page request in the moving average of the page durations, and the seconds in which the average
+# halves while no page requests are in progress, so that the searches are not shed for long after a busy moment has passed
+LATENCY_WEIGHT = 0.1
+LATENCY_HALF_LIFE = 1.0
+
+# Requests in progress in this worker process by class, the moving average of the duration of its page requests in seconds
+# and the time it was last updated, and the requests refused by class
+inFlight = {"page": 0, "expensive": 0}
+pageLatency = [0.0, 0.0]
+shedCount = {"page": 0, "expensive": 0}
+admissionLock = threading.Lock()
+
+
+# Mark the view as expensive, so that its requests are shed first when the worker is overloaded
+def expensive(view):
+
+    view.admission = "expensive"
+    return view
+
+
+# Leave the requests of the view out of the admission control, as the live update streams are open for minutes by design
+def exempt(view):
+
+    view.admission = "exempt"
+    return view
+
+
+# Enable the admission control if ADMISSION_MAX_CONCURRENCY is set. When it is 0, no hooks are registered at all
+def init_app(app):
+
+    if not app.config["ADMISSION_MAX_CONCURRENCY"]:
+        return
+
+    app.before_request(admit_request)
+    app.teardown_request(finish_request)
+
+
+# Admit the request or answer it with 503 Service Unavailable. Expensive requests are refused once ADMISSION_EXPENSIVE_CONCURRENCY of them
+# are in progress, or while the page requests take longer than ADMISSION_LATENCY_MS on average. Every other request is admitted
+# until the worker has ADMISSION_MAX_CONCURRENCY requests in progress, so the pages keep being served while the searches are shed
+def admit_request():
+
+    view = current_app.view_functions.get(request.endpoint)
+    kind = getattr(view, "admission", "page")
+    if kind == "exempt":
+        return None
+
+    config = current_app.config
+    with admissionLock:
+        if inFlight["page"] + inFlight["expensive"] >= config["ADMISSION_MAX_CONCURRENCY"]:
+            admitted = False
+        elif kind == "expensive":
+            admitted = inFlight["expensive"] < config["ADMISSION_EXPENSIVE_CONCURRENCY"] and average_latency() * 1000 <= config["ADMISSION_LATENCY_MS"]
+        else:
+            admitted = True
+
+        if admitted:
+            inFlight[kind] += 1
+        else:
+            shedCount[kind] += 1
+
+    if not admitted:
+        return Response("The forum is busy, try again in a moment", status=503, headers={"Retry-After": "1"}, mimetype="text/plain")
+
+    g.admission = (kind, perf_counter())
+    return None
+
+
+# Count the admitted request out, and add the duration of a page request to the moving average
+def finish_request(exception):
+
+    if not "admission" in g:
+        return
+
+    kind, start = g.pop("admission")
+    with admissionLock:
+        inFlight[kind] -= 1
+        if kind == "page":
+            now = perf_counter()
+            average = average_latency(now)
+            pageLatency[0] = average + (now - start - average) * LATENCY_WEIGHT
+            pageLatency[1] = now
+
+
+# Moving average of the page durations. While no page requests are in progress, it decays with the time since the last one finished
+def average_latency(now=None):
+
+    if inFlight["page"]:
+        return pageLatency[0]
+    if now is None:
+        now = perf_counter()
+
+    return pageLatency[0] * 0.5 ** ((now - pageLatency[1]) / LATENCY_HALF_LIFE)
@@ -1,7 +1,93 @@
-from flask import Flask, session
-from os import getenv
+from flask import Flask
+from os import getenv, path
 
-app = Flask(__name__)
-app.config["SECRET_KEY"] = getenv("SECRET_KEY")
+# For the address of the client behind the proxies of the platform
+from werkzeug.middleware.proxy_fix import ProxyFix
 
-import routes
+# For the settings of the rate limits and the default location of their counters
+import re, tempfile
+
+import db, instrumentation, admission, rendering, routes, commands
+
+
+# Build the application out of the settings in the environment. Nothing is connected or compiled here:
+# the database connections are opened and the templates loaded when first needed, or by warmup.warm_up before the first request
+def create_app():
+
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = getenv("SECRET_KEY")
+    # Number of threads listed on a single page of a section
+    app.config["THREADS_PER_PAGE"] = int(getenv("THREADS_PER_PAGE", "50"))
+    # Number of messages shown on a single page of a thread
+    app.config["MESSAGES_PER_PAGE"] = int(getenv("MESSAGES_PER_PAGE", "50"))
+    # Text search configuration used for indexing and querying, and the number of search results on a page
+    app.config["SEARCH_CONFIG"] = getenv("SEARCH_CONFIG", "simple")
+    app.config["SEARCH_RESULTS_PER_PAGE"] = int(getenv("SEARCH_RESULTS_PER_PAGE", "20"))
+    # Upper bound of the results of a single query over all of its pages
+    app.config["SEARCH_MAX_RESULTS"] = int(getenv("SEARCH_MAX_RESULTS", "500"))
+    # Cache of search results bounded by the number of cached pages of results (0 disables it) and their total size, and the time they are kept.
+    # Posts invalidate the results in the worker process they happen in, the time limit bounds how stale the other workers can be
+    app.config["SEARCH_CACHE_MAX_ENTRIES"] = int(getenv("SEARCH_CACHE_MAX_ENTRIES", "1000"))
+    app.config["SEARCH_CACHE_MAX_BYTES"] = int(getenv("SEARCH_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+    app.config["SEARCH_CACHE_TTL"] = float(getenv("SEARCH_CACHE_TTL", "60"))
+    # Memory bound of the cache of pages rendered for visitors who are not logged in (0 disables it), and the time the pages are kept.
+    # Writes invalidate the pages of the worker process they happen in, the time limit bounds how stale the other workers can be
+    app.config["PAGE_CACHE_MAX_BYTES"] = int(getenv("PAGE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+    app.config["PAGE_CACHE_TTL"] = float(getenv("PAGE_CACHE_TTL", "30"))
+    # Parameters of the password hashes as "pbkdf2:<hash function>:<iterations>" and the salt length.
+    # Passwords hashed with other parameters are hashed again when their users log in
+    app.config["PASSWORD_HASH_METHOD"] = getenv("PASSWORD_HASH_METHOD", "pbkdf2:sha256:260000")
+    app.config["PASSWORD_SALT_LENGTH"] = int(getenv("PASSWORD_SALT_LENGTH", "16"))
+    # Replies are either written by the request ("direct"), or queued for a writer thread that writes them in batches ("buffered").
+    # A batch is written once it has REPLY_BATCH_SIZE replies or REPLY_FLUSH_INTERVAL seconds have passed since its first reply,
+    # and the request returns once its batch is committed. A reply not taken into a batch within REPLY_ACK_TIMEOUT seconds is given up
+    # and its request fails, while a reply already being written is waited for
+    app.config["REPLY_WRITE_MODE"] = getenv("REPLY_WRITE_MODE", "direct")
+    app.config["REPLY_BATCH_SIZE"] = int(getenv("REPLY_BATCH_SIZE", "100"))
+    app.config["REPLY_FLUSH_INTERVAL"] = float(getenv("REPLY_FLUSH_INTERVAL", "0.01"))
+    app.config["REPLY_ACK_TIMEOUT"] = float(getenv("REPLY_ACK_TIMEOUT", "10"))
+    # Live updates of threads: the time a Server-Sent Events stream is kept open before the browser reconnects,
+    # the interval of the keep-alive comments on an idle stream and the time a long-polling request waits for new messages
+    app.config["LIVE_STREAM_SECONDS"] = float(getenv("LIVE_STREAM_SECONDS", "300"))
+    app.config["LIVE_HEARTBEAT_SECONDS"] = float(getenv("LIVE_HEARTBEAT_SECONDS", "15"))
+    app.config["LIVE_POLL_SECONDS"] = float(getenv("LIVE_POLL_SECONDS", "25"))
+    # Directory of the compiled templates, filled by flask compile-templates when the app is deployed so that the workers
+    # do not compile the templates again when they start (empty compiles them in every worker)
+    app.config["TEMPLATE_CACHE_DIR"] = getenv("TEMPLATE_CACHE_DIR", path.join(app.root_path, ".template_cache"))
+    # Pages that are not served from the page cache are sent while they are rendered: the head of the page as soon as it is ready,
+    # then the rest in chunks of STREAM_CHUNK_BYTES characters ("0" renders the pages in full first)
+    app.config["STREAMED_PAGES"] = getenv("STREAMED_PAGES", "1") == "1"
+    app.config["STREAM_CHUNK_BYTES"] = int(getenv("STREAM_CHUNK_BYTES", "16384"))
+    # Token bucket limits of the account creation, login, posting and search requests, as name=requests/seconds, for each client address
+    # and each user ("" turns them off). The buckets are kept in the SQLite file RATE_LIMIT_STORE, shared by the worker processes of the host
+    app.config["RATE_LIMITS"] = {name: (int(count), float(seconds)) for name, count, seconds in re.findall(r"(\w+)=(\d+)/([\d.]+)",
+                                 getenv("RATE_LIMITS", "createaccount=5/3600,login=10/60,post_thread=5/60,post_reply=20/60,search=30/60"))}
+    app.config["RATE_LIMIT_STORE"] = getenv("RATE_LIMIT_STORE", path.join(tempfile.gettempdir(), "forum-ratelimit.sqlite3"))
+    # Proxies in front of the app trusted to give the address of the client in X-Forwarded-For (1 on Heroku, 0 when the app is reached directly)
+    app.config["FORWARDED_PROXIES"] = int(getenv("FORWARDED_PROXIES", "0"))
+    # Admission control of each worker process: at most ADMISSION_MAX_CONCURRENCY requests in progress (0 turns it off), of which at most
+    # ADMISSION_EXPENSIVE_CONCURRENCY searches. The searches are refused while the page requests take longer than ADMISSION_LATENCY_MS on average
+    app.config["ADMISSION_MAX_CONCURRENCY"] = int(getenv("ADMISSION_MAX_CONCURRENCY", "100"))
+    app.config["ADMISSION_EXPENSIVE_CONCURRENCY"] = int(getenv("ADMISSION_EXPENSIVE_CONCURRENCY", "2"))
+    app.config["ADMISSION_LATENCY_MS"] = float(getenv("ADMISSION_LATENCY_MS", "500"))
+    # Per-request SQL statistics, the Server-Timing header, the slow query log and the /metrics endpoint, off by default
+    app.config["INSTRUMENTATION"] = getenv("INSTRUMENTATION", "0") == "1"
+    app.config["SLOW_QUERY_MS"] = float(getenv("SLOW_QUERY_MS", "100"))
+    # Warm-up of each gunicorn worker before it accepts requests: load the templates, open the connection pool
+    # and prepare the hot-path statements on every connection (see warmup.py)
+    app.config["WARM_UP"] = getenv("WARM_UP", "1") == "1"
+    # The hot-path queries are run as server-side prepared statements of each connection, so the database parses and plans them
+    # once per connection. Turn off ("0") behind a connection pooler in transaction mode, which does not keep the connection of a session
+    app.config["PREPARED_STATEMENTS"] = getenv("PREPARED_STATEMENTS", "1") == "1"
+
+    if app.config["FORWARDED_PROXIES"]:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["FORWARDED_PROXIES"])
+
+    db.init_app(app)
+    instrumentation.init_app(app)
+    admission.init_app(app)
+    rendering.init_app(app)
+    app.register_blueprint(routes.blueprint)
+    app.register_blueprint(commands.blueprint)
+
+    return app
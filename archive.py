@@ -0,0 +1,128 @@
+from sqlalchemy import text
+
+# For timing the scans in the report
+from time import perf_counter
+
+
+# Columns copied into the archive tables
+THREAD_COLUMNS = "id, posting_time, user_id, section_id, thread_name, content, visible, last_activity, version, modified_at, message_count"
+MESSAGE_COLUMNS = "id, posting_time, user_id, thread_id, content, visible"
+
+# Tables measured in the report, the hot tables first
+REPORT_TABLES = ["messages", "threads", "search_documents", "messages_archive", "threads_archive"]
+
+
+# Move the messages matching the condition into the archive and drop their search documents.
+# Returns the number of messages moved, how many of them were visible and their size in bytes for each thread
+def move_messages(connection, condition, params):
+
+    sql = "DELETE FROM search_documents WHERE message_id IN (SELECT id FROM messages WHERE " + condition + ")"
+    connection.execute(text(sql), params)
+
+    # The rows are moved with a single statement, the insert being run even though its result is not used
+    sql = "WITH moved AS (DELETE FROM messages WHERE " + condition + " RETURNING " + MESSAGE_COLUMNS + ", pg_column_size(messages.*) AS row_size)," \
+    " archived AS (INSERT INTO messages_archive (" + MESSAGE_COLUMNS + ") SELECT " + MESSAGE_COLUMNS + " FROM moved)" \
+    " SELECT thread_id, count(*) AS message_count, count(*) FILTER (WHERE visible) AS visible_count, COALESCE(sum(row_size), 0) AS size" \
+    " FROM moved GROUP BY thread_id"
+
+    return connection.execute(text(sql), params).fetchall()
+
+
+# Archive the deleted messages of the threads that are still in use, in batches of increasing ids each committed on its own,
+# so that the rows are locked only for the duration of a batch. Returns the number of messages moved and their size in bytes
+def archive_messages(engine, batch_size):
+
+    messageCount = 0
+    size = 0
+    last = 0
+    with engine.connect() as connection:
+        while True:
+            with connection.begin():
+                sql = "SELECT id FROM messages WHERE id > :last AND visible=false ORDER BY id LIMIT :batch_size FOR UPDATE SKIP LOCKED"
+                ids = [row.id for row in connection.execute(text(sql), {"last": last, "batch_size": batch_size})]
+                if not ids:
+                    break
+                last = ids[-1]
+
+                for thread in move_messages(connection, "id = ANY(:ids)", {"ids": ids}):
+                    messageCount += thread.message_count
+                    size += thread.size
+
+    return messageCount, size
+
+
+# Archive the threads matching the condition along with all their messages, in batches committed on their own.
+# Archived threads that were still visible are taken out of the statistics of their sections.
+# Returns the number of threads and messages moved and their size in bytes
+def archive_threads(engine, condition, params, batch_size):
+
+    threadCount = 0
+    messageCount = 0
+    size = 0
+    last = 0
+    with engine.connect() as connection:
+        while True:
+            with connection.begin():
+                sql = "SELECT id FROM threads WHERE id > :last AND " + condition + " ORDER BY id LIMIT :batch_size FOR UPDATE SKIP LOCKED"
+                ids = [row.id for row in connection.execute(text(sql), dict(params, last=last, batch_size=batch_size))]
+                if not ids:
+                    break
+                last = ids[-1]
+
+                visibleMessages = {}
+                for thread in move_messages(connection, "thread_id = ANY(:ids)", {"ids": ids}):
+                    messageCount += thread.message_count
+                    size += thread.size
+                    visibleMessages[thread.thread_id] = thread.visible_count
+
+                sql = "DELETE FROM search_documents WHERE thread_id = ANY(:ids)"
+                connection.execute(text(sql), {"ids": ids})
+
+                sql = "WITH moved AS (DELETE FROM threads WHERE id = ANY(:ids) RETURNING " + THREAD_COLUMNS + ", pg_column_size(threads.*) AS row_size)," \
+                " archived AS (INSERT INTO threads_archive (" + THREAD_COLUMNS + ") SELECT " + THREAD_COLUMNS + " FROM moved)" \
+                " SELECT id, section_id, visible, row_size FROM moved"
+                threads = connection.execute(text(sql), {"ids": ids}).fetchall()
+                threadCount += len(threads)
+                size += sum(thread.row_size for thread in threads)
+
+                # Update the statistics and the page versions of the sections the visible threads were listed in
+                sections = {}
+                for thread in threads:
+                    if thread.visible:
+                        counts = sections.setdefault(thread.section_id, [0, 0])
+                        counts[0] += 1
+                        counts[1] += visibleMessages.get(thread.id, 0)
+                for section_id, (sectionThreads, sectionMessages) in sections.items():
+                    sql = "UPDATE section_stats SET thread_count = thread_count - :threads, message_count = message_count - :messages WHERE section_id=:section_id"
+                    connection.execute(text(sql), {"threads": sectionThreads, "messages": sectionMessages, "section_id": section_id})
+                if sections:
+                    sql = "UPDATE sections SET version=version+1, modified_at=NOW() WHERE id = ANY(:section_ids)"
+                    connection.execute(text(sql), {"section_ids": list(sections)})
+
+    return threadCount, messageCount, size
+
+
+# Size of each table with its indexes in bytes, and the time of a full scan of it in milliseconds
+def measure(engine):
+
+    sizes = {}
+    with engine.connect() as connection:
+        for table in REPORT_TABLES:
+            # A partitioned table has no storage of its own, its size is the sum of its partitions
+            sql = "SELECT COALESCE((SELECT sum(pg_total_relation_size(relid)) FROM pg_partition_tree(T.id)), pg_total_relation_size(T.id))" \
+            " FROM (SELECT CAST(:table AS regclass) AS id) T"
+            size = connection.execute(text(sql), {"table": table}).scalar()
+            start = perf_counter()
+            connection.execute("SELECT count(*) FROM " + table).scalar()
+            sizes[table] = (size, (perf_counter() - start) * 1000)
+
+    return sizes
+
+
+# Let the space of the moved rows be reused and refresh the planner statistics of the tables
+def vacuum(engine):
+
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        for table in REPORT_TABLES:
+            connection.execute("VACUUM ANALYZE " + table)
@@ -0,0 +1,145 @@
+# Benchmark of the admission control and the rate limits.
+# Floods gunicorn with search requests while other clients load pages, with the admission control off and on, and reports the page latencies
+# and how many of the searches were served or shed. Also times a take from the token buckets shared by the worker processes.
+#
+#   BENCHMARK_DATABASE_URL=postgresql:///forum_bench python -m benchmarks.admission_benchmark --page-clients 8 --search-clients 32
+
+import argparse, json, threading, tempfile, http.client
+
+from os import environ, path
+
+# For timing the requests
+from time import perf_counter, sleep
+
+from benchmarks import seed
+from benchmarks.routes_benchmark import percentile
+from benchmarks.serving_benchmark import start_server, log_in
+
+
+# Settings of the server for each mode. The search cache is off so that every search request runs its query
+MODES = {
+    "off": {"ADMISSION_MAX_CONCURRENCY": "0", "SEARCH_CACHE_MAX_ENTRIES": "0"},
+    "on": {"ADMISSION_MAX_CONCURRENCY": "100", "SEARCH_CACHE_MAX_ENTRIES": "0"},
+}
+
+# Searches matching most of the messages, the expensive requests of the flood
+SEARCHES = ["/result?query=message&prevURL=/&page=%d" % page for page in range(1, 6)]
+
+
+# Send the requests of the paths in turn until the deadline, adding the latency of each response to the list of its status.
+# A refused request is followed by a pause of the seconds in its Retry-After, as a browser retrying the page would make
+def client(port, cookie, paths, deadline, results):
+
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+    i = 0
+    while perf_counter() < deadline:
+        start = perf_counter()
+        retryAfter = 0
+        try:
+            connection.request("GET", paths[i % len(paths)], headers={"Cookie": cookie})
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+            if status == 503:
+                retryAfter = float(response.getheader("Retry-After", "1"))
+        except (OSError, http.client.HTTPException):
+            status = None
+            connection.close()
+        results.setdefault(status, []).append(perf_counter() - start)
+        sleep(min(retryAfter, max(0, deadline - perf_counter())))
+        i += 1
+
+
+# Run the page clients and the search clients together for the given time, return the measurements of both
+def run_flood(port, username, pages, pageClients, searchClients, seconds):
+
+    cookie = log_in(port, username)
+    pageResults = {}
+    searchResults = {}
+    deadline = perf_counter() + seconds
+    threads = [threading.Thread(target=client, args=(port, cookie, pages, deadline, pageResults)) for i in range(pageClients)]
+    threads += [threading.Thread(target=client, args=(port, cookie, SEARCHES, deadline, searchResults)) for i in range(searchClients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    served = sorted(pageResults.get(200, []))
+    return {
+        "pages_per_second": len(served) / seconds,
+        "page_p50_ms": percentile(served, 0.50) * 1000 if served else None,
+        "page_p95_ms": percentile(served, 0.95) * 1000 if served else None,
+        "pages_shed": len(pageResults.get(503, [])),
+        "searches_served": len(searchResults.get(200, [])),
+        "searches_shed": len(searchResults.get(503, [])),
+        "errors": sum(len(latencies) for status, latencies in list(pageResults.items()) + list(searchResults.items()) if status not in (200, 503)),
+    }
+
+
+# Microseconds taken by a take from the token buckets, each from a different bucket, as the requests of different clients would
+def time_bucket_take(app, takes):
+
+    import ratelimit
+
+    with app.app_context():
+        store = ratelimit.BucketStore(path.join(tempfile.mkdtemp(), "buckets.sqlite3"))
+        start = perf_counter()
+        for i in range(takes):
+            store.take("search:ip:%d" % (i % 1000), 30, 0.5)
+
+    return (perf_counter() - start) / takes * 1000000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the page latencies under a flood of searches with the admission control off and on")
+    seed.add_size_arguments(parser)
+    parser.add_argument("--seed", action="store_true", help="replace the database contents with a generated forum first")
+    parser.add_argument("--page-clients", type=int, default=8, help="clients loading pages")
+    parser.add_argument("--search-clients", type=int, default=32, help="clients sending searches")
+    parser.add_argument("--seconds", type=float, default=20, help="duration of the flood for each mode")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--takes", type=int, default=20000, help="takes from the token buckets to time")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    app = seed.load_app()
+    from db import db
+    import migrate
+
+    with app.app_context():
+        engine = db.engine
+    if args.seed:
+        seed.reset_database(engine)
+        seed.seed(engine, args.sections, args.private_sections, args.users, args.threads, args.messages)
+        seed.rebuild_derived(app)
+        migrate.apply_migrations(engine)
+        seed.analyze(engine)
+
+    with engine.connect() as connection:
+        section, thread = connection.execute("SELECT section_id, thread_id FROM messages M JOIN threads T ON T.id = M.thread_id" \
+                                             " JOIN sections S ON S.id = T.section_id WHERE NOT S.private" \
+                                             " GROUP BY section_id, thread_id ORDER BY count(*) DESC LIMIT 1").fetchone()
+        username = connection.execute("SELECT username FROM users WHERE username LIKE 'user%%' ORDER BY id LIMIT 1").scalar()
+    pages = ["/", "/section/%d" % section, "/section/%d/%d" % (section, thread), "/section/%d/%d?newest=1" % (section, thread)]
+
+    results = {}
+    for mode, settings in MODES.items():
+        process, port, startup = start_server("gevent", environ["DATABASE_URL"], args.workers, settings)
+        try:
+            results[mode] = run_flood(port, username, pages, args.page_clients, args.search_clients, args.seconds)
+        finally:
+            process.terminate()
+            process.wait()
+    takeTime = time_bucket_take(app, args.takes)
+
+    print("%d page clients, %d search clients, %d gevent workers" % (args.page_clients, args.search_clients, args.workers))
+    print("%-10s %9s %12s %12s %11s %16s %14s %7s" % ("admission", "pages/s", "p50 (ms)", "p95 (ms)", "pages shed", "searches served",
+                                                    "searches shed", "errors"))
+    for mode, result in results.items():
+        print("%-10s %9.1f %12.1f %12.1f %11d %16d %14d %7d" % (mode, result["pages_per_second"], result["page_p50_ms"] or 0, result["page_p95_ms"] or 0,
+                                                               result["pages_shed"], result["searches_served"], result["searches_shed"], result["errors"]))
+    print("Token bucket take: %.1f us" % takeTime)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"size": vars(args), "results": results, "bucket_take_us": takeTime}, output, indent=2)
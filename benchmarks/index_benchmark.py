@@ -0,0 +1,92 @@
+# Before/after benchmark of the hot-path indexes added by the migrations.
+# Seeds BENCHMARK_DATABASE_URL with a large forum, times the page queries without the indexes,
+# applies the migrations and times the same queries again.
+#
+#   BENCHMARK_DATABASE_URL=postgresql:///forum_bench python -m benchmarks.index_benchmark --messages 2000000
+
+import argparse, json, statistics
+
+# For timing the queries
+from time import perf_counter
+
+from flask import session
+
+from benchmarks import seed
+
+
+# Time the hot-path data functions, return the median time of each in milliseconds
+def measure(app, cases, repeat):
+
+    from db import db
+
+    timings = {}
+    for name, username, run in cases:
+        times = []
+        for i in range(repeat):
+            with app.test_request_context():
+                if username:
+                    session["username"] = username
+                start = perf_counter()
+                run()
+                times.append(perf_counter() - start)
+                db.session.remove()
+        timings[name] = statistics.median(times) * 1000
+
+    return timings
+
+
+# The data functions run on the front page, section and thread pages and in the authentication
+def hot_path_cases(engine):
+
+    import forum, users
+
+    with engine.connect() as connection:
+        # The busiest section and thread, and a user with access to a private section
+        busiestSection = connection.execute("SELECT section_id FROM threads GROUP BY section_id ORDER BY count(*) DESC LIMIT 1").scalar()
+        busiestThread = connection.execute("SELECT thread_id FROM messages GROUP BY thread_id ORDER BY count(*) DESC LIMIT 1").scalar()
+        privateSection, username = connection.execute("SELECT P.section_id, U.username FROM user_privileges P JOIN users U ON U.id = P.user_id" \
+                                                      " ORDER BY P.id DESC LIMIT 1").fetchone()
+
+    return [
+        ("list_sections", username, lambda: forum.list_sections()),
+        ("list_threads (newest)", None, lambda: forum.list_threads(busiestSection, "newest")),
+        ("list_threads (latest reply)", None, lambda: forum.list_threads(busiestSection, "activity")),
+        ("get_messages (first page)", None, lambda: forum.get_messages(busiestThread)),
+        ("get_messages (newest page)", None, lambda: forum.get_messages(busiestThread, newest=True)),
+        ("check_section_access (private)", username, lambda: users.check_section_access(privateSection)),
+        ("is_existing_username", None, lambda: users.is_existing_username(username)),
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the hot-path queries before and after the index migrations")
+    seed.add_size_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    app = seed.load_app()
+    from db import db
+    import migrate
+
+    with app.app_context():
+        engine = db.engine
+    seed.reset_database(engine)
+    seed.seed(engine, args.sections, args.private_sections, args.users, args.threads, args.messages)
+    seed.rebuild_derived(app, search_index=False)
+    seed.analyze(engine)
+
+    cases = hot_path_cases(engine)
+    before = measure(app, cases, args.repeat)
+
+    migrate.apply_migrations(engine)
+    seed.analyze(engine)
+    after = measure(app, cases, args.repeat)
+
+    print("%-34s %12s %12s %9s" % ("query", "before (ms)", "after (ms)", "speedup"))
+    for name in before:
+        print("%-34s %12.2f %12.2f %8.1fx" % (name, before[name], after[name], before[name] / max(after[name], 1e-6)))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"size": vars(args), "before": before, "after": after}, output, indent=2)
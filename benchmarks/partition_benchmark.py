@@ -0,0 +1,88 @@
+# Before/after benchmark of partitioning the messages table by month.
+# Seeds BENCHMARK_DATABASE_URL with a large forum, times the page queries and a vacuum after a week of edits on the plain table,
+# converts the table with the partition-messages command and times the same again.
+#
+#   BENCHMARK_DATABASE_URL=postgresql:///forum_bench python -m benchmarks.partition_benchmark --threads 500000 --messages 50000000
+
+import argparse, json
+
+# For timing the conversion and the vacuum
+from time import perf_counter
+
+from sqlalchemy import text
+
+from benchmarks import seed
+from benchmarks.index_benchmark import measure, hot_path_cases
+
+
+# The hot-path data functions, and the ones following the recent activity of a new thread
+def recent_activity_cases(engine):
+
+    import forum
+
+    with engine.connect() as connection:
+        # The busiest thread started within the last month, and its newest message
+        recentThread = connection.execute("SELECT M.thread_id FROM messages M JOIN threads T ON T.id = M.thread_id" \
+                                          " WHERE T.posting_time > NOW() - interval '30 days' GROUP BY M.thread_id ORDER BY count(*) DESC LIMIT 1").scalar()
+        newestMessage = connection.execute(text("SELECT max(id) FROM messages WHERE thread_id=:thread_id"), {"thread_id": recentThread}).scalar()
+
+    return hot_path_cases(engine) + [
+        ("get_messages (recent, first page)", None, lambda: forum.get_messages(recentThread)),
+        ("get_messages (recent, newest page)", None, lambda: forum.get_messages(recentThread, newest=True)),
+        ("get_messages_since (recent)", None, lambda: forum.get_messages_since(recentThread, newestMessage, 100)),
+    ]
+
+
+# Edit the messages of the last week and time the vacuum removing the old row versions, in milliseconds.
+# Only the partitions of the recent months have anything to clean up once the table is partitioned
+def time_vacuum(engine):
+
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        connection.execute("UPDATE messages SET content = content || '.' WHERE posting_time > NOW() - interval '7 days'")
+        start = perf_counter()
+        connection.execute("VACUUM messages")
+
+    return (perf_counter() - start) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the page queries and a vacuum before and after partitioning the messages")
+    seed.add_size_arguments(parser)
+    parser.add_argument("--months-ahead", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    app = seed.load_app()
+    from db import db
+    import migrate, partition
+
+    with app.app_context():
+        engine = db.engine
+    seed.reset_database(engine)
+    seed.seed(engine, args.sections, args.private_sections, args.users, args.threads, args.messages)
+    seed.rebuild_derived(app, search_index=False)
+    migrate.apply_migrations(engine)
+    seed.analyze(engine)
+
+    cases = recent_activity_cases(engine)
+    before = measure(app, cases, args.repeat)
+    before["vacuum after a week of edits"] = time_vacuum(engine)
+
+    start = perf_counter()
+    partition.partition_messages(engine, args.months_ahead)
+    conversion = perf_counter() - start
+    seed.analyze(engine)
+
+    after = measure(app, cases, args.repeat)
+    after["vacuum after a week of edits"] = time_vacuum(engine)
+
+    print("Partitioned %d messages in %.1f s" % (args.messages, conversion))
+    print("%-36s %12s %12s %9s" % ("query", "before (ms)", "after (ms)", "speedup"))
+    for name in before:
+        print("%-36s %12.2f %12.2f %8.1fx" % (name, before[name], after[name], before[name] / max(after[name], 1e-6)))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"size": vars(args), "conversion_seconds": conversion, "before": before, "after": after}, output, indent=2)
@@ -0,0 +1,42 @@
+# Micro-benchmark of password verification: logins per second on one core for each hashing cost.
+#
+#   python -m benchmarks.password_benchmark --iterations 100000,260000,600000
+
+import argparse, json
+
+# For timing the verifications
+from time import perf_counter
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+# Verify a password hashed with the given number of iterations repeatedly, return the verifications per second
+def logins_per_second(iterations, repeat):
+
+    passwordHash = generate_password_hash("benchmark", method="pbkdf2:sha256:%d" % iterations)
+
+    start = perf_counter()
+    for i in range(repeat):
+        check_password_hash(passwordHash, "benchmark")
+    elapsed = perf_counter() - start
+
+    return repeat / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the password verifications per second and core for each hashing cost")
+    parser.add_argument("--iterations", default="50000,100000,260000,600000", help="comma separated PBKDF2 iteration counts")
+    parser.add_argument("--repeat", type=int, default=20, help="verifications timed for each iteration count")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {}
+    print("%-32s %14s" % ("PASSWORD_HASH_METHOD", "logins/s/core"))
+    for iterations in [int(count) for count in args.iterations.split(",")]:
+        method = "pbkdf2:sha256:%d" % iterations
+        results[method] = logins_per_second(iterations, args.repeat)
+        print("%-32s %14.1f" % (method, results[method]))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
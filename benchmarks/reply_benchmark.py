@@ -0,0 +1,82 @@
+# Benchmark of replies per second with the direct and buffered reply write modes.
+# Concurrent clients post replies to the same thread through the Flask test client, first with a commit per reply
+# and then through the writer thread that commits the replies in batches.
+#
+#   BENCHMARK_DATABASE_URL=postgresql:///forum_bench python -m benchmarks.reply_benchmark --seed --concurrency 32
+
+import argparse, json, threading
+
+# For timing the replies
+from time import perf_counter
+
+from benchmarks import seed
+from benchmarks.routes_benchmark import log_in
+
+
+# Post replies from concurrent clients in the given write mode, return the replies per second
+def replies_per_second(app, mode, thread_url, username, concurrency, replies):
+
+    app.config["REPLY_WRITE_MODE"] = mode
+    errors = []
+
+    def client_replies():
+        client = app.test_client()
+        token = log_in(client, username)
+        for i in range(replies):
+            response = client.post(thread_url + "/post_reply", data={"crsf_token": token, "content": "Benchmark reply %d" % i})
+            if response.status_code != 302:
+                errors.append(response.status_code)
+
+    clients = [threading.Thread(target=client_replies) for i in range(concurrency)]
+    start = perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = perf_counter() - start
+
+    if errors:
+        raise SystemExit("%d replies failed in the %s mode" % (len(errors), mode))
+
+    return concurrency * replies / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the replies per second of the direct and buffered write modes")
+    seed.add_size_arguments(parser)
+    parser.add_argument("--seed", action="store_true", help="replace the database contents with a generated forum first")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients posting replies")
+    parser.add_argument("--replies", type=int, default=50, help="replies posted by each client")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    app = seed.load_app()
+    from db import db
+    import migrate
+
+    # Every waiting request holds a connection, so the pool has to serve every client and the writer thread at once
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"pool_size": args.concurrency + 2}
+
+    with app.app_context():
+        engine = db.engine
+    if args.seed:
+        seed.reset_database(engine)
+        seed.seed(engine, args.sections, args.private_sections, args.users, args.threads, args.messages)
+        seed.rebuild_derived(app)
+        migrate.apply_migrations(engine)
+        seed.analyze(engine)
+
+    with engine.connect() as connection:
+        section, thread = connection.execute("SELECT section_id, id FROM threads WHERE visible AND section_id IN" \
+                                             " (SELECT id FROM sections WHERE NOT private) ORDER BY id LIMIT 1").fetchone()
+        username = connection.execute("SELECT username FROM users WHERE username LIKE 'user%%' ORDER BY id LIMIT 1").scalar()
+    threadUrl = "/section/%d/%d" % (section, thread)
+
+    results = {}
+    for mode in ("direct", "buffered"):
+        results[mode] = replies_per_second(app, mode, threadUrl, username, args.concurrency, args.replies)
+        print("%-10s %10.1f replies/s" % (mode, results[mode]))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"concurrency": args.concurrency, "replies_per_second": results}, output, indent=2)
@@ -0,0 +1,116 @@
+# Micro-benchmark of the edit history: the space taken by the earlier versions of edited posts as full copies, as compressed copies and as
+# the compressed deltas of revisions.py, the time an edit spends encoding its delta, and the time to rebuild the oldest version with the
+# chains of deltas as the edits leave them and after flask compact-revisions has rebased them.
+#
+#   python -m benchmarks.revision_benchmark --words 50,500,5000 --edits 100
+
+import argparse, json, random, zlib
+
+# For timing the encoding and the rebuilds
+from time import perf_counter
+
+import revisions
+
+
+# Words of the generated posts
+VOCABULARY = ["forum", "thread", "message", "reply", "section", "moderator", "the", "a", "of", "and", "is", "it", "fluffy", "Luna",
+              "really", "seems", "like", "what", "do", "you", "reckon", "new", "old", "edit", "post", "about", "this", "that"]
+
+
+# A post of the given number of words, with a line break every dozen words or so
+def generate_post(generator, words):
+
+    return "".join(generator.choice(VOCABULARY) + ("\n" if generator.random() < 0.08 else " ") for i in range(words))
+
+
+# An edit of a post replacing, adding or removing a few words at a random place
+def edit_post(generator, text):
+
+    tokens = revisions.TOKEN.findall(text)
+    position = generator.randrange(len(tokens) + 1)
+    removed = generator.randint(0, 3)
+    added = [generator.choice(VOCABULARY) + " " for i in range(generator.randint(0, 3))]
+
+    return "".join(tokens[:position] + added + tokens[position + removed:])
+
+
+# Rebuild the oldest version of a chain given newest first as the edit history of revisions does: from the nearest snapshot, or from the current text
+def rebuild_oldest(text, rows):
+
+    chain = []
+    for row in reversed(rows):
+        chain.append(row)
+        if row[1]:
+            break
+    for row_id, snapshot, data in reversed(chain):
+        text = revisions.decode(snapshot, data, text)
+
+    return text
+
+
+# Edit a post of the given length repeatedly, return the measurements of its history
+def measure_history(words, edits, max_chain, seed_value):
+
+    generator = random.Random(seed_value)
+    text = generate_post(generator, words)
+
+    fullSize = 0
+    compressedSize = 0
+    encodeTime = 0
+    rows = []
+    for i in range(edits):
+        newText = edit_post(generator, text)
+        fullSize += len(text.encode())
+        compressedSize += len(zlib.compress(text.encode()))
+        start = perf_counter()
+        snapshot, data = revisions.encode(newText, text)
+        encodeTime += perf_counter() - start
+        rows.insert(0, (i, snapshot, data))
+        text = newText
+
+    # The chain as left by the edits, then with the snapshots of the compaction in place
+    start = perf_counter()
+    oldest = rebuild_oldest(text, rows)
+    chainTime = perf_counter() - start
+
+    snapshots = dict(revisions.rebase_chain(text, rows, max_chain))
+    compacted = [(row_id, snapshot or row_id in snapshots, snapshots.get(row_id, data)) for row_id, snapshot, data in rows]
+    start = perf_counter()
+    compactedOldest = rebuild_oldest(text, compacted)
+    compactedTime = perf_counter() - start
+    assert compactedOldest == oldest
+
+    return {
+        "full_copies_bytes": fullSize,
+        "compressed_copies_bytes": compressedSize,
+        "deltas_bytes": sum(len(data) for row_id, snapshot, data in rows),
+        "compacted_bytes": sum(len(data) for row_id, snapshot, data in compacted),
+        "encode_ms": encodeTime / edits * 1000,
+        "oldest_ms": chainTime * 1000,
+        "oldest_compacted_ms": compactedTime * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the size of the edit history as full copies and as compressed deltas")
+    parser.add_argument("--words", default="50,500,5000", help="comma separated lengths of the posts in words")
+    parser.add_argument("--edits", type=int, default=100, help="edits of each post")
+    parser.add_argument("--max-chain", type=int, default=revisions.DEFAULT_MAX_CHAIN, help="deltas allowed by the compaction")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for words in [int(count) for count in args.words.split(",")]:
+        results[words] = measure_history(words, args.edits, args.max_chain, words)
+
+    print("%d edits of each post, compaction with --max-chain %d, sizes in KB" % (args.edits, args.max_chain))
+    print("%-7s %12s %12s %9s %11s %11s %13s %15s" % ("words", "full copies", "compressed", "deltas", "compacted", "encode (ms)",
+                                                     "oldest (ms)", "compacted (ms)"))
+    for words, result in results.items():
+        print("%-7d %12.1f %12.1f %9.1f %11.1f %11.2f %13.2f %15.2f" % (words, result["full_copies_bytes"] / 1024, result["compressed_copies_bytes"] / 1024,
+                                                                       result["deltas_bytes"] / 1024, result["compacted_bytes"] / 1024,
+                                                                       result["encode_ms"], result["oldest_ms"], result["oldest_compacted_ms"]))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"edits": args.edits, "max_chain": args.max_chain, "results": results}, output, indent=2)
@@ -0,0 +1,175 @@
+# Load and latency benchmark of the routes in routes.py, driven through the Flask test client.
+# Reports the throughput, the p50/p95/p99 latencies and the SQL statements per request of each route,
+# and saves them as JSON for comparison against an earlier run.
+#
+#   BENCHMARK_DATABASE_URL=postgresql:///forum_bench python -m benchmarks.routes_benchmark --seed --output run.json
+#   BENCHMARK_DATABASE_URL=postgresql:///forum_bench python -m benchmarks.routes_benchmark --baseline run.json
+
+import argparse, json, threading
+
+# For timing the requests
+from time import perf_counter, strftime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from benchmarks import seed
+
+
+# Number of SQL statements executed by each thread of the benchmark
+statementCounts = threading.local()
+
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    statementCounts.value = getattr(statementCounts, "value", 0) + 1
+
+
+# Value below which the given share of the sorted samples fall
+def percentile(samples, share):
+
+    index = min(len(samples) - 1, max(0, int(round(share * len(samples))) - 1))
+    return samples[index]
+
+
+# Log in a test client as the given user and return its CSRF token
+def log_in(client, username):
+
+    client.post("/login", data={"username": username, "password": seed.PASSWORD})
+    with client.session_transaction() as session:
+        return session["crsf_token"]
+
+
+# The requests of the benchmark as (name, logged in, function sending one request with a test client)
+def route_cases(engine):
+
+    with engine.connect() as connection:
+        section, thread = connection.execute("SELECT section_id, thread_id FROM messages M JOIN threads T ON T.id = M.thread_id" \
+                                             " JOIN sections S ON S.id = T.section_id WHERE NOT S.private" \
+                                             " GROUP BY section_id, thread_id ORDER BY count(*) DESC LIMIT 1").fetchone()
+        message, username = connection.execute("SELECT M.id, U.username FROM messages M JOIN users U ON U.id = M.user_id" \
+                                               " WHERE M.thread_id = %(thread)s AND M.visible ORDER BY M.id LIMIT 1", {"thread": thread}).fetchone()
+
+    base = "/section/%d/%d" % (section, thread)
+
+    return username, [
+        ("front page (anonymous)", False, lambda client, token: client.get("/")),
+        ("front page", True, lambda client, token: client.get("/")),
+        ("section (anonymous)", False, lambda client, token: client.get("/section/%d" % section)),
+        ("section", True, lambda client, token: client.get("/section/%d" % section)),
+        ("section, latest reply order", True, lambda client, token: client.get("/section/%d?sort=activity" % section)),
+        ("thread (anonymous)", False, lambda client, token: client.get(base)),
+        ("thread", True, lambda client, token: client.get(base)),
+        ("thread, newest page", True, lambda client, token: client.get(base + "?newest=1")),
+        ("search", True, lambda client, token: client.get("/result?query=message&prevURL=/")),
+        ("search, rare word", True, lambda client, token: client.get("/result?query=thread+42&prevURL=/")),
+        ("post reply", True, lambda client, token: client.post(base + "/post_reply", data={"crsf_token": token, "content": "Benchmark reply"})),
+        ("edit message", True, lambda client, token: client.post(base + "/%d/post_message_edit" % message,
+                                                                 data={"crsf_token": token, "content": "Benchmark edit"})),
+        ("login", False, lambda client, token: client.post("/login", data={"username": username, "password": seed.PASSWORD})),
+    ]
+
+
+# Send the requests of one route from the given number of concurrent clients, return the measurements
+def run_route(app, username, loggedIn, send, requests, concurrency):
+
+    latencies = []
+    statements = []
+    errors = []
+
+    def worker(count):
+        client = app.test_client()
+        token = log_in(client, username) if loggedIn else None
+        for i in range(count):
+            statementCounts.value = 0
+            start = perf_counter()
+            response = send(client, token)
+            # The streamed pages are rendered as they are read, and closing them ends their request in this thread
+            response.get_data()
+            response.close()
+            latencies.append(perf_counter() - start)
+            statements.append(statementCounts.value)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+
+    workers = [threading.Thread(target=worker, args=(requests // concurrency,)) for i in range(concurrency)]
+    start = perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "sql_per_request": sum(statements) / len(statements),
+    }
+
+
+# Print the measurements, along with the change against the baseline when one is given
+def report(results, baseline):
+
+    print("%-30s %10s %9s %9s %9s %8s" % ("route", "req/s", "p50 ms", "p95 ms", "p99 ms", "sql/req"))
+    for name, result in results.items():
+        print("%-30s %10.1f %9.2f %9.2f %9.2f %8.1f" % (name, result["throughput_rps"], result["p50_ms"], result["p95_ms"],
+                                                         result["p99_ms"], result["sql_per_request"]))
+        if baseline and name in baseline:
+            previous = baseline[name]
+            print("%-30s %+9.0f%% %+8.0f%% %+8.0f%% %+8.0f%% %+8.1f" % ("  vs. baseline",
+                  100 * (result["throughput_rps"] / previous["throughput_rps"] - 1), 100 * (result["p50_ms"] / previous["p50_ms"] - 1),
+                  100 * (result["p95_ms"] / previous["p95_ms"] - 1), 100 * (result["p99_ms"] / previous["p99_ms"] - 1),
+                  result["sql_per_request"] - previous["sql_per_request"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the routes of the forum against BENCHMARK_DATABASE_URL")
+    seed.add_size_arguments(parser)
+    parser.add_argument("--seed", action="store_true", help="replace the database contents with a generated forum first")
+    parser.add_argument("--requests", type=int, default=200, help="requests sent to each route")
+    parser.add_argument("--concurrency", type=int, default=1, help="concurrent clients per route")
+    parser.add_argument("--routes", help="comma separated names of the routes to run, all by default")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    app = seed.load_app()
+    from db import db
+    import migrate
+
+    with app.app_context():
+        engine = db.engine
+    if args.seed:
+        seed.reset_database(engine)
+        seed.seed(engine, args.sections, args.private_sections, args.users, args.threads, args.messages)
+        seed.rebuild_derived(app)
+        migrate.apply_migrations(engine)
+        seed.analyze(engine)
+
+    event.listen(Engine, "before_cursor_execute", count_statement)
+
+    username, cases = route_cases(engine)
+    selected = args.routes.split(",") if args.routes else None
+
+    results = {}
+    for name, loggedIn, send in cases:
+        if selected and name not in selected:
+            continue
+        # A few untimed requests warm up the connection pool and the template cache
+        run_route(app, username, loggedIn, send, min(10, args.requests), 1)
+        results[name] = run_route(app, username, loggedIn, send, args.requests, args.concurrency)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baselineFile:
+            baseline = json.load(baselineFile)["routes"]
+    report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"time": strftime("%Y-%m-%dT%H:%M:%S"), "requests": args.requests, "concurrency": args.concurrency,
+                       "routes": results}, output, indent=2)
@@ -0,0 +1,139 @@
+# For reading the benchmark database address
+from os import environ, getenv, path
+
+import argparse
+
+from sqlalchemy import text
+
+# For hashing the common password of the generated users
+from werkzeug.security import generate_password_hash
+
+
+# Schema of the forum, loaded into the emptied benchmark database
+SCHEMA_FILE = path.join(path.dirname(path.dirname(path.abspath(__file__))), "schema.sql")
+
+# Password of every generated user
+PASSWORD = "benchmark"
+
+
+# Import the application against the benchmark database given in BENCHMARK_DATABASE_URL.
+# A separate variable is used so that the production database is never wiped by accident
+def load_app():
+
+    url = getenv("BENCHMARK_DATABASE_URL")
+    if not url:
+        raise SystemExit("Set BENCHMARK_DATABASE_URL to a throwaway database, its contents will be replaced")
+
+    environ["DATABASE_URL"] = url
+    environ.setdefault("SECRET_KEY", "benchmark")
+    # The benchmark clients log in and post far faster than the rate limits allow
+    environ.setdefault("RATE_LIMITS", "")
+
+    from app import create_app
+
+    return create_app()
+
+
+# Drop everything in the database and create the tables from schema.sql
+def reset_database(engine):
+
+    with engine.begin() as connection:
+        cursor = connection.connection.cursor()
+        cursor.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+        with open(SCHEMA_FILE) as schema:
+            cursor.execute(schema.read())
+
+
+# Fill the database with a generated forum of the given size. The rows are inserted with set-based statements,
+# and the authors, sections and threads are drawn from skewed distributions, so that a few of them get most of the posts
+def seed(engine, sections=20, private_sections=5, users=1000, threads=20000, messages=1000000, seed_value=0.42):
+
+    params = {"sections": sections, "private": private_sections, "users": users, "threads": threads, "messages": messages,
+              "password": generate_password_hash(PASSWORD)}
+
+    with engine.begin() as connection:
+        # The random numbers of this connection are repeatable
+        connection.execute(text("SELECT setseed(:seed)"), {"seed": seed_value})
+
+        sql = "INSERT INTO users (username, password) SELECT 'user' || i, :password FROM generate_series(1, :users) i"
+        connection.execute(text(sql), params)
+        params["user_base"] = connection.execute("SELECT min(id) FROM users WHERE username LIKE 'user%%'").scalar()
+
+        sql = "INSERT INTO sections (section_name, private) SELECT 'Section ' || i, i <= :private FROM generate_series(1, :sections) i"
+        connection.execute(text(sql), params)
+        params["section_base"] = connection.execute("SELECT min(id) FROM sections WHERE section_name LIKE 'Section %%'").scalar()
+
+        # Every tenth user has access to each private section
+        sql = "INSERT INTO user_privileges (user_id, section_id) SELECT U.id, S.id FROM sections S JOIN users U ON U.id % 10 = S.id % 10" \
+        " WHERE S.private AND S.id >= :section_base AND U.id >= :user_base"
+        connection.execute(text(sql), params)
+
+        sql = "INSERT INTO threads (posting_time, user_id, section_id, thread_name, content)" \
+        " SELECT NOW() - random() * interval '365 days', :user_base + floor(:users * power(random(), 2))," \
+        " :section_base + floor(:sections * power(random(), 2)), 'Thread ' || i, 'Opening message of thread ' || i" \
+        " FROM generate_series(1, :threads) i"
+        connection.execute(text(sql), params)
+        params["thread_base"] = connection.execute("SELECT min(id) FROM threads WHERE thread_name LIKE 'Thread %%'").scalar()
+
+        # A small share of the messages is deleted
+        sql = "INSERT INTO messages (posting_time, user_id, thread_id, content, visible)" \
+        " SELECT T.posting_time + random() * interval '30 days', :user_base + floor(:users * power(random(), 2)), T.id," \
+        " 'Message ' || G.i || ' about ' || md5(G.i::text), random() > 0.05" \
+        " FROM (SELECT i, :thread_base + floor(:threads * power(random(), 3))::integer AS thread_id FROM generate_series(1, :messages) i) G" \
+        " JOIN threads T ON T.id = G.thread_id"
+        connection.execute(text(sql), params)
+
+        connection.execute("UPDATE threads SET last_activity = posting_time")
+        connection.execute("UPDATE threads T SET last_activity = A.latest FROM (SELECT thread_id, max(posting_time) AS latest" \
+                           " FROM messages GROUP BY thread_id) A WHERE A.thread_id = T.id")
+
+
+# Recompute the access sets of the users, the section statistics and the search index of the seeded forum
+def rebuild_derived(app, search_index=True):
+
+    import forum, search, users
+
+    with app.app_context():
+        users.rebuild_section_access()
+        forum.rebuild_section_stats()
+        if search_index:
+            search.reindex()
+
+
+# Run VACUUM ANALYZE, so that the measurements are not skewed by missing planner statistics
+def analyze(engine):
+
+    with engine.connect() as connection:
+        connection.execution_options(isolation_level="AUTOCOMMIT").execute("VACUUM ANALYZE")
+
+
+# Command line options shared by the benchmarks for the size of the seeded forum
+def add_size_arguments(parser):
+
+    parser.add_argument("--sections", type=int, default=20)
+    parser.add_argument("--private-sections", type=int, default=5)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=20000)
+    parser.add_argument("--messages", type=int, default=1000000)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replace the contents of BENCHMARK_DATABASE_URL with a generated forum")
+    add_size_arguments(parser)
+    parser.add_argument("--no-search-index", action="store_true", help="leave the search index empty")
+    parser.add_argument("--migrate", action="store_true", help="apply the migrations after seeding")
+    args = parser.parse_args()
+
+    app = load_app()
+    from db import db
+    import migrate
+
+    with app.app_context():
+        engine = db.engine
+    reset_database(engine)
+    seed(engine, args.sections, args.private_sections, args.users, args.threads, args.messages)
+    rebuild_derived(app, not args.no_search_index)
+    if args.migrate:
+        migrate.apply_migrations(engine)
+    analyze(engine)
+    print("Seeded %d sections, %d users, %d threads and %d messages" % (args.sections, args.users, args.threads, args.messages))
@@ -0,0 +1,249 @@
+# Benchmark of the sync and gevent gunicorn workers under concurrent load.
+# Starts gunicorn with each worker class against BENCHMARK_DATABASE_URL, sends the page requests of logged in users
+# over HTTP from concurrent clients, and reports the throughput, the latency percentiles and the most database connections in use.
+# The database round trips can be slowed down by a local proxy, to stand in for a database on another host.
+#
+#   BENCHMARK_DATABASE_URL=postgresql:///forum_bench python -m benchmarks.serving_benchmark --seed --concurrency 64 --latency-ms 2
+
+import argparse, json, threading, multiprocessing, subprocess, socket, asyncio, sys
+
+# For talking to the server like a browser would
+import http.client
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from os import environ, path
+
+# For timing the requests
+from time import perf_counter, sleep
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+
+from benchmarks import seed
+from benchmarks.routes_benchmark import percentile
+
+
+# Folder of the app, where gunicorn is started
+APP_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+
+WORKER_CLASSES = ["sync", "gevent"]
+
+# Settings of the server. The admission control is off, as it would shed the searches under the load of the gevent workers
+# and the comparison would be of the requests refused rather than served; admission_benchmark measures it
+SETTINGS = {"ADMISSION_MAX_CONCURRENCY": "0"}
+
+
+# Forward the connections of the local port to the database, delaying each packet sent to the database by the given time.
+# Every statement then waits for the latency once, as it would with the database on another host
+def run_latency_proxy(localPort, host, port, latency):
+
+    async def pipe(reader, writer, delay):
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                if delay:
+                    await asyncio.sleep(delay)
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def connect(clientReader, clientWriter):
+        serverReader, serverWriter = await asyncio.open_connection(host, port)
+        await asyncio.gather(pipe(clientReader, serverWriter, latency), pipe(serverReader, clientWriter, 0))
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(asyncio.start_server(connect, "127.0.0.1", localPort))
+    loop.run_forever()
+
+
+# A free local port
+def free_port():
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+# Start the latency proxy in a process of its own, so that the client threads of the benchmark do not delay it further. Returns the local port
+def start_latency_proxy(host, port, latency):
+
+    localPort = free_port()
+    multiprocessing.Process(target=run_latency_proxy, args=(localPort, host, port, latency), daemon=True).start()
+    for i in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", localPort)).close()
+            break
+        except OSError:
+            sleep(0.05)
+
+    return localPort
+
+
+# Start gunicorn with the worker class and any further settings on a free port and wait until it answers.
+# Returns the process, the port and the seconds from starting gunicorn to its first response
+def start_server(workerClass, databaseUrl, workers, settings={}):
+
+    port = free_port()
+    start = perf_counter()
+    env = dict(environ, DATABASE_URL=databaseUrl, SECRET_KEY="benchmark", GUNICORN_WORKER_CLASS=workerClass, WEB_CONCURRENCY=str(workers), **settings)
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", "127.0.0.1:%d" % port, "app:create_app()"],
+                               cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    for i in range(1000):
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("GET", "/")
+            connection.getresponse().read()
+            return process, port, perf_counter() - start
+        except OSError:
+            sleep(0.01)
+
+    process.kill()
+    raise SystemExit("gunicorn with %s workers did not start" % workerClass)
+
+
+# Log a client in over HTTP, return its session cookie
+def log_in(port, username):
+
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    body = urlencode({"username": username, "password": seed.PASSWORD})
+    connection.request("POST", "/login", body, {"Content-Type": "application/x-www-form-urlencoded"})
+    response = connection.getresponse()
+    response.read()
+    cookie = SimpleCookie(response.getheader("Set-Cookie"))
+
+    return "session=" + cookie["session"].value
+
+
+# The highest number of client connections to the benchmark database seen while the event is not set
+def watch_connections(engine, done, peak):
+
+    with engine.connect() as connection:
+        while not done.is_set():
+            count = connection.execute("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()" \
+                                       " AND backend_type = 'client backend' AND pid <> pg_backend_pid()").scalar()
+            peak[0] = max(peak[0], count)
+            sleep(0.1)
+
+
+# Send the page requests from concurrent clients for the given time, return the measurements
+def run_load(port, username, paths, concurrency, seconds, engine):
+
+    latencies = []
+    errors = []
+    shed = []
+    cookies = [log_in(port, username) for i in range(concurrency)]
+
+    def client(cookie):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        i = 0
+        while perf_counter() < deadline:
+            start = perf_counter()
+            try:
+                connection.request("GET", paths[i % len(paths)], headers={"Cookie": cookie})
+                response = connection.getresponse()
+                response.read()
+                if response.status == 503:
+                    shed.append(response.status)
+                elif response.status >= 400:
+                    errors.append(response.status)
+            except (OSError, http.client.HTTPException):
+                errors.append(None)
+                connection.close()
+            latencies.append(perf_counter() - start)
+            i += 1
+
+    done = threading.Event()
+    peak = [0]
+    watcher = threading.Thread(target=watch_connections, args=(engine, done, peak))
+    watcher.start()
+
+    clients = [threading.Thread(target=client, args=(cookie,)) for cookie in cookies]
+    start = perf_counter()
+    deadline = start + seconds
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = perf_counter() - start
+    done.set()
+    watcher.join()
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "shed": len(shed),
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "peak_db_connections": peak[0],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the sync and gevent gunicorn workers under concurrent page requests")
+    seed.add_size_arguments(parser)
+    parser.add_argument("--seed", action="store_true", help="replace the database contents with a generated forum first")
+    parser.add_argument("--concurrency", type=int, default=64, help="concurrent clients sending requests")
+    parser.add_argument("--seconds", type=float, default=20, help="duration of the load for each worker class")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--latency-ms", type=float, default=0, help="delay added to every database round trip")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    app = seed.load_app()
+    from db import db
+    import migrate
+
+    with app.app_context():
+        engine = db.engine
+    if args.seed:
+        seed.reset_database(engine)
+        seed.seed(engine, args.sections, args.private_sections, args.users, args.threads, args.messages)
+        seed.rebuild_derived(app)
+        migrate.apply_migrations(engine)
+        seed.analyze(engine)
+
+    with engine.connect() as connection:
+        section, thread = connection.execute("SELECT section_id, thread_id FROM messages M JOIN threads T ON T.id = M.thread_id" \
+                                             " JOIN sections S ON S.id = T.section_id WHERE NOT S.private" \
+                                             " GROUP BY section_id, thread_id ORDER BY count(*) DESC LIMIT 1").fetchone()
+        username = connection.execute("SELECT username FROM users WHERE username LIKE 'user%%' ORDER BY id LIMIT 1").scalar()
+    paths = ["/", "/section/%d" % section, "/section/%d/%d" % (section, thread), "/section/%d/%d?newest=1" % (section, thread),
+             "/result?query=thread+42&prevURL=/"]
+
+    databaseUrl = make_url(environ["DATABASE_URL"])
+    if args.latency_ms:
+        proxyPort = start_latency_proxy(databaseUrl.host or "localhost", databaseUrl.port or 5432, args.latency_ms / 1000)
+        databaseUrl.host = "127.0.0.1"
+        databaseUrl.port = proxyPort
+
+    watchEngine = create_engine(environ["DATABASE_URL"])
+    results = {}
+    for workerClass in WORKER_CLASSES:
+        process, port, startup = start_server(workerClass, str(databaseUrl), args.workers, SETTINGS)
+        try:
+            results[workerClass] = run_load(port, username, paths, args.concurrency, args.seconds, watchEngine)
+            results[workerClass]["startup_s"] = startup
+        finally:
+            process.terminate()
+            process.wait()
+
+    print("%d clients, %d workers, %.1f ms added to each database round trip" % (args.concurrency, args.workers, args.latency_ms))
+    print("%-8s %10s %10s %10s %10s %8s %8s %14s %10s" % ("workers", "req/s", "p50 (ms)", "p95 (ms)", "p99 (ms)", "errors", "shed", "db connections", "start (s)"))
+    for workerClass, result in results.items():
+        print("%-8s %10.1f %10.1f %10.1f %10.1f %8d %8d %14d %10.2f" % (workerClass, result["throughput_rps"], result["p50_ms"], result["p95_ms"],
+                                                                        result["p99_ms"], result["errors"], result["shed"], result["peak_db_connections"],
+                                                                        result["startup_s"]))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"size": vars(args), "results": results}, output, indent=2)
@@ -0,0 +1,138 @@
+# Startup benchmark of a worker: the time to import the app, create it and warm it up, and the latency of the first requests
+# and of the later ones, cold (no warm-up, no prepared statements), with the warm-up, and with the warm-up and the prepared statements.
+# Each start is measured in a fresh Python process against BENCHMARK_DATABASE_URL, as a worker starting after a dyno has slept.
+#
+#   BENCHMARK_DATABASE_URL=postgresql:///forum_bench python -m benchmarks.startup_benchmark --seed --runs 5
+
+import argparse, json, subprocess, sys
+
+from os import environ
+
+# For timing the start and the requests
+from time import perf_counter
+from statistics import median
+
+
+# Settings of each startup mode
+MODES = {
+    "cold": {"WARM_UP": "0", "PREPARED_STATEMENTS": "0"},
+    "warm-up": {"WARM_UP": "1", "PREPARED_STATEMENTS": "0"},
+    "warm-up + prepared": {"WARM_UP": "1", "PREPARED_STATEMENTS": "1"},
+}
+
+
+# Start the app in this process as a gunicorn worker would and send the requests of a logged in user: once each right after the start,
+# then the given number of times more. Prints the measurements in milliseconds as JSON
+def measure_start(username, paths, repeat):
+
+    start = perf_counter()
+    from app import create_app
+    importTime = perf_counter() - start
+
+    start = perf_counter()
+    app = create_app()
+    createTime = perf_counter() - start
+
+    warmup = {"templates": 0, "statements": 0, "pool": 0}
+    if app.config["WARM_UP"]:
+        import warmup as warmupModule
+        warmup = warmupModule.warm_up(app)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["username"] = username
+
+    first = {}
+    for path in paths:
+        start = perf_counter()
+        client.get(path).get_data()
+        first[path] = (perf_counter() - start) * 1000
+
+    later = {path: [] for path in paths}
+    for i in range(repeat):
+        for path in paths:
+            start = perf_counter()
+            client.get(path).get_data()
+            later[path].append((perf_counter() - start) * 1000)
+
+    json.dump({"import": importTime * 1000, "create_app": createTime * 1000, "warmup": warmup, "first": first,
+               "later": {path: median(times) for path, times in later.items()}}, sys.stdout)
+
+
+# Run a start in a fresh Python process with the settings of the mode, return its measurements
+def run_start(mode, username, paths, repeat):
+
+    env = dict(environ, DATABASE_URL=environ["BENCHMARK_DATABASE_URL"], SECRET_KEY="benchmark", PAGE_CACHE_MAX_BYTES="0", **MODES[mode])
+    output = subprocess.run([sys.executable, "-m", "benchmarks.startup_benchmark", "--child", json.dumps([username, paths, repeat])],
+                            env=env, stdout=subprocess.PIPE, check=True).stdout
+
+    return json.loads(output)
+
+
+# Median of each measurement over the starts
+def summarise(starts, paths):
+
+    return {
+        "import": median(start["import"] for start in starts),
+        "create_app": median(start["create_app"] for start in starts),
+        "warmup": {phase: median(start["warmup"][phase] for start in starts) for phase in ("templates", "statements", "pool")},
+        "first": {path: median(start["first"][path] for start in starts) for path in paths},
+        "later": {path: median(start["later"][path] for start in starts) for path in paths},
+    }
+
+
+if __name__ == "__main__":
+    # A start measured in this process, before anything of the app or its libraries is imported
+    if sys.argv[1:2] == ["--child"]:
+        measure_start(*json.loads(sys.argv[2]))
+        raise SystemExit(0)
+
+    from benchmarks import seed
+
+    parser = argparse.ArgumentParser(description="Time the start of a worker and its first requests with and without the warm-up")
+    parser.add_argument("--seed", action="store_true", help="replace the database contents with a generated forum first")
+    parser.add_argument("--runs", type=int, default=5, help="starts measured for each mode")
+    parser.add_argument("--repeat", type=int, default=50, help="requests of each page after the first one")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    seed.add_size_arguments(parser)
+    args = parser.parse_args()
+
+    app = seed.load_app()
+    from db import db
+    import migrate
+
+    with app.app_context():
+        engine = db.engine
+    if args.seed:
+        seed.reset_database(engine)
+        seed.seed(engine, args.sections, args.private_sections, args.users, args.threads, args.messages)
+        seed.rebuild_derived(app)
+        migrate.apply_migrations(engine)
+        seed.analyze(engine)
+
+    with engine.connect() as connection:
+        section, thread = connection.execute("SELECT section_id, thread_id FROM messages M JOIN threads T ON T.id = M.thread_id" \
+                                             " JOIN sections S ON S.id = T.section_id WHERE NOT S.private" \
+                                             " GROUP BY section_id, thread_id ORDER BY count(*) DESC LIMIT 1").fetchone()
+        username = connection.execute("SELECT username FROM users WHERE username LIKE 'user%%' ORDER BY id LIMIT 1").scalar()
+    paths = ["/", "/section/%d" % section, "/section/%d/%d" % (section, thread), "/section/%d/%d?newest=1" % (section, thread)]
+
+    results = {mode: summarise([run_start(mode, username, paths, args.repeat) for i in range(args.runs)], paths) for mode in MODES}
+
+    print("Median of %d starts, times in ms" % args.runs)
+    print("%-20s %8s %11s %10s %11s %8s %8s" % ("mode", "import", "create_app", "templates", "statements", "pool", "ready"))
+    for mode, result in results.items():
+        warmup = result["warmup"]
+        ready = result["import"] + result["create_app"] + sum(warmup.values())
+        print("%-20s %8.1f %11.1f %10.1f %11.1f %8.1f %8.1f" % (mode, result["import"], result["create_app"], warmup["templates"],
+                                                               warmup["statements"], warmup["pool"], ready))
+
+    print()
+    print("%-36s %-20s %12s %12s" % ("page", "mode", "first (ms)", "later (ms)"))
+    for path in paths:
+        for mode, result in results.items():
+            print("%-36s %-20s %12.2f %12.2f" % (path, mode, result["first"][path], result["later"][path]))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump({"runs": args.runs, "repeat": args.repeat, "results": results}, output, indent=2)
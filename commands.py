@@ -0,0 +1,165 @@
+from db import db
+
+import forum, search, users, migrate, transfer, archive, partition, rendering, revisions
+
+# For printing the command output and setting the exit status
+import click
+
+from flask import Blueprint, current_app
+
+
+# The flask commands, registered on the application by create_app without a group of their own
+blueprint = Blueprint("commands", __name__, cli_group=None)
+
+
+# Recompute the statistics of every section and the message counts of the threads from the threads and messages
+@blueprint.cli.command("rebuild-stats")
+def rebuild_stats():
+
+    forum.rebuild_section_stats()
+    click.echo("Section statistics rebuilt")
+
+
+# Check that the stored statistics of every section and the message counts of the threads match the threads and messages
+@blueprint.cli.command("verify-stats")
+def verify_stats():
+
+    mismatches = forum.verify_section_stats()
+    for mismatch in mismatches:
+        click.echo("Section %s: %s/%s threads, %s/%s messages (stored/actual)" % (mismatch.section_id,
+                   mismatch.stored_threads, mismatch.actual_threads, mismatch.stored_messages, mismatch.actual_messages))
+    threadMismatches = forum.verify_thread_counts()
+    for mismatch in threadMismatches:
+        click.echo("Thread %s: %s/%s messages (stored/actual)" % (mismatch.thread_id, mismatch.stored_messages, mismatch.actual_messages))
+
+    if mismatches or threadMismatches:
+        raise SystemExit(1)
+    click.echo("Section statistics are up to date")
+
+
+# Rebuild the search index from all the threads and messages
+@blueprint.cli.command("reindex-search")
+def reindex_search():
+
+    threadCount, messageCount = search.reindex()
+    click.echo("Indexed %d threads and %d messages" % (threadCount, messageCount))
+
+
+# Compile the templates into TEMPLATE_CACHE_DIR, run when the app is built so that the workers start with compiled templates
+@blueprint.cli.command("compile-templates")
+def compile_templates():
+
+    if not current_app.jinja_env.bytecode_cache:
+        raise click.ClickException("TEMPLATE_CACHE_DIR is not set")
+    templateCount = rendering.compile_templates(current_app)
+    click.echo("Compiled %d templates into %s" % (templateCount, current_app.config["TEMPLATE_CACHE_DIR"]))
+
+
+# Apply the database migrations that have not been applied yet
+@blueprint.cli.command("migrate")
+def migrate_database():
+
+    applied = migrate.apply_migrations(db.engine)
+    for version, name in applied:
+        click.echo("Applied migration %03d %s" % (version, name))
+
+    click.echo("Database schema is at version %d" % migrate.current_version(db.engine))
+
+
+# Export the users, sections, privileges, threads and messages, along with the archived ones and the edit history, into a directory as JSON lines or CSV files
+@blueprint.cli.command("export")
+@click.argument("directory")
+@click.option("--format", "fileFormat", type=click.Choice(transfer.FORMATS), default="jsonl")
+def export_forum(directory, fileFormat):
+
+    counts = transfer.export_forum(db.engine, directory, fileFormat)
+    for table, rowCount in counts.items():
+        click.echo("Exported %d rows of %s" % (rowCount, table))
+
+
+# Import a directory written by the export command, then rebuild the access sets of the users, the section statistics and the search index
+@blueprint.cli.command("import")
+@click.argument("directory")
+@click.option("--replace", is_flag=True, help="Delete the current contents of the forum first")
+def import_forum(directory, replace):
+
+    try:
+        counts = transfer.import_forum(db.engine, directory, replace)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    for table, rowCount in counts.items():
+        click.echo("Imported %d rows of %s" % (rowCount, table))
+
+    users.rebuild_section_access()
+    forum.rebuild_section_stats()
+    threadCount, messageCount = search.reindex()
+    click.echo("Indexed %d threads and %d messages" % (threadCount, messageCount))
+
+
+# Move the deleted threads and messages, and optionally the threads without replies for a number of months, into the archive tables.
+# Prints the size and full scan time of the tables before and after
+@blueprint.cli.command("archive")
+@click.option("--cold-months", type=int, help="Also archive the threads with no activity for this many months")
+@click.option("--batch-size", type=int, default=1000, help="Rows moved in each transaction")
+@click.option("--vacuum", is_flag=True, help="Vacuum the tables afterwards, so that the report shows the space freed for reuse")
+def archive_rows(cold_months, batch_size, vacuum):
+
+    before = archive.measure(db.engine)
+
+    threadCount, messageCount, size = archive.archive_threads(db.engine, "visible=false", {}, batch_size)
+    click.echo("Archived %d deleted threads with %d messages" % (threadCount, messageCount))
+    deletedMessages, deletedSize = archive.archive_messages(db.engine, batch_size)
+    click.echo("Archived %d deleted messages" % deletedMessages)
+    size += deletedSize
+    if cold_months:
+        condition = "visible=true AND last_activity < NOW() - make_interval(months => :months)"
+        threadCount, messageCount, coldSize = archive.archive_threads(db.engine, condition, {"months": cold_months}, batch_size)
+        click.echo("Archived %d threads with no activity in %d months, with %d messages" % (threadCount, cold_months, messageCount))
+        size += coldSize
+    click.echo("Moved %.1f MB of rows" % (size / 1024 / 1024))
+
+    if vacuum:
+        archive.vacuum(db.engine)
+    after = archive.measure(db.engine)
+
+    click.echo("%-18s %14s %14s %12s %12s" % ("table", "before (MB)", "after (MB)", "scan before", "scan after"))
+    for table in archive.REPORT_TABLES:
+        click.echo("%-18s %14.1f %14.1f %10.1fms %10.1fms" % (table, before[table][0] / 1024 / 1024, after[table][0] / 1024 / 1024,
+                                                             before[table][1], after[table][1]))
+
+
+# Replace the messages table with one partitioned by the month of the posting time. Posting waits while the messages are copied
+@blueprint.cli.command("partition-messages")
+@click.option("--months-ahead", type=int, default=3, help="Create the partitions for this many months after the current one")
+def partition_messages(months_ahead):
+
+    try:
+        messageCount = partition.partition_messages(db.engine, months_ahead)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    click.echo("Moved %d messages into the partitioned table" % messageCount)
+
+
+# Create the missing monthly partitions of the messages table up to a number of months ahead. Meant to be run daily by a scheduler
+@blueprint.cli.command("create-partitions")
+@click.option("--months-ahead", type=int, default=3, help="Create the partitions for this many months after the current one")
+def create_partitions(months_ahead):
+
+    try:
+        created = partition.create_future_partitions(db.engine, months_ahead)
+    except ValueError as error:
+        raise click.ClickException(str(error))
+    for name in created:
+        click.echo("Created partition %s" % name)
+    click.echo("Partitions exist up to %d months ahead" % months_ahead)
+
+
+# Rebase the long chains of deltas in the edit history onto snapshots, so that showing any version applies at most --max-chain deltas.
+# Meant to be run daily by a scheduler
+@blueprint.cli.command("compact-revisions")
+@click.option("--max-chain", type=click.IntRange(0), default=revisions.DEFAULT_MAX_CHAIN, help="Deltas allowed between a version and the current text or a snapshot")
+def compact_revisions(max_chain):
+
+    postCount, snapshotCount, sizeBefore, sizeAfter = revisions.compact(db.engine, max_chain)
+    click.echo("Rebased the edit history of %d posts with %d snapshots" % (postCount, snapshotCount))
+    click.echo("Revision data: %.1f KB before, %.1f KB after" % (sizeBefore / 1024, sizeAfter / 1024))
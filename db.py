@@ -1,7 +1,192 @@
-from app import app
 from flask_sqlalchemy import SQLAlchemy
+from flask import g, session, current_app, has_app_context, has_request_context
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
 from os import getenv
+import random, re, threading, time
 
-app.config["SQLALCHEMY_DATABASE_URI"] = getenv("DATABASE_URL")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-db = SQLAlchemy(app)
+db = SQLAlchemy()
+
+# Named parameters of a statement, matched as text() matches them
+PARAMETER = re.compile(r"(?<![:\w\\]):(\w+)(?!:)")
+
+# Statements run as prepared statements in this worker process, as {sql: (name, statement with numbered parameters, EXECUTE statement)}
+preparedStatements = {}
+preparedLock = threading.Lock()
+
+
+# Read the database settings, and register the commit at the end of each request and the listeners of the connections
+def init_app(app):
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = getenv("DATABASE_URL")
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # Connection pools of the primary database and of each replica: connections kept open, connections opened beyond them at busy times,
+    # and the seconds a request waits for one. Together they bound the connections of a worker process however many requests it serves at once.
+    # The most recently used connection is handed out first, so that a quiet worker keeps to the connections whose database caches are warm
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"pool_size": int(getenv("DATABASE_POOL_SIZE", "5")),
+                                               "max_overflow": int(getenv("DATABASE_MAX_OVERFLOW", "10")),
+                                               "pool_timeout": float(getenv("DATABASE_POOL_TIMEOUT", "30")),
+                                               "pool_use_lifo": True}
+    app.config["DATABASE_REPLICA_POOL_SIZE"] = int(getenv("DATABASE_REPLICA_POOL_SIZE", "5"))
+    app.config["DATABASE_REPLICA_MAX_OVERFLOW"] = int(getenv("DATABASE_REPLICA_MAX_OVERFLOW", "10"))
+    app.config["DATABASE_REPLICA_POOL_TIMEOUT"] = float(getenv("DATABASE_REPLICA_POOL_TIMEOUT", "30"))
+    # Comma separated read replicas of the primary database. The read-only page queries are spread over them,
+    # except for the user who has written to the primary within the last DATABASE_REPLICA_STICKY_SECONDS, so that they see their own posts
+    app.config["DATABASE_REPLICA_URLS"] = [url.strip() for url in getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+    app.config["DATABASE_REPLICA_STICKY_SECONDS"] = float(getenv("DATABASE_REPLICA_STICKY_SECONDS", "5"))
+    db.init_app(app)
+
+    # The replicas refuse writes, so a write sent to one by mistake fails instead of going missing
+    app.extensions["replicas"] = [create_engine(url, pool_size=app.config["DATABASE_REPLICA_POOL_SIZE"], max_overflow=app.config["DATABASE_REPLICA_MAX_OVERFLOW"],
+                                                pool_timeout=app.config["DATABASE_REPLICA_POOL_TIMEOUT"], pool_use_lifo=True,
+                                                connect_args={"options": "-c default_transaction_read_only=on"})
+                                  for url in app.config["DATABASE_REPLICA_URLS"]]
+
+    app.after_request(commit_request)
+    app.teardown_request(rollback_request)
+    # With replicas, every statement other than a query sent to the primary marks the request as a writer
+    if app.extensions["replicas"] and not event.contains(Engine, "before_cursor_execute", detect_write):
+        event.listen(Engine, "before_cursor_execute", detect_write)
+    # New connections prepare the statements already prepared on the others
+    if app.config["PREPARED_STATEMENTS"] and not event.contains(Pool, "connect", prepare_statements):
+        event.listen(Pool, "connect", prepare_statements)
+
+
+# Note that the current request has written to the primary, its later reads and those of the same user within the sticky window stay there
+def wrote_primary():
+
+    if has_request_context():
+        g.wrote_primary = True
+
+
+# Engine for the read-only queries of the current request, None for the primary
+def read_bind():
+
+    if not has_request_context() or not current_app.extensions["replicas"]:
+        return None
+    if g.get("wrote_primary") or session.get("primary_until", 0) > time.time():
+        return None
+    if "replica" not in g:
+        g.replica = random.choice(current_app.extensions["replicas"])
+
+    return g.replica
+
+
+# Execute a read-only query on a replica if one can be used, otherwise on the primary
+def read(sql, params={}):
+
+    return db.session.execute(sql, params, bind=read_bind())
+
+
+# Execute a read-only query of the hot path as a prepared statement on a replica if one can be used, otherwise on the primary
+def read_prepared(sql, params={}):
+
+    return execute_prepared(sql, params, bind=read_bind())
+
+
+# Execute a read-only query as a server-side prepared statement of its connection, so that the database parses and plans it once
+# per connection instead of on every call. The connections opened later prepare it when they connect, the open ones when they first run it
+def execute_prepared(sql, params={}, bind=None):
+
+    if not current_app.config["PREPARED_STATEMENTS"]:
+        return db.session.execute(sql, params, bind=bind)
+
+    prepared = preparedStatements.get(sql)
+    if prepared is None:
+        prepared = prepare(sql)
+    name, statement, execute = prepared
+
+    connection = db.session.connection(bind=bind)
+    preparedNames = connection.connection.info.setdefault("prepared", set())
+    if not name in preparedNames:
+        cursor = connection.connection.cursor()
+        cursor.execute("PREPARE " + name + " AS " + statement)
+        cursor.close()
+        preparedNames.add(name)
+
+    return connection.execute(execute, params)
+
+
+# Name the statement and number its parameters for PREPARE, and form the EXECUTE statement passing them in order
+def prepare(sql):
+
+    names = []
+
+    def number(match):
+        if not match.group(1) in names:
+            names.append(match.group(1))
+        return "$%d" % (names.index(match.group(1)) + 1)
+
+    statement = PARAMETER.sub(number, sql)
+    with preparedLock:
+        if not sql in preparedStatements:
+            name = "forum_%d" % len(preparedStatements)
+            execute = "EXECUTE " + name + ("(" + ", ".join(":" + parameter for parameter in names) + ")" if names else "")
+            preparedStatements[sql] = (name, statement, text(execute))
+
+    return preparedStatements[sql]
+
+
+# Prepare the statements known to the worker process on a new connection, before it is used
+def prepare_statements(dbapiConnection, connectionRecord):
+
+    preparedNames = connectionRecord.info.setdefault("prepared", set())
+    cursor = dbapiConnection.cursor()
+    for name, statement, execute in list(preparedStatements.values()):
+        try:
+            cursor.execute("PREPARE " + name + " AS " + statement)
+            preparedNames.add(name)
+        except dbapiConnection.Error:
+            # Left to be prepared when it is first run, where the error is reported
+            dbapiConnection.rollback()
+    cursor.close()
+    dbapiConnection.rollback()
+
+
+# Run the callback once the transaction of the current request or task has been committed with commit_session,
+# or right away outside of the application context
+def after_commit(callback):
+
+    if has_app_context():
+        g.setdefault("after_commit", []).append(callback)
+    else:
+        callback()
+
+
+# Commit the session and run the callbacks waiting for the commit
+def commit_session():
+
+    db.session.commit()
+    for callback in g.pop("after_commit", []):
+        callback()
+
+
+# The data functions do not commit: all the writes of a request are committed in a single transaction at its end,
+# and rolled back if the request fails
+def commit_request(response):
+
+    if response.status_code >= 400:
+        db.session.rollback()
+        g.pop("after_commit", None)
+    else:
+        commit_session()
+        if g.get("wrote_primary"):
+            session["primary_until"] = time.time() + current_app.config["DATABASE_REPLICA_STICKY_SECONDS"]
+
+    return response
+
+
+def rollback_request(exception):
+
+    if exception is not None:
+        db.session.rollback()
+
+
+# Mark the request as a writer when it sends a statement other than a query to the primary.
+# Only queries are prepared, so running a prepared statement is a query too
+def detect_write(conn, cursor, statement, parameters, context, executemany):
+
+    if has_request_context() and conn.engine not in current_app.extensions["replicas"] and \
+            statement.lstrip()[:6].upper() != "SELECT" and statement.lstrip()[:7].upper() != "EXECUTE":
+        wrote_primary()
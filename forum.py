@@ -1,8 +1,45 @@
-from db import db
+from db import db, read_prepared, read_bind, wrote_primary
 
-import users
+import users, search, pagecache, writequeue, live, revisions
 
-from flask import session
+# For executing queries through a server-side cursor
+from sqlalchemy import text
+
+from flask import session, current_app
+
+# For parsing the pagination cursors
+from datetime import datetime
+
+
+# Columns by which the threads of a section can be ordered
+THREAD_SORT_KEYS = {"newest": "posting_time", "activity": "last_activity"}
+
+
+# Column of a time stamp formatted for display, so that the pages do not format it in Python for every row
+def display_time(column, name):
+
+    return "to_char(" + column + ", 'YYYY-MM-DD HH24:MI:SS') AS " + name
+
+
+# --- PAGINATION ---
+
+# Form a pagination cursor out of a time stamp and a row identifier
+def encode_cursor(time, row_id):
+
+    return time.isoformat() + "_" + str(row_id)
+
+
+# Parse a pagination cursor back into a time stamp and a row identifier, None if it is malformed
+def decode_cursor(cursor):
+
+    if not cursor:
+        return None
+
+    try:
+        time, row_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(time), int(row_id)
+    except ValueError:
+        return None
 
 # --- SECTIONS ---
 
@@ -11,45 +48,85 @@ def create_section(section_name, make_private):
 
     sql = "INSERT INTO sections (section_name, private) VALUES (:section_name, :make_private) RETURNING id"
     result = db.session.execute(sql, {"section_name": section_name, "make_private": make_private})
-    db.session.commit()
     section_id = result.fetchone().id
 
-    sql = "SELECT * FROM sections"
-    result = db.session.execute(sql)
-    sec = result.fetchall()
-    print(sec)
+    # Start the statistics of the section from zero
+    sql = "INSERT INTO section_stats (section_id) VALUES (:section_id)"
+    db.session.execute(sql, {"section_id": section_id})
+    pagecache.invalidate("index")
 
     return section_id
 
 
-# Form a list of sections based on the user rights
+# Form a list of sections based on the user rights, along with their statistics
 def list_sections():
 
-    if "username" in session:
-        # User is logged in, check which private sections are accessible
-        user_id = users.get_user_id()
-		# Query for the sections that are not private or private to which the user has privilege
-        sql = "SELECT S.id, S.section_name, S.private, count(DISTINCT T.id) AS thread_count, count(M.id) AS message_count, " \
-            " max(M.posting_time) FROM sections S LEFT JOIN threads T ON S.id = T.section_id " \
-            "LEFT JOIN messages M on T.id = M.thread_id WHERE S.visible=true "\
-            "GROUP BY S.id HAVING (NOT S.private OR S.id IN (SELECT section_id FROM user_privileges WHERE user_id=:user_id))"
-        result = db.session.execute(sql, {"user_id":user_id})
-    else:
-		# The user is not logged in, fetch sections that are not private
-        result = db.session.execute("SELECT S.id, S.section_name, S.private, count(DISTINCT T.id) AS thread_count, count(M.id) AS message_count, " \
-        " max(M.posting_time) FROM sections S LEFT JOIN threads T ON S.id = T.section_id " \
-        "LEFT JOIN messages M on T.id = M.thread_id WHERE S.visible=true AND S.private=false GROUP BY S.id")
+    # The private sections are listed only if the user has access to them
+    identity = users.get_identity()
+    section_ids = sorted(identity.sections) if identity else []
+
+    sql = "SELECT S.id, S.section_name, S.private, COALESCE(ST.thread_count, 0) AS thread_count, COALESCE(ST.message_count, 0) AS message_count, " \
+        " ST.last_post FROM sections S LEFT JOIN section_stats ST ON S.id = ST.section_id WHERE S.visible=true " \
+        " AND (NOT S.private OR S.id = ANY(:section_ids)) ORDER BY S.id"
+    result = read_prepared(sql, {"section_ids": section_ids})
     sections = result.fetchall()
 
     return sections
 
 
+# Statistics of every visible section computed from scratch out of the threads and messages
+SECTION_STATS_QUERY = "SELECT S.id AS section_id, count(DISTINCT T.id) AS thread_count, count(M.id) AS message_count, max(M.posting_time) AS last_post" \
+    " FROM sections S LEFT JOIN threads T ON S.id = T.section_id AND T.visible=true" \
+    " LEFT JOIN messages M ON T.id = M.thread_id AND M.visible=true WHERE S.visible=true GROUP BY S.id"
+
+
+# Set the message counts of the threads of the table that differ from their visible messages in the messages table
+THREAD_COUNTS_UPDATE = "UPDATE {threads} T SET message_count = COALESCE(C.message_count, 0) FROM {threads} X" \
+    " LEFT JOIN (SELECT thread_id, count(*) AS message_count FROM {messages} WHERE visible=true GROUP BY thread_id) C ON C.thread_id = X.id" \
+    " WHERE T.id = X.id AND T.message_count <> COALESCE(C.message_count, 0)"
+
+
+# Replace the stored section statistics and message counts of the threads with freshly computed ones
+def rebuild_section_stats():
+
+    db.session.execute("DELETE FROM section_stats")
+    sql = "INSERT INTO section_stats (section_id, thread_count, message_count, last_post) " + SECTION_STATS_QUERY
+    db.session.execute(sql)
+    db.session.execute(THREAD_COUNTS_UPDATE.format(threads="threads", messages="messages"))
+    db.session.execute(THREAD_COUNTS_UPDATE.format(threads="threads_archive", messages="messages_archive"))
+    db.session.commit()
+
+
+# Compare the stored section statistics with freshly computed ones, return the sections that differ.
+# The time stamp of the latest post is not rolled back when messages are deleted, so only the counts are compared
+def verify_section_stats():
+
+    sql = "SELECT C.section_id, ST.thread_count AS stored_threads, C.thread_count AS actual_threads," \
+    " ST.message_count AS stored_messages, C.message_count AS actual_messages" \
+    " FROM (" + SECTION_STATS_QUERY + ") C LEFT JOIN section_stats ST ON ST.section_id = C.section_id" \
+    " WHERE ST.section_id IS NULL OR ST.thread_count <> C.thread_count OR ST.message_count <> C.message_count ORDER BY C.section_id"
+    result = db.session.execute(sql)
+    mismatches = result.fetchall()
+
+    return mismatches
+
+
+# Compare the stored message counts of the threads with their visible messages, return the threads that differ
+def verify_thread_counts():
+
+    sql = "SELECT T.id AS thread_id, T.message_count AS stored_messages, count(M.id) AS actual_messages" \
+    " FROM threads T LEFT JOIN messages M ON M.thread_id = T.id AND M.visible=true" \
+    " GROUP BY T.id HAVING T.message_count <> count(M.id) ORDER BY T.id"
+    result = db.session.execute(sql)
+    mismatches = result.fetchall()
+
+    return mismatches
+
+
 # Query for the section name corresponding to the id
 def get_section_name(id):
     
-    sql = "SELECT section_name FROM sections WHERE id=:section_id"
-    result = db.session.execute(sql, {"section_id": id})
-    sectionName = result.fetchone().section_name
+    sectionName = users.get_section(id).section_name
 
     return sectionName
 
@@ -57,41 +134,147 @@ def get_section_name(id):
 # Check whether a section is private
 def check_section_privacy(id):
 
-    sql = "SELECT private FROM sections WHERE id=:id"
-    result = db.session.execute(sql, {"id":id})
-    isPrivate = result.fetchone().private
+    isPrivate = users.get_section(id).private
 
     return isPrivate
 
 # Delete a section
 def delete_section(id):
 
-    sql = "UPDATE sections SET visible=false WHERE id=:section_id"
+    sql = "UPDATE sections SET visible=false, version=version+1, modified_at=NOW() WHERE id=:section_id"
     db.session.execute(sql, {"section_id": id})
-    db.session.commit()
+
+    # Hide the threads and messages of the section, so that the archival job moves them out
+    sql = "UPDATE messages SET visible=false WHERE thread_id IN (SELECT id FROM threads WHERE section_id=:section_id) AND visible=true"
+    db.session.execute(sql, {"section_id": id})
+    sql = "UPDATE threads SET visible=false, message_count=0, version=version+1, modified_at=NOW() WHERE section_id=:section_id AND visible=true"
+    db.session.execute(sql, {"section_id": id})
+    search.hide_section(id)
+
+    # Statistics are kept only for the visible sections
+    sql = "DELETE FROM section_stats WHERE section_id=:section_id"
+    db.session.execute(sql, {"section_id": id})
+    users.revoke_section_access(id)
+    pagecache.invalidate("index", "section:" + str(id))
+
+
+# Bump the versions of the pages of the sections given as an argument, so that conditional requests for them see the change
+def touch_sections(section_ids):
+
+    sql = "UPDATE sections SET version=version+1, modified_at=NOW() WHERE id = ANY(:section_ids)"
+    db.session.execute(sql, {"section_ids": [int(section_id) for section_id in section_ids]})
+
+
+# Fetch the version of the page of a section for validating conditional requests, None if there is no such section.
+# The modification time is settled once its second has passed, until then a later change could fall within the same second
+def get_section_version(id):
+
+    if not str(id).isdigit():
+        return None
+
+    sql = "SELECT version, modified_at, date_trunc('second', modified_at) < date_trunc('second', NOW()) AS settled FROM sections WHERE id=:id"
+    result = read_prepared(sql, {"id": id})
+
+    return result.fetchone()
 
 
 # --- THREADS ---
 
-# Query for the relevant columns of threads in the argument section
-def list_threads(id):
+# Bump the versions of the pages of the threads given as an argument, returns the sections of the threads
+def touch_threads(thread_ids):
+
+    sql = "UPDATE threads SET version=version+1, modified_at=NOW() WHERE id = ANY(:thread_ids) RETURNING section_id"
+    result = db.session.execute(sql, {"thread_ids": [int(thread_id) for thread_id in thread_ids]})
+
+    return [thread.section_id for thread in result.fetchall()]
+
+
+# Fetch the version of the page of a thread for validating conditional requests, None if there is no such thread
+def get_thread_version(thread_id):
+
+    if not str(thread_id).isdigit():
+        return None
+
+    sql = "SELECT version, modified_at, date_trunc('second', modified_at) < date_trunc('second', NOW()) AS settled FROM threads WHERE id=:thread_id"
+    result = read_prepared(sql, {"thread_id": thread_id})
+
+    return result.fetchone()
+
+
+# Fetch the section of a thread still in the hot tables, None if there is no such thread
+def get_thread_section(thread_id):
+
+    if not str(thread_id).isdigit():
+        return None
+
+    sql = "SELECT section_id FROM threads WHERE id=:thread_id"
+    thread = read_prepared(sql, {"thread_id": thread_id}).fetchone()
+
+    return thread.section_id if thread else None
 
-    sql = "SELECT T.id, T.posting_time, T.thread_name, U.username, COUNT(M.id) AS reply_count FROM users U LEFT JOIN threads T"\
-    " ON T.user_id = U.id LEFT JOIN messages M ON T.id = M.thread_id WHERE T.section_id=:id AND T.visible=true "\
-    " GROUP BY (T.id, U.username) ORDER BY T.posting_time DESC"
-    result = db.session.execute(sql, {"id": id})
+
+# Query for one page of the threads in the argument section, ordered by the sort mode given as an argument.
+# The page is located with a keyset cursor on (sort key, id), so its cost does not depend on the size of the section
+def list_threads(id, sort="newest", after=None, before=None):
+
+    sortKey = THREAD_SORT_KEYS[sort]
+    pageSize = current_app.config["THREADS_PER_PAGE"]
+
+    after = decode_cursor(after)
+    before = decode_cursor(before)
+
+    params = {"id": id, "limit": pageSize + 1}
+    if before:
+        # Moving towards the newer threads, the page is fetched in reverse order
+        condition = " AND (T." + sortKey + ", T.id) > (:cursor_time, :cursor_id)"
+        order = "ASC"
+        params["cursor_time"], params["cursor_id"] = before
+    elif after:
+        condition = " AND (T." + sortKey + ", T.id) < (:cursor_time, :cursor_id)"
+        order = "DESC"
+        params["cursor_time"], params["cursor_id"] = after
+    else:
+        condition = ""
+        order = "DESC"
+
+    sql = "SELECT T.id, T.posting_time, T.last_activity, T.thread_name, U.username, " + display_time("T.posting_time", "posting_time_text") + ", " + \
+    display_time("T.last_activity", "last_activity_text") + ", T.message_count AS reply_count" \
+    " FROM threads T LEFT JOIN users U ON T.user_id = U.id WHERE T.section_id=:id AND T.visible=true" + condition + \
+    " ORDER BY T." + sortKey + " " + order + ", T.id " + order + " LIMIT :limit"
+    result = read_prepared(sql, params)
     threads = result.fetchall()
 
-    return threads
+    hasMore = len(threads) > pageSize
+    threads = threads[:pageSize]
+    if before:
+        threads.reverse()
+
+    # Form the cursors for the neighbouring pages, None if there is no such page
+    nextCursor = None
+    prevCursor = None
+    if threads:
+        first = threads[0]
+        last = threads[-1]
+        if before or hasMore:
+            nextCursor = encode_cursor(getattr(last, sortKey), last.id)
+        if after or (before and hasMore):
+            prevCursor = encode_cursor(getattr(first, sortKey), first.id)
 
+    return threads, nextCursor, prevCursor
 
-# Query for the relevant columns of a thread given as an argument
+
+# Query for the relevant columns of a thread given as an argument. Threads moved out by the archival job are read from the archive
 def get_thread(thread_id):
 
-    sql = "SELECT T.thread_name, T.posting_time, T.content, U.username FROM threads T LEFT JOIN users U ON T.user_id = U.id WHERE T.id=:thread_id"
-    result = db.session.execute(sql, {"thread_id":thread_id})
+    sql = "SELECT T.thread_name, T.posting_time, " + display_time("T.posting_time", "posting_time_text") + ", T.content, U.username, T.message_count, false AS archived FROM threads T LEFT JOIN users U ON T.user_id = U.id WHERE T.id=:thread_id"
+    result = read_prepared(sql, {"thread_id":thread_id})
     thread = result.fetchone()
 
+    if not thread:
+        sql = "SELECT T.thread_name, T.posting_time, " + display_time("T.posting_time", "posting_time_text") + ", T.content, U.username, T.message_count, true AS archived FROM threads_archive T LEFT JOIN users U ON T.user_id = U.id WHERE T.id=:thread_id"
+        result = read_prepared(sql, {"thread_id":thread_id})
+        thread = result.fetchone()
+
     return thread
 
 
@@ -102,31 +285,59 @@ def post_thread(threadTitle, message, id):
 
     sql = "INSERT INTO threads (posting_time, user_id, section_id, thread_name, content) VALUES (NOW(), :user_id, :id, :threadTitle, :message) RETURNING id"
     result = db.session.execute(sql, {"user_id":user_id, "id":id, "threadTitle":threadTitle, "message":message})
-    db.session.commit()
     thread_id = result.fetchone()[0]
 
+    # Make the thread searchable
+    search.index_thread(thread_id)
+
+    # Update the statistics of the section
+    sql = "INSERT INTO section_stats (section_id, thread_count) VALUES (:id, 1) " \
+    " ON CONFLICT (section_id) DO UPDATE SET thread_count = section_stats.thread_count + 1"
+    db.session.execute(sql, {"id":id})
+    touch_sections([id])
+    pagecache.invalidate("index", "section:" + str(id))
+
     return thread_id
 
 
-# Update a thread given as an argument with the title and content given as arguments 
+# Update a thread given as an argument with the title and content given as arguments.
+# The replaced title and content are read by the same statement and kept in the edit history
 def post_thread_edit(thread_name, content, thread_id):
 
-    sql = "UPDATE threads SET thread_name=:thread_name, content=:content WHERE id=:thread_id"
-    db.session.execute(sql, {"thread_name":thread_name, "content":content, "thread_id":thread_id})
-    db.session.commit()
+    sql = "UPDATE threads T SET thread_name=:thread_name, content=:content, version=T.version+1, modified_at=NOW()" \
+    " FROM (SELECT id, thread_name, content FROM threads WHERE id=:thread_id FOR UPDATE) O WHERE T.id = O.id" \
+    " RETURNING T.section_id, O.thread_name AS old_name, O.content AS old_content"
+    result = db.session.execute(sql, {"thread_name":thread_name, "content":content, "thread_id":thread_id})
+    thread = result.fetchone()
+    section_id = thread.section_id
+    # The row stays locked by the update until the commit, which numbering the revision relies on
+    revisions.record(thread_id, None, revisions.thread_text(thread.old_name, thread.old_content), revisions.thread_text(thread_name, content))
+    touch_sections([section_id])
+    search.index_thread(thread_id)
+    pagecache.invalidate("section:" + str(section_id), "thread:" + str(thread_id))
 
 
 # Delete the thread given as an argument
 def delete_thread(thread_id):
 
-    sql = "UPDATE messages SET visible=false WHERE thread_id=:thread_id"
-    db.session.execute(sql, {"thread_id":thread_id})
-    db.session.commit()
+    sql = "UPDATE messages SET visible=false WHERE thread_id=:thread_id AND visible=true"
+    result = db.session.execute(sql, {"thread_id":thread_id})
+    hiddenMessages = result.rowcount
 
     # Set the visibility of the thread to false
-    sql = "UPDATE threads SET visible=false WHERE id=:thread_id"
-    db.session.execute(sql, {"thread_id":thread_id})
-    db.session.commit()
+    sql = "UPDATE threads SET visible=false, message_count=0, version=version+1, modified_at=NOW() WHERE id=:thread_id AND visible=true RETURNING section_id"
+    result = db.session.execute(sql, {"thread_id":thread_id})
+    thread = result.fetchone()
+
+    # Remove the thread and its messages from the search results
+    search.hide_thread(thread_id)
+
+    # Update the statistics of the section, unless the thread was already deleted
+    if thread:
+        sql = "UPDATE section_stats SET thread_count = thread_count - 1, message_count = message_count - :hidden WHERE section_id=:section_id"
+        db.session.execute(sql, {"hidden":hiddenMessages, "section_id":thread.section_id})
+        touch_sections([thread.section_id])
+        pagecache.invalidate("index", "section:" + str(thread.section_id), "thread:" + str(thread_id))
 
 
 # Check if the user is the creator of the thread given as the argument
@@ -144,17 +355,102 @@ def check_if_thread_creator(thread_id):
 
 # --- MESSAGES ----
 
-# Fetch relevant information related to messages in the thread given as an argument
-def get_messages(thread_id):
+# Table holding the messages of a thread, the archive for the threads moved there by the archival job
+def messages_table(archived):
+
+    return "messages_archive" if archived else "messages"
+
+
+# Condition limiting the messages of the thread to the ones posted after the thread itself, which they always are.
+# When the messages table is partitioned by the posting time, this leaves out the partitions older than the thread
+def thread_time_bound(archived):
+
+    return "" if archived else " AND M.posting_time >= (SELECT posting_time FROM threads WHERE id=:thread_id)"
+
+
+# Fetch one page of the messages in the thread given as an argument, oldest first.
+# The page is located either with a (posting_time, id) cursor, with a page number or as the newest page of the thread
+def get_messages(thread_id, after=None, before=None, page=None, newest=False, archived=False):
+
+    pageSize = current_app.config["MESSAGES_PER_PAGE"]
+
+    after = decode_cursor(after)
+    before = decode_cursor(before)
+
+    params = {"thread_id": thread_id, "limit": pageSize + 1, "offset": 0}
+    reverse = False
+    if after:
+        # The separate bound on the posting time lets the partitions before the cursor be left out
+        condition = " AND (M.posting_time, M.id) > (:cursor_time, :cursor_id) AND M.posting_time >= :cursor_time"
+        params["cursor_time"], params["cursor_id"] = after
+    elif before:
+        # Moving towards the older messages, the page is fetched in reverse order
+        condition = " AND (M.posting_time, M.id) < (:cursor_time, :cursor_id) AND M.posting_time <= :cursor_time"
+        params["cursor_time"], params["cursor_id"] = before
+        reverse = True
+    elif newest:
+        condition = ""
+        reverse = True
+    else:
+        # Jumping to a page by its number has to skip the messages on the preceding pages
+        condition = ""
+        if page and page > 1:
+            params["offset"] = (page - 1) * pageSize
+
+    order = "DESC" if reverse else "ASC"
 
     # Query for the messages posted in the thread
-    sql = "SELECT M.id, M.posting_time, M.content, U.username FROM messages M" \
-    " LEFT JOIN users U ON U.id = M.user_id WHERE M.thread_id=:thread_id AND M.visible=true ORDER BY posting_time ASC"
-    result = db.session.execute(sql, {"thread_id": thread_id})
+    sql = "SELECT M.id, M.posting_time, " + display_time("M.posting_time", "posting_time_text") + ", M.content, U.username FROM " + messages_table(archived) + " M" \
+    " LEFT JOIN users U ON U.id = M.user_id WHERE M.thread_id=:thread_id AND M.visible=true" + thread_time_bound(archived) + condition + \
+    " ORDER BY M.posting_time " + order + ", M.id " + order + " LIMIT :limit OFFSET :offset"
+    result = read_prepared(sql, params)
+    messages = result.fetchall()
+
+    hasMore = len(messages) > pageSize
+    messages = messages[:pageSize]
+    if reverse:
+        messages.reverse()
+
+    # Form the cursors for the neighbouring pages, None if there is no such page
+    nextCursor = None
+    prevCursor = None
+    if messages:
+        first = messages[0]
+        last = messages[-1]
+        if (hasMore and not reverse) or before:
+            nextCursor = encode_cursor(last.posting_time, last.id)
+        if (hasMore and reverse) or after or params["offset"]:
+            prevCursor = encode_cursor(first.posting_time, first.id)
+
+    return messages, nextCursor, prevCursor
+
+
+# Iterate over all the messages in the thread given as an argument, oldest first.
+# The rows are fetched in batches through a server-side cursor, so the memory use does not depend on the length of the thread
+def stream_messages(thread_id, archived=False):
+
+    sql = "SELECT M.id, M.posting_time, " + display_time("M.posting_time", "posting_time_text") + ", M.content, U.username FROM " + messages_table(archived) + " M" \
+    " LEFT JOIN users U ON U.id = M.user_id WHERE M.thread_id=:thread_id AND M.visible=true" + thread_time_bound(archived) + \
+    " ORDER BY M.posting_time ASC, M.id ASC"
+    connection = db.session.connection(bind=read_bind()).execution_options(stream_results=True)
+    result = connection.execute(text(sql), {"thread_id": thread_id})
+
+    for message in result:
+        yield message
+
+# Fetch the messages of the thread posted after the message id given as an argument, oldest first, for the live updates.
+# Read from the primary database, which the notifications of new messages come from
+def get_messages_since(thread_id, since, limit):
+
+    sql = "SELECT M.id, " + display_time("M.posting_time", "posting_time_text") + ", M.content, U.username FROM messages M" \
+    " LEFT JOIN users U ON U.id = M.user_id WHERE M.thread_id=:thread_id AND M.id > :since AND M.visible=true" + thread_time_bound(False) + \
+    " ORDER BY M.id LIMIT :limit"
+    result = db.session.execute(sql, {"thread_id": thread_id, "since": since, "limit": limit})
     messages = result.fetchall()
 
     return messages
 
+
 # Fetch the content of the message given as an argument
 def get_message(message_id):
 
@@ -166,30 +462,112 @@ def get_message(message_id):
     return message
 
 
-# Add a message with content and thread identifier given by the argument to the database
+# Add a message with content and thread identifier given by the argument to the database.
+# In the buffered write mode the message is written by the writer thread along with other replies, and this returns once it is committed
 def post_message(content, thread_id):
 
     user_id = users.get_user_id()
 
-    # Insert the reply into the database
-    sql = "INSERT INTO messages (posting_time, user_id, thread_id, content) VALUES (NOW(), :user_id, :thread_id, :content)"
-    db.session.execute(sql, {"user_id": user_id, "thread_id": thread_id, "content": content})
-    db.session.commit()
-
-
-# Update a message given as an argument with the content given as another argument
+    if current_app.config["REPLY_WRITE_MODE"] == "buffered":
+        message_id = writequeue.submit(user_id, thread_id, content)
+        wrote_primary()
+    else:
+        message_id = insert_messages([(user_id, thread_id, content)])[0]
+
+    return message_id
+
+
+# Insert the messages given as (user_id, thread_id, content) tuples with a single statement, and update the threads,
+# section statistics and search index accordingly. Returns the ids of the messages in the order of the arguments.
+# Raises ValueError before inserting any message if one of the threads is not visible
+def insert_messages(rows):
+
+    # Move the threads up in the latest activity ordering and count their new messages. Only the visible threads are updated,
+    # and their rows stay locked until the commit, so a thread deleted or archived meanwhile gets no replies
+    threadCounts = {}
+    for user_id, thread_id, content in rows:
+        threadCounts[int(thread_id)] = threadCounts.get(int(thread_id), 0) + 1
+    thread_ids = set(threadCounts)
+    sql = "UPDATE threads T SET last_activity=NOW(), message_count = T.message_count + C.count, version=T.version+1, modified_at=NOW()" \
+    " FROM unnest(CAST(:thread_ids AS INTEGER[]), CAST(:counts AS INTEGER[])) AS C(thread_id, count) WHERE T.id = C.thread_id AND T.visible=true" \
+    " RETURNING T.id, T.section_id"
+    result = db.session.execute(sql, {"thread_ids": list(threadCounts), "counts": list(threadCounts.values())})
+    sections = {thread.id: thread.section_id for thread in result.fetchall()}
+    if len(sections) < len(threadCounts):
+        raise ValueError("The thread has been deleted")
+
+    # Insert the replies into the database
+    values = []
+    params = {}
+    for i, (user_id, thread_id, content) in enumerate(rows):
+        values.append("(NOW(), :user_id%d, :thread_id%d, :content%d)" % (i, i, i))
+        params["user_id%d" % i] = user_id
+        params["thread_id%d" % i] = thread_id
+        params["content%d" % i] = content
+    sql = "INSERT INTO messages (posting_time, user_id, thread_id, content) VALUES " + ", ".join(values) + " RETURNING id"
+    result = db.session.execute(sql, params)
+    message_ids = [message.id for message in result.fetchall()]
+
+    # Make the messages searchable
+    search.index_messages(message_ids)
+
+    # Update the statistics of the sections
+    messageCounts = {}
+    for user_id, thread_id, content in rows:
+        section_id = sections[int(thread_id)]
+        messageCounts[section_id] = messageCounts.get(section_id, 0) + 1
+    for section_id, messageCount in messageCounts.items():
+        sql = "INSERT INTO section_stats (section_id, message_count, last_post) VALUES (:section_id, :count, NOW()) " \
+        " ON CONFLICT (section_id) DO UPDATE SET message_count = section_stats.message_count + :count, last_post = NOW()"
+        db.session.execute(sql, {"section_id": section_id, "count": messageCount})
+    touch_sections(messageCounts)
+
+    # Wake the clients following the threads
+    live.notify_threads(thread_ids)
+
+    pagecache.invalidate("index", *(["section:" + str(section_id) for section_id in messageCounts] +
+                                    ["thread:" + str(thread_id) for thread_id in thread_ids]))
+
+    return message_ids
+
+
+# Update a message given as an argument with the content given as another argument.
+# The replaced content is read by the same statement and kept in the edit history
 def post_message_edit(content, message_id):
     
-    sql = "UPDATE messages SET content=:content WHERE id=:message_id"
-    db.session.execute(sql, {"content":content, "message_id":message_id})
-    db.session.commit()
+    sql = "UPDATE messages M SET content=:content FROM (SELECT id, content FROM messages WHERE id=:message_id FOR UPDATE) O" \
+    " WHERE M.id = O.id RETURNING M.thread_id, O.content AS old_content"
+    result = db.session.execute(sql, {"content":content, "message_id":message_id})
+    message = result.fetchone()
+    thread_id = message.thread_id
+    # The row stays locked by the update until the commit, which numbering the revision relies on
+    revisions.record(thread_id, message_id, message.old_content, content)
+    touch_threads([thread_id])
+    search.index_message(message_id)
+    pagecache.invalidate("thread:" + str(thread_id))
 
 # Delete the message given as an argument
 def delete_message(message_id):
 
-    sql = "UPDATE messages SET visible=false WHERE id=:message_id"
-    db.session.execute(sql, {"message_id": message_id})
-    db.session.commit()
+    sql = "UPDATE messages SET visible=false WHERE id=:message_id AND visible=true RETURNING thread_id"
+    result = db.session.execute(sql, {"message_id": message_id})
+    message = result.fetchone()
+
+    # Remove the message from the search results
+    search.hide_message(message_id)
+
+    # Update the statistics of the thread and the section, unless the message was already deleted
+    if message:
+        sql = "UPDATE threads SET message_count = message_count - 1 WHERE id=:thread_id"
+        db.session.execute(sql, {"thread_id": message.thread_id})
+        section_id = touch_threads([message.thread_id])[0]
+        touch_sections([section_id])
+
+        sql = "UPDATE section_stats SET message_count = message_count - 1 WHERE section_id=:section_id"
+        db.session.execute(sql, {"section_id": section_id})
+
+        pagecache.invalidate("index", "section:" + str(section_id), "thread:" + str(message.thread_id))
+
 
 # Check if the user is the creator of the message given as an argument
 def check_if_message_creator(message_id):
@@ -203,27 +581,3 @@ def check_if_message_creator(message_id):
     isCreator = (user == session["username"])
 
     return isCreator
-
-
-# --- QUERY ---
-
-# Fetch the threads and messages with the queried string in them
-def search_forum(query):
-
-    # Search for messages containing the queried string
-    sql = "SELECT M.content, S.id AS section_id, T.id AS thread_id, T.thread_name FROM sections S " \
-    " LEFT JOIN threads T ON S.id=T.section_id LEFT JOIN messages M" \
-    " ON T.id = M.thread_id WHERE lower(M.content) LIKE :query"
-    result = db.session.execute(sql, {"query": "%"+query+"%"})
-    messages = result.fetchall()
-
-    # Search for threads containing the queried string
-    sql = "SELECT id, section_id, thread_name, content FROM threads WHERE (lower(content) LIKE :query) OR (lower(thread_name) LIKE :query)"
-    result = db.session.execute(sql, {"query": "%"+query+"%"})
-    threads = result.fetchall()
-
-    return messages, threads
-
-
-
-
@@ -0,0 +1,35 @@
+# Settings of the gunicorn server started by the Procfile. The gevent workers serve each request in a greenlet,
+# so the idle live update connections of the threads do not tie up a worker each, and a worker serves other requests
+# while one waits for the database. The database connections of a worker stay bounded by its connection pool
+from os import getenv
+
+worker_class = getenv("GUNICORN_WORKER_CLASS", "gevent")
+workers = int(getenv("WEB_CONCURRENCY", "2"))
+# Connections served at the same time by a gevent worker
+worker_connections = int(getenv("GUNICORN_WORKER_CONNECTIONS", "2000"))
+
+
+# Make psycopg2 yield to the other greenlets while it waits for the database
+def post_fork(server, worker):
+
+    if worker_class == "gevent":
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+# Warm up the worker before it accepts requests, unless WARM_UP is off. A worker that fails to warm up still starts,
+# and connects and loads the templates on its first requests instead
+def post_worker_init(worker):
+
+    app = worker.wsgi
+    if not app.config["WARM_UP"]:
+        return
+
+    import warmup
+    try:
+        timings = warmup.warm_up(app)
+    except Exception:
+        worker.log.exception("Warm-up failed")
+        return
+    worker.log.info("Warmed up: templates %.1f ms, statements %.1f ms, connection pool %.1f ms",
+                    timings["templates"], timings["statements"], timings["pool"])
@@ -0,0 +1,188 @@
+from flask import g, request, has_app_context, current_app, Response
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# For the slow query log and normalising the statements in it
+import logging, re, threading
+
+# For timing the requests and statements
+from time import perf_counter
+
+import ratelimit, admission
+
+
+# Log of the statements slower than the SLOW_QUERY_MS setting
+slowQueryLog = logging.getLogger("forum.slowquery")
+
+# Upper bounds of the request duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the buckets for the number of statements per request
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Per-route histograms of this worker process, as {(metric, route): [bucket counts..., sum, count]}
+histograms = {}
+histogramLock = threading.Lock()
+slowQueryCount = [0]
+
+
+# Enable the instrumentation if the INSTRUMENTATION setting is on. When it is off, no hooks are registered at all
+def init_app(app):
+
+    if not app.config["INSTRUMENTATION"]:
+        return
+
+    # The listeners are attached to the Engine class, so that they cover every engine the application creates.
+    # They are registered only once however many applications are created, and measure the statements of the applications that enable them
+    if not event.contains(Engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+
+    @app.before_request
+    def start_request():
+        g.request_start = perf_counter()
+        g.sql_count = 0
+        g.sql_time = 0.0
+        g.sql_slowest = (0.0, None)
+
+    @app.after_request
+    def finish_request(response):
+        if not "request_start" in g:
+            return response
+
+        elapsed = perf_counter() - g.request_start
+        response.headers["Server-Timing"] = 'db;dur=%.2f;desc="%d queries", db-slowest;dur=%.2f, app;dur=%.2f' % (
+            g.sql_time * 1000, g.sql_count, g.sql_slowest[0] * 1000, elapsed * 1000)
+
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        observe("forum_request_duration_seconds", route, elapsed, DURATION_BUCKETS)
+        observe("forum_request_sql_duration_seconds", route, g.sql_time, DURATION_BUCKETS)
+        observe("forum_request_sql_queries", route, g.sql_count, QUERY_COUNT_BUCKETS)
+
+        return response
+
+    app.add_url_rule("/metrics", "metrics", metrics)
+
+
+# Whether the statements run within the current application are measured
+def measuring():
+
+    return has_app_context() and current_app.config["INSTRUMENTATION"]
+
+
+# Note the start time of a statement of an instrumented application
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+
+    if measuring():
+        conn.info.setdefault("query_start", []).append(perf_counter())
+
+
+# Count the statement in the measurements of the request, and log it if it took longer than SLOW_QUERY_MS
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+
+    if not measuring() or not conn.info.get("query_start"):
+        return
+
+    elapsed = perf_counter() - conn.info["query_start"].pop()
+
+    if elapsed >= current_app.config["SLOW_QUERY_MS"] / 1000:
+        slowQueryCount[0] += 1
+        names = sorted(parameters) if isinstance(parameters, dict) else []
+        slowQueryLog.warning("Slow query (%.1f ms): %s [parameters: %s]", elapsed * 1000, normalise(statement), ", ".join(names))
+
+    if "sql_count" in g:
+        g.sql_count += 1
+        g.sql_time += elapsed
+        if elapsed > g.sql_slowest[0]:
+            g.sql_slowest = (elapsed, statement)
+
+
+# Replace the literal values in a statement, so that statements differing only by their values are logged alike
+def normalise(statement):
+
+    statement = re.sub(r"%\((\w+)\)s", r":\1", statement)
+    statement = re.sub(r"'(?:[^']|'')*'", "?", statement)
+    statement = re.sub(r"\b\d+(?:\.\d+)?\b", "?", statement)
+
+    return " ".join(statement.split())
+
+
+# Add an observation to the histogram of the metric and route
+def observe(metric, route, value, buckets):
+
+    with histogramLock:
+        histogram = histograms.get((metric, route))
+        if histogram is None:
+            histogram = histograms[(metric, route)] = [0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+# Label value in the Prometheus text format
+def label(value):
+
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Describe the measurements of this worker process in the Prometheus text format
+def metrics():
+
+    descriptions = {
+        "forum_request_duration_seconds": ("Duration of the requests", DURATION_BUCKETS),
+        "forum_request_sql_duration_seconds": ("Time spent in SQL statements per request", DURATION_BUCKETS),
+        "forum_request_sql_queries": ("Number of SQL statements per request", QUERY_COUNT_BUCKETS),
+    }
+
+    with histogramLock:
+        snapshot = {key: list(histogram) for key, histogram in histograms.items()}
+
+    lines = []
+    for metric, (description, buckets) in descriptions.items():
+        lines.append("# HELP %s %s" % (metric, description))
+        lines.append("# TYPE %s histogram" % metric)
+        for (name, route), histogram in sorted(snapshot.items()):
+            if name != metric:
+                continue
+            for i, bound in enumerate(buckets):
+                lines.append('%s_bucket{route="%s",le="%s"} %d' % (metric, label(route), bound, histogram[i]))
+            lines.append('%s_bucket{route="%s",le="+Inf"} %d' % (metric, label(route), histogram[-1]))
+            lines.append('%s_sum{route="%s"} %s' % (metric, label(route), histogram[-2]))
+            lines.append('%s_count{route="%s"} %d' % (metric, label(route), histogram[-1]))
+
+    lines.append("# HELP forum_slow_queries_total Statements slower than the slow query threshold")
+    lines.append("# TYPE forum_slow_queries_total counter")
+    lines.append("forum_slow_queries_total %d" % slowQueryCount[0])
+
+    # Hits and misses of the page and search result caches, and what they hold
+    caches = [(name, current_app.extensions.get(name)) for name in ("pagecache", "searchcache")]
+    caches = [(name, cache) for name, cache in caches if cache is not None]
+    for metric, description, attribute in (("forum_cache_hits_total", "Lookups answered from the cache", "hits"),
+                                           ("forum_cache_misses_total", "Lookups not found in the cache", "misses"),
+                                           ("forum_cache_bytes", "Approximate size of the cached entries", "size")):
+        lines.append("# HELP %s %s" % (metric, description))
+        lines.append("# TYPE %s %s" % (metric, "gauge" if attribute == "size" else "counter"))
+        for name, cache in caches:
+            lines.append('%s{cache="%s"} %d' % (metric, name, getattr(cache, attribute)))
+    lines.append("# HELP forum_cache_entries Entries in the cache")
+    lines.append("# TYPE forum_cache_entries gauge")
+    for name, cache in caches:
+        lines.append('forum_cache_entries{cache="%s"} %d' % (name, len(cache.pages)))
+
+    # Requests refused by the rate limits and by the admission control, and the page durations the admission control goes by
+    lines.append("# HELP forum_rate_limited_total Requests refused with 429 by the rate limit of the given name")
+    lines.append("# TYPE forum_rate_limited_total counter")
+    for name, count in sorted(ratelimit.limitedCount.items()):
+        lines.append('forum_rate_limited_total{limit="%s"} %d' % (label(name), count))
+    lines.append("# HELP forum_requests_shed_total Requests refused with 503 by the admission control")
+    lines.append("# TYPE forum_requests_shed_total counter")
+    for kind, count in sorted(admission.shedCount.items()):
+        lines.append('forum_requests_shed_total{class="%s"} %d' % (kind, count))
+    lines.append("# HELP forum_page_latency_average_seconds Moving average of the page request durations")
+    lines.append("# TYPE forum_page_latency_average_seconds gauge")
+    lines.append("forum_page_latency_average_seconds %f" % admission.average_latency())
+
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,190 @@
+from db import db
+
+import forum
+
+from flask import current_app, session
+
+# For the listener thread and the events the waiting clients block on
+import threading, select, logging, weakref
+
+# For encoding the messages sent to the clients
+import json
+
+from time import monotonic, sleep
+
+
+# Channel of the database notifications sent when messages are posted, with the thread id as the payload
+CHANNEL = "forum_messages"
+
+# Messages sent to a client at a time
+BATCH_SIZE = 100
+
+log = logging.getLogger("forum.live")
+
+
+# Clients waiting for new messages, as one event per thread that is set and replaced when the thread gets a message.
+# A waiting client costs only the event it holds, so idle connections do not tie up database connections.
+# Each thread has a generation counted up by its notifications, and every thread by notify_all. A client takes the generation
+# before it queries the messages and waits only if it is still the same, so a message posted in between is not missed.
+# Each app has its own hub, kept in its extensions along with the thread listening for the notifications of its database
+class Hub:
+
+    def __init__(self):
+        self.events = {}
+        self.generations = {}
+        self.epoch = 0
+        self.lock = threading.Lock()
+        self.listener = None
+        self.listenerLock = threading.Lock()
+
+    # Generation of the thread, to be taken before querying its messages
+    def generation(self, thread_id):
+        with self.lock:
+            return self.epoch, self.generations.get(str(thread_id), 0)
+
+    # Wait until the thread has been notified after the generation given, at most timeout seconds. Returns whether it was
+    def wait(self, thread_id, generation, timeout):
+        key = str(thread_id)
+        with self.lock:
+            if (self.epoch, self.generations.get(key, 0)) != generation:
+                return True
+            event = self.events.setdefault(key, threading.Event())
+        return event.wait(timeout)
+
+    # Wake the clients waiting for the thread
+    def notify(self, thread_id):
+        key = str(thread_id)
+        with self.lock:
+            self.generations[key] = self.generations.get(key, 0) + 1
+            event = self.events.pop(key, None)
+        if event is not None:
+            event.set()
+
+    # Wake every waiting client, when notifications may have been missed
+    def notify_all(self):
+        with self.lock:
+            self.epoch += 1
+            events = list(self.events.values())
+            self.events.clear()
+        for event in events:
+            event.set()
+
+
+hubsLock = threading.Lock()
+
+
+# The hub of the app in this process, with the thread listening for the notifications of the app started unless it is already running
+def get_hub(app):
+
+    with hubsLock:
+        if not "live" in app.extensions:
+            app.extensions["live"] = Hub()
+    hub = app.extensions["live"]
+
+    with hub.listenerLock:
+        if hub.listener is None or not hub.listener.is_alive():
+            hub.listener = threading.Thread(target=listen, args=(weakref.ref(app), hub), name="live-listener", daemon=True)
+            hub.listener.start()
+
+    return hub
+
+
+# Connection to the database of the app taken out of the pool for good, None if the app is gone
+def connect(appRef):
+
+    app = appRef()
+    if app is None:
+        return None
+
+    with app.app_context():
+        connection = db.engine.raw_connection()
+    connection.detach()
+
+    return connection
+
+
+# Pass the notifications of new messages to the hub. The listening connection is replaced after a failure, waking every client
+# once listening again since notifications may have been lost in between. The app is only referred to weakly,
+# so that the thread stops once the app is gone instead of reconnecting to its database for good
+def listen(appRef, hub):
+
+    failed = False
+    while True:
+        connection = None
+        try:
+            connection = connect(appRef)
+            if connection is None:
+                return
+            connection.connection.autocommit = True
+            connection.cursor().execute("LISTEN " + CHANNEL)
+            if failed:
+                hub.notify_all()
+                failed = False
+
+            while True:
+                if select.select([connection.connection], [], [], 60) == ([], [], []):
+                    if appRef() is None:
+                        return
+                    continue
+                connection.connection.poll()
+                while connection.connection.notifies:
+                    hub.notify(connection.connection.notifies.pop(0).payload)
+        except Exception:
+            log.exception("Listening for new messages failed, reconnecting")
+            failed = True
+            sleep(1)
+        finally:
+            if connection is not None:
+                connection.close()
+
+
+# Notify the listeners of every worker process of new messages in the threads given as an argument, once the transaction commits
+def notify_threads(thread_ids):
+
+    sql = "SELECT pg_notify('" + CHANNEL + "', CAST(thread_id AS TEXT)) FROM unnest(CAST(:thread_ids AS INTEGER[])) AS thread_id"
+    db.session.execute(sql, {"thread_ids": [int(thread_id) for thread_id in thread_ids]})
+
+
+# Messages of the thread posted after the message id given as an argument, ready to be encoded as JSON.
+# The database connection is released right away, as the caller may wait for a long time before the next query
+def new_messages(thread_id, since):
+
+    messages = forum.get_messages_since(thread_id, since, BATCH_SIZE)
+    db.session.close()
+
+    return [{"id": message.id, "posting_time": message.posting_time_text, "username": message.username,
+             "content": message.content, "own": message.username == session.get("username")} for message in messages]
+
+
+# Server-Sent Events of the messages posted in the thread after the message id given as an argument.
+# The stream is closed after LIVE_STREAM_SECONDS, and the browser reconnects with the id of the last message it received
+def stream_messages(thread_id, since):
+
+    app = current_app._get_current_object()
+    hub = get_hub(app)
+    deadline = monotonic() + app.config["LIVE_STREAM_SECONDS"]
+
+    yield "retry: 3000\n\n"
+    while monotonic() < deadline:
+        generation = hub.generation(thread_id)
+        messages = new_messages(thread_id, since)
+        for message in messages:
+            since = message["id"]
+            yield "id: %d\nevent: message\ndata: %s\n\n" % (message["id"], json.dumps(message))
+        if not messages and not hub.wait(thread_id, generation, app.config["LIVE_HEARTBEAT_SECONDS"]):
+            # Comment lines keep the proxies from closing an idle connection
+            yield ": keep-alive\n\n"
+
+
+# Wait up to LIVE_POLL_SECONDS for messages posted in the thread after the message id given as an argument
+def wait_for_messages(thread_id, since):
+
+    app = current_app._get_current_object()
+    hub = get_hub(app)
+
+    generation = hub.generation(thread_id)
+    messages = new_messages(thread_id, since)
+    if not messages and hub.wait(thread_id, generation, app.config["LIVE_POLL_SECONDS"]):
+        messages = new_messages(thread_id, since)
+
+    return messages
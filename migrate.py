@@ -0,0 +1,60 @@
+# For finding the migration files
+from os import listdir, path
+
+from sqlalchemy import text
+
+
+# Directory of the numbered migration files, named as <version>_<name>.sql
+MIGRATIONS_DIR = path.join(path.dirname(path.abspath(__file__)), "migrations")
+
+# Key of the advisory lock that keeps two processes from migrating at the same time
+MIGRATION_LOCK = 724301
+
+
+# List the migrations as (version, name, file path) in the order of their versions
+def list_migrations():
+
+    migrations = []
+    for filename in listdir(MIGRATIONS_DIR):
+        if filename.endswith(".sql"):
+            version, name = filename[:-len(".sql")].split("_", 1)
+            migrations.append((int(version), name, path.join(MIGRATIONS_DIR, filename)))
+
+    return sorted(migrations)
+
+
+# Apply the migrations that are not yet recorded as applied, each within its own transaction.
+# Returns the (version, name) of the applied migrations
+def apply_migrations(engine):
+
+    applied = []
+    with engine.connect() as connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, name TEXT, applied_at TIMESTAMP DEFAULT NOW())")
+
+        for version, name, filename in list_migrations():
+            with connection.begin():
+                connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK})
+
+                sql = "SELECT version FROM schema_migrations WHERE version=:version"
+                if connection.execute(text(sql), {"version": version}).fetchone():
+                    continue
+
+                # The migration file may hold several statements, so it is sent to the database as is
+                with open(filename) as migration:
+                    connection.connection.cursor().execute(migration.read())
+
+                sql = "INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"
+                connection.execute(text(sql), {"version": version, "name": name})
+                applied.append((version, name))
+
+    return applied
+
+
+# Fetch the highest applied migration version, 0 if none is applied
+def current_version(engine):
+
+    with engine.connect() as connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, name TEXT, applied_at TIMESTAMP DEFAULT NOW())")
+        version = connection.execute("SELECT COALESCE(max(version), 0) FROM schema_migrations").scalar()
+
+    return version
@@ -0,0 +1,29 @@
+/* Columns and tables added to schema.sql before the migrations existed, for the databases created from the original schema.
+   Numbered before the index migrations, which need them. A database created from the current schema.sql has them all already,
+   so this only fills in what is missing */
+
+/* Time of the latest reply of each thread, for ordering the threads by their latest activity */
+ALTER TABLE threads ADD COLUMN IF NOT EXISTS last_activity TIMESTAMP;
+UPDATE threads T SET last_activity = GREATEST(T.posting_time, (SELECT max(M.posting_time) FROM messages M WHERE M.thread_id = T.id))
+    WHERE T.last_activity IS NULL;
+ALTER TABLE threads ALTER COLUMN last_activity SET DEFAULT NOW();
+
+/* Statistics of each section, kept up to date by the write operations. Computed as flask rebuild-stats does, for the sections that have none yet */
+CREATE TABLE IF NOT EXISTS section_stats(section_id INTEGER PRIMARY KEY REFERENCES sections, thread_count INTEGER DEFAULT 0, message_count INTEGER DEFAULT 0, last_post TIMESTAMP);
+INSERT INTO section_stats (section_id, thread_count, message_count, last_post)
+    SELECT S.id, count(DISTINCT T.id), count(M.id), max(M.posting_time) FROM sections S LEFT JOIN threads T ON S.id = T.section_id AND T.visible=true
+    LEFT JOIN messages M ON T.id = M.thread_id AND M.visible=true
+    WHERE S.visible=true AND NOT EXISTS (SELECT 1 FROM section_stats X WHERE X.section_id = S.id) GROUP BY S.id;
+
+/* Search index over thread titles, thread contents and messages. Filled as flask reindex-search does, with the default SEARCH_CONFIG,
+   for the threads and messages that have no document yet */
+CREATE TABLE IF NOT EXISTS search_documents(id SERIAL PRIMARY KEY, thread_id INTEGER REFERENCES threads, message_id INTEGER REFERENCES messages, section_id INTEGER REFERENCES sections, visible BOOLEAN DEFAULT true, document TSVECTOR);
+CREATE INDEX IF NOT EXISTS search_documents_document_idx ON search_documents USING GIN (document) WHERE visible;
+CREATE UNIQUE INDEX IF NOT EXISTS search_documents_thread_idx ON search_documents (thread_id) WHERE message_id IS NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS search_documents_message_idx ON search_documents (message_id);
+INSERT INTO search_documents (thread_id, section_id, visible, document)
+    SELECT T.id, T.section_id, T.visible, setweight(to_tsvector('simple', coalesce(T.thread_name, '')), 'A') || setweight(to_tsvector('simple', coalesce(T.content, '')), 'B')
+    FROM threads T WHERE NOT EXISTS (SELECT 1 FROM search_documents D WHERE D.thread_id = T.id AND D.message_id IS NULL);
+INSERT INTO search_documents (thread_id, message_id, section_id, visible, document)
+    SELECT M.thread_id, M.id, T.section_id, M.visible AND T.visible, setweight(to_tsvector('simple', coalesce(M.content, '')), 'C')
+    FROM messages M JOIN threads T ON T.id = M.thread_id WHERE NOT EXISTS (SELECT 1 FROM search_documents D WHERE D.message_id = M.id);
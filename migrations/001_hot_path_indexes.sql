@@ -0,0 +1,11 @@
+/* Indexes for the queries run on every page load */
+
+/* Pages of threads in a section, by creation time and by latest reply */
+CREATE INDEX IF NOT EXISTS threads_section_posting_time_idx ON threads (section_id, posting_time DESC, id DESC) WHERE visible;
+CREATE INDEX IF NOT EXISTS threads_section_last_activity_idx ON threads (section_id, last_activity DESC, id DESC) WHERE visible;
+
+/* Pages of messages in a thread and the reply counts */
+CREATE INDEX IF NOT EXISTS messages_thread_posting_time_idx ON messages (thread_id, posting_time, id) WHERE visible;
+
+/* Access rights of a user to the private sections */
+CREATE INDEX IF NOT EXISTS user_privileges_user_section_idx ON user_privileges (user_id, section_id);
@@ -0,0 +1,6 @@
+/* Users are looked up by their username, which therefore has to be unique.
+   Registering used to check for the username before adding the user, so two registrations at the same time could both add it.
+   The first user with the name keeps it, and the later ones are renamed to the name followed by their id, keeping their posts and rights */
+UPDATE users U SET username = U.username || '_' || U.id
+    WHERE EXISTS (SELECT 1 FROM users D WHERE D.username = U.username AND D.id < U.id);
+CREATE UNIQUE INDEX IF NOT EXISTS users_username_key ON users (username);
@@ -0,0 +1,3 @@
+/* The example accounts were created with plain text passwords, store them hashed like the passwords of other users */
+UPDATE users SET password='pbkdf2:sha256:260000$BpmSaYWHny3n8GfH$926bcd611c73142ab87060602e970097a939f930d1b1f6788b7fb6e1171025f3' WHERE username='root' AND password='root';
+UPDATE users SET password='pbkdf2:sha256:260000$fCk4hb7DlDpqtjOJ$6f7d64fc9da944a0402f41244ab0245dc78dc64a8f0d7ed5f7f5e945b583bdf4' WHERE username='tester' AND password='123';
@@ -0,0 +1,9 @@
+/* Version counters and modification times of the section and thread pages, for answering conditional requests without rendering */
+
+/* Bumped whenever the list of threads of the section changes: new, edited and deleted threads and replies */
+ALTER TABLE sections ADD COLUMN IF NOT EXISTS version INTEGER DEFAULT 0;
+ALTER TABLE sections ADD COLUMN IF NOT EXISTS modified_at TIMESTAMPTZ DEFAULT NOW();
+
+/* Bumped whenever the thread or its messages change */
+ALTER TABLE threads ADD COLUMN IF NOT EXISTS version INTEGER DEFAULT 0;
+ALTER TABLE threads ADD COLUMN IF NOT EXISTS modified_at TIMESTAMPTZ DEFAULT NOW();
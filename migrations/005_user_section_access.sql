@@ -0,0 +1,11 @@
+/* Precomputed access sets of the users to the private sections, and one privilege row per user and section */
+
+/* Drop the duplicate privileges granted more than once, keeping the first grant */
+DELETE FROM user_privileges P USING user_privileges D WHERE P.user_id = D.user_id AND P.section_id = D.section_id AND P.id > D.id;
+CREATE UNIQUE INDEX IF NOT EXISTS user_privileges_user_section_key ON user_privileges (user_id, section_id);
+DROP INDEX IF EXISTS user_privileges_user_section_idx;
+
+/* Sorted ids of the visible private sections the user has access to, loaded along with the user */
+ALTER TABLE users ADD COLUMN IF NOT EXISTS section_access INTEGER[] NOT NULL DEFAULT '{}';
+UPDATE users U SET section_access = COALESCE((SELECT array_agg(DISTINCT P.section_id ORDER BY P.section_id) FROM user_privileges P
+    JOIN sections S ON S.id = P.section_id WHERE P.user_id = U.id AND S.visible), '{}');
@@ -0,0 +1,2 @@
+/* New messages of a thread after the last one a client has seen, for the live updates */
+CREATE INDEX IF NOT EXISTS messages_thread_id_idx ON messages (thread_id, id) WHERE visible;
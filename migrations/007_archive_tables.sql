@@ -0,0 +1,10 @@
+/* Archive tables for the deleted and cold threads and messages moved out of the hot tables by flask archive.
+   They have the columns of the hot tables without the foreign keys, and are read only when an archived thread is opened */
+CREATE TABLE IF NOT EXISTS threads_archive (LIKE threads, archived_at TIMESTAMPTZ DEFAULT NOW(), PRIMARY KEY (id));
+CREATE TABLE IF NOT EXISTS messages_archive (LIKE messages, archived_at TIMESTAMPTZ DEFAULT NOW(), PRIMARY KEY (id));
+CREATE INDEX IF NOT EXISTS messages_archive_thread_posting_time_idx ON messages_archive (thread_id, posting_time, id);
+
+/* Threads of the sections deleted before deleting a section hid its threads */
+UPDATE messages SET visible=false WHERE visible AND thread_id IN (SELECT T.id FROM threads T JOIN sections S ON S.id = T.section_id WHERE NOT S.visible);
+UPDATE threads SET visible=false WHERE visible AND section_id IN (SELECT id FROM sections WHERE NOT visible);
+UPDATE search_documents SET visible=false WHERE visible AND section_id IN (SELECT id FROM sections WHERE NOT visible);
@@ -0,0 +1,25 @@
+/* Earlier versions of the edited threads and messages, kept out of the hot tables, which hold only the current text.
+   Each row is the version that an edit replaced, stored as a zlib compressed delta against the next newer version, or as a compressed
+   snapshot of the whole text when that is smaller or when flask compact-revisions rebases a long chain of deltas.
+   The revisions of a thread have no message_id, its text being the title and the content on the lines after it.
+   There are no foreign keys, as the threads and messages may be moved into the archive tables */
+CREATE TABLE IF NOT EXISTS revisions (
+    id SERIAL PRIMARY KEY,
+    thread_id INTEGER NOT NULL,
+    message_id INTEGER,
+    revision INTEGER NOT NULL,
+    user_id INTEGER,
+    replaced_at TIMESTAMPTZ DEFAULT NOW(),
+    snapshot BOOLEAN NOT NULL,
+    data BYTEA NOT NULL
+);
+
+/* The revisions are numbered by the edits while the post is locked; should two edits still get the same number, the later one fails
+   instead of storing a second version under it. The message_id of the revisions of a thread is NULL, which the constraint does not
+   compare, so the partial index on the threads keeps their numbers unique. The message index serves the lookups by the message */
+CREATE UNIQUE INDEX IF NOT EXISTS revisions_post_revision_key ON revisions (thread_id, message_id, revision);
+CREATE UNIQUE INDEX IF NOT EXISTS revisions_thread_revision_idx ON revisions (thread_id, revision) WHERE message_id IS NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS revisions_message_revision_idx ON revisions (message_id, revision) WHERE message_id IS NOT NULL;
+
+/* The data is compressed already, so the database does not try to compress it again */
+ALTER TABLE revisions ALTER COLUMN data SET STORAGE EXTERNAL;
@@ -0,0 +1,10 @@
+/* Number of visible messages of each thread, kept up to date by the write operations like the statistics of the sections,
+   so that the pages of a thread and the lists of threads do not count the messages of long threads on every view */
+ALTER TABLE threads ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE threads_archive ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0;
+
+/* Counted as flask rebuild-stats does */
+UPDATE threads T SET message_count = C.message_count
+    FROM (SELECT thread_id, count(*) AS message_count FROM messages WHERE visible=true GROUP BY thread_id) C WHERE C.thread_id = T.id;
+UPDATE threads_archive T SET message_count = C.message_count
+    FROM (SELECT thread_id, count(*) AS message_count FROM messages_archive WHERE visible=true GROUP BY thread_id) C WHERE C.thread_id = T.id;
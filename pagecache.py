@@ -0,0 +1,191 @@
+from db import after_commit
+
+import users
+
+from flask import current_app, request, session, g, Response, make_response
+
+# For answering conditional requests
+from werkzeug.http import is_resource_modified
+from hashlib import sha1
+from os import listdir, path
+
+# For the least recently used ordering and thread safety of the cache
+from collections import OrderedDict
+import threading
+
+# For expiring the cached pages
+from time import monotonic
+
+from functools import wraps
+
+
+# Cache of rendered pages bounded by their total size and optionally by their number, evicting the least recently used pages first.
+# Every page carries tags naming the data it was rendered from, and invalidating a tag drops the pages carrying it
+class PageCache:
+
+    def __init__(self, max_bytes, ttl, max_entries=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.pages = OrderedDict()
+        self.tagged = {}
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    # Fetch the page stored under the key, None if it is not cached or has expired
+    def get(self, key):
+        with self.lock:
+            entry = self.pages.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            body, tags, stored, size = entry
+            if monotonic() - stored > self.ttl:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self.pages.move_to_end(key)
+            self.hits += 1
+            return body
+
+    # Current invalidation counts of the tags, for detecting writes that happen while a page is rendered
+    def tag_versions(self, tags):
+        with self.lock:
+            return [self.versions.get(tag, 0) for tag in tags]
+
+    # Store a page, unless one of its tags has been invalidated since the versions were read.
+    # The size of the page is its length unless given otherwise
+    def set(self, key, body, tags, versions, size=None):
+        if size is None:
+            size = len(body)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if [self.versions.get(tag, 0) for tag in tags] != versions:
+                return
+            if key in self.pages:
+                self._remove(key)
+            self.pages[key] = (body, tags, monotonic(), size)
+            self.size += size
+            for tag in tags:
+                self.tagged.setdefault(tag, set()).add(key)
+            while self.size > self.max_bytes or (self.max_entries and len(self.pages) > self.max_entries):
+                self._remove(next(iter(self.pages)))
+
+    # Drop the pages carrying any of the tags
+    def invalidate(self, tags):
+        with self.lock:
+            for tag in tags:
+                self.versions[tag] = self.versions.get(tag, 0) + 1
+                for key in list(self.tagged.get(tag, ())):
+                    self._remove(key)
+
+    def _remove(self, key):
+        body, tags, stored, size = self.pages.pop(key)
+        self.size -= size
+        for tag in tags:
+            keys = self.tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tagged[tag]
+
+
+# The page cache of the application, None if it is disabled
+def get_cache():
+
+    if not "pagecache" in current_app.extensions:
+        maxBytes = current_app.config["PAGE_CACHE_MAX_BYTES"]
+        current_app.extensions["pagecache"] = PageCache(maxBytes, current_app.config["PAGE_CACHE_TTL"]) if maxBytes > 0 else None
+
+    return current_app.extensions["pagecache"]
+
+
+# Drop the cached pages rendered from the data named by the tags, once the change is committed
+def invalidate(*tags):
+
+    cache = get_cache()
+    if cache is not None:
+        after_commit(lambda: cache.invalidate(tags))
+
+
+# Whether the page of the current request is stored in the page cache, as it is for the visitors who are not logged in
+def caches_request():
+
+    return get_cache() is not None and "username" not in session
+
+
+# Serve the page from the cache to the visitors who are not logged in, as they all get the same HTML.
+# The tag function is called with the arguments of the view and names the data the page is rendered from.
+# The pages are keyed by the version of their data when the conditional decorator has read it, as the invalidations
+# reach only the cache of this worker, and a page cached before a write through another worker must not be served under the new version
+def anonymous(tag_function):
+    def decorator(view):
+        @wraps(view)
+        def cached_view(**kwargs):
+            if not caches_request():
+                return view(**kwargs)
+
+            cache = get_cache()
+            key = (request.full_path, g.get("page_version"))
+            body = cache.get(key)
+            if body is not None:
+                return Response(body, mimetype="text/html")
+
+            tags = tag_function(**kwargs)
+            versions = cache.tag_versions(tags)
+            response = make_response(view(**kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                cache.set(key, response.get_data(), tags, versions)
+
+            return response
+        return cached_view
+    return decorator
+
+
+# Digest of the templates, so that the entity tags of the pages change when a new version of the templates is deployed
+TEMPLATES_DIR = path.join(path.dirname(path.abspath(__file__)), "templates")
+TEMPLATES_VERSION = sha1(b"".join(open(path.join(TEMPLATES_DIR, filename), "rb").read() for filename in sorted(listdir(TEMPLATES_DIR)))).hexdigest()
+
+
+# Answer conditional requests for the page of the view with 304 Not Modified without running the view.
+# The version function returns the version, modification time and whether the time is settled for the data of the page,
+# or None when the page cannot be validated. The entity tag combines the version with what the page shows of the user,
+# and the modification time is used only for visitors who are not logged in, as logging in does not change it
+def conditional(version_function):
+    def decorator(view):
+        @wraps(view)
+        def conditional_view(**kwargs):
+            version = version_function(**kwargs)
+            if version is None:
+                return view(**kwargs)
+
+            identity = users.get_identity()
+            if identity is None:
+                user = None
+            else:
+                user = (identity.username, identity.moderator, sorted(identity.sections))
+            etag = sha1(repr((TEMPLATES_VERSION, version.version, user)).encode()).hexdigest()
+            g.page_version = version.version
+            lastModified = version.modified_at if identity is None and version.settled else None
+
+            if is_resource_modified(request.environ, etag, last_modified=lastModified):
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+            else:
+                response = Response(status=304)
+
+            response.set_etag(etag, weak=True)
+            if lastModified:
+                response.last_modified = lastModified
+            response.cache_control.no_cache = True
+            response.cache_control.private = identity is not None
+            response.vary.add("Cookie")
+
+            return response
+        return conditional_view
+    return decorator
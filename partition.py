@@ -0,0 +1,131 @@
+from sqlalchemy import text
+
+from datetime import date
+
+
+# Indexes of the messages table, created again on the partitioned table under the same names
+MESSAGE_INDEXES = [
+    ("messages_thread_posting_time_idx", "(thread_id, posting_time, id) WHERE visible"),
+    ("messages_thread_id_idx", "(thread_id, id) WHERE visible"),
+]
+
+# Partition catching the messages outside of the monthly partitions, so that a missing partition never fails a post
+DEFAULT_PARTITION = "messages_default"
+
+
+# Whether the messages table is partitioned by the posting time
+def is_partitioned(connection):
+
+    sql = "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = CAST('messages' AS regclass))"
+
+    return connection.execute(sql).scalar()
+
+
+# First day of the month the given number of months after the month of the date given as an argument
+def add_months(day, months):
+
+    month = day.month - 1 + months
+
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+# Name of the partition holding the messages of the month starting on the date given as an argument
+def partition_name(month):
+
+    return "messages_%04d_%02d" % (month.year, month.month)
+
+
+# Create the monthly partitions of the table given as an argument from the month of the first date up to the month of the last one,
+# skipping the partitions that exist already. Messages of the new months found in the default partition are moved into the new partitions.
+# Returns the names of the created partitions
+def create_partitions(connection, table, first, last):
+
+    sql = "SELECT C.relname FROM pg_inherits I JOIN pg_class C ON C.oid = I.inhrelid WHERE I.inhparent = CAST(:table AS regclass)"
+    existing = {row.relname for row in connection.execute(text(sql), {"table": table})}
+
+    created = []
+    month = add_months(first, 0)
+    last = add_months(last, 0)
+    while month <= last:
+        name = partition_name(month)
+        if name not in existing:
+            end = add_months(month, 1)
+            # Posting waits until the partition is attached, so that no message of the month is left behind in the default partition
+            connection.execute("LOCK TABLE " + DEFAULT_PARTITION + " IN ACCESS EXCLUSIVE MODE")
+            connection.execute("CREATE TABLE " + name + " (LIKE " + table + " INCLUDING DEFAULTS)")
+            sql = "WITH moved AS (DELETE FROM " + DEFAULT_PARTITION + " WHERE posting_time >= :start AND posting_time < :end RETURNING *)" \
+            " INSERT INTO " + name + " SELECT * FROM moved"
+            connection.execute(text(sql), {"start": month, "end": end})
+            connection.execute("ALTER TABLE " + table + " ATTACH PARTITION " + name + " FOR VALUES FROM ('" + month.isoformat() + "') TO ('" + end.isoformat() + "')")
+            created.append(name)
+        month = add_months(month, 1)
+
+    return created
+
+
+# Create the partitions of the partitioned messages table for the current month and the given number of months ahead.
+# Run from a scheduled job, so that the new messages never end up in the default partition. Returns the names of the created partitions
+def create_future_partitions(engine, months_ahead):
+
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            raise ValueError("The messages table is not partitioned, run flask partition-messages first")
+
+        today = date.today()
+        created = create_partitions(connection, "messages", today, add_months(today, months_ahead))
+
+        # Partitioned tables are not analyzed by autovacuum, only their partitions are
+        connection.execute("ANALYZE messages")
+
+    return created
+
+
+# Replace the messages table with a table partitioned by the month of the posting time, with partitions from the month of the oldest message
+# up to the given number of months ahead. The rows are copied within a single transaction: the messages stay readable while they are copied
+# and indexed, but posting waits until the new table has replaced the old one. Returns the number of messages copied
+def partition_messages(engine, months_ahead):
+
+    with engine.begin() as connection:
+        if is_partitioned(connection):
+            raise ValueError("The messages table is partitioned already")
+
+        connection.execute("LOCK TABLE messages IN EXCLUSIVE MODE")
+        missing = connection.execute("SELECT count(*) FROM messages WHERE posting_time IS NULL").scalar()
+        if missing:
+            raise ValueError("%d messages have no posting time, set it before partitioning" % missing)
+
+        today = date.today()
+        first, last = connection.execute("SELECT min(posting_time), max(posting_time) FROM messages").fetchone()
+        first = first.date() if first else today
+        last = max(last.date() if last else today, add_months(today, months_ahead))
+
+        # The posting time is part of the primary key, as the unique indexes of a partitioned table have to include the partition key
+        connection.execute("CREATE TABLE messages_partitioned (LIKE messages INCLUDING DEFAULTS) PARTITION BY RANGE (posting_time)")
+        connection.execute("CREATE TABLE " + DEFAULT_PARTITION + " PARTITION OF messages_partitioned DEFAULT")
+        create_partitions(connection, "messages_partitioned", first, last)
+
+        # The indexes and foreign keys are added after the copy, which is faster than updating them row by row
+        messageCount = connection.execute("INSERT INTO messages_partitioned SELECT * FROM messages").rowcount
+        connection.execute("ALTER TABLE messages_partitioned ADD CONSTRAINT messages_partitioned_pkey PRIMARY KEY (id, posting_time)")
+        for name, definition in MESSAGE_INDEXES:
+            connection.execute("CREATE INDEX " + name + "_partitioned ON messages_partitioned " + definition)
+        connection.execute("ALTER TABLE messages_partitioned ADD CONSTRAINT messages_user_id_fkey FOREIGN KEY (user_id) REFERENCES users," \
+                           " ADD CONSTRAINT messages_thread_id_fkey FOREIGN KEY (thread_id) REFERENCES threads")
+
+        # The message ids are no longer unique on their own, so the search documents cannot reference them with a foreign key
+        connection.execute("ALTER TABLE search_documents DROP CONSTRAINT IF EXISTS search_documents_message_id_fkey")
+
+        # Swap the tables, keeping the sequence of the message ids
+        sequence = connection.execute("SELECT pg_get_serial_sequence('messages', 'id')").scalar()
+        connection.execute("ALTER SEQUENCE " + sequence + " OWNED BY NONE")
+        connection.execute("DROP TABLE messages")
+        connection.execute("ALTER TABLE messages_partitioned RENAME TO messages")
+        connection.execute("ALTER SEQUENCE " + sequence + " OWNED BY messages.id")
+        connection.execute("ALTER INDEX messages_partitioned_pkey RENAME TO messages_pkey")
+        for name, definition in MESSAGE_INDEXES:
+            connection.execute("ALTER INDEX " + name + "_partitioned RENAME TO " + name)
+
+        # Planner statistics for the new table
+        connection.execute("ANALYZE messages")
+
+    return messageCount
@@ -0,0 +1,112 @@
+from flask import current_app, request, Response
+
+import users
+
+from functools import wraps
+
+# For the token buckets shared by the worker processes
+import sqlite3, threading, math
+
+# For refilling the buckets
+from time import time
+
+
+# Seconds between the removals of the buckets that have filled up again, which are the same as no bucket at all
+PRUNE_INTERVAL = 60
+
+# Requests refused by this worker process, by the name of the limit
+limitedCount = {}
+limitedLock = threading.Lock()
+
+
+# Token buckets kept in a SQLite file, so that every worker process on the host takes from the same buckets.
+# A bucket holds up to its capacity in tokens and is refilled at its rate; each request takes a token
+class BucketStore:
+
+    def __init__(self, filename):
+        self.connection = sqlite3.connect(filename, timeout=5, isolation_level=None, check_same_thread=False)
+        # The counts are not worth a disk flush on every request: at worst a crash refills the buckets
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+        self.lock = threading.Lock()
+        self.pruned = time()
+
+    # Take a token from the bucket. Returns 0 if there was one, otherwise the seconds until there is
+    def take(self, key, capacity, rate):
+
+        # The connection commits the transaction at the end of the block, or rolls it back on an error
+        with self.lock, self.connection:
+            now = time()
+            self.connection.execute("BEGIN IMMEDIATE")
+            bucket = self.connection.execute("SELECT tokens, updated FROM buckets WHERE key=?", (key,)).fetchone()
+            tokens = capacity if bucket is None else min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                self.connection.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+                wait = 0
+            else:
+                wait = (1 - tokens) / rate
+            if now - self.pruned > PRUNE_INTERVAL:
+                self.prune(now)
+
+        return wait
+
+    # Remove the buckets that have had time to fill up, given the slowest refill of the configured limits
+    def prune(self, now):
+
+        longest = max(seconds for count, seconds in current_app.config["RATE_LIMITS"].values())
+        self.connection.execute("DELETE FROM buckets WHERE updated < ?", (now - longest,))
+        self.pruned = now
+
+
+# The bucket store of the worker process, opened on first use
+def get_store():
+
+    if not "ratelimit" in current_app.extensions:
+        current_app.extensions["ratelimit"] = BucketStore(current_app.config["RATE_LIMIT_STORE"])
+
+    return current_app.extensions["ratelimit"]
+
+
+# Take a token for the request from the bucket of the client address and from that of the user under the limit of the given name.
+# Returns 0 if the request is within the limits, otherwise the seconds until it would be
+def check(name, user):
+
+    rate = current_app.config["RATE_LIMITS"].get(name)
+    if not rate:
+        return 0
+
+    count, seconds = rate
+    keys = [name + ":ip:" + str(request.remote_addr)]
+    if user:
+        keys.append(name + ":user:" + str(user))
+
+    store = get_store()
+    return max(store.take(key, count, count / seconds) for key in keys)
+
+
+# Limit the requests of the view to the rate configured in RATE_LIMITS under the given name, for each client address
+# and for each user: the logged in user, or the one given by the user function, such as the username tried in a login.
+# Requests over the limit are answered with 429 Too Many Requests and the seconds to wait in Retry-After
+def limit(name, user_function=None):
+    def decorator(view):
+        @wraps(view)
+        def limited_view(**kwargs):
+            if user_function is not None:
+                user = user_function()
+            else:
+                identity = users.get_identity()
+                user = identity.id if identity else None
+
+            wait = check(name, user)
+            if wait:
+                with limitedLock:
+                    limitedCount[name] = limitedCount.get(name, 0) + 1
+                retryAfter = str(math.ceil(wait))
+                return Response("Too many requests, try again in " + retryAfter + " seconds", status=429,
+                                headers={"Retry-After": retryAfter}, mimetype="text/plain")
+
+            return view(**kwargs)
+        return limited_view
+    return decorator
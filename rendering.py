@@ -0,0 +1,82 @@
+from flask import Response, current_app, render_template, stream_with_context
+
+# For the compiled templates kept on disk
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+
+from os import makedirs
+
+import pagecache
+
+
+# Output of the flush variable of the layout in the streamed pages, after which the head of the page is sent on before the body is rendered
+FLUSH = Markup("<!-- flush -->")
+
+
+# Compiled templates on disk, found by the template names alone. The default keys include the path of the template file,
+# which differs between the build directory the templates are compiled in and the directory the app runs in
+class TemplateCache(FileSystemBytecodeCache):
+
+    def get_cache_key(self, name, filename=None):
+        return super().get_cache_key(name)
+
+
+# Keep the compiled templates in TEMPLATE_CACHE_DIR, unless the setting is empty
+def init_app(app):
+
+    directory = app.config["TEMPLATE_CACHE_DIR"]
+    if directory:
+        makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = TemplateCache(directory)
+
+
+# Compile every template into the template cache. Returns the number of templates
+def compile_templates(app):
+
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+
+    return len(names)
+
+
+# Join the pieces of a page rendered by Jinja into chunks of at least the given number of characters.
+# The pieces before the flush marker are sent on right away, so that the browser gets the head of the page while the body is rendered
+def chunks(pieces, size):
+
+    buffer = []
+    length = 0
+    for piece in pieces:
+        if piece == FLUSH:
+            length = size
+        else:
+            buffer.append(piece)
+            length += len(piece)
+        if length >= size and buffer:
+            yield "".join(buffer)
+            buffer = []
+            length = 0
+
+    if buffer:
+        yield "".join(buffer)
+
+
+# Send the page rendered from the template in chunks while it is being rendered, so that the whole page is never held in memory.
+# Iterators in the context, such as the messages read from a server-side cursor, are consumed only as the page is rendered
+def stream_page(name, **context):
+
+    app = current_app._get_current_object()
+    context["flush"] = FLUSH
+    app.update_template_context(context)
+    pieces = app.jinja_env.get_template(name).generate(context)
+
+    return Response(stream_with_context(chunks(pieces, app.config["STREAM_CHUNK_BYTES"])))
+
+
+# Render the page from the template, streaming it if STREAMED_PAGES is on and the page is not going to be stored in the page cache
+def render_page(name, **context):
+
+    if not current_app.config["STREAMED_PAGES"] or pagecache.caches_request():
+        return render_template(name, **context)
+
+    return stream_page(name, **context)
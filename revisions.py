@@ -0,0 +1,281 @@
+from db import db
+
+import users
+
+# For the deltas between the versions of a text and the diffs shown to the moderators
+import difflib, json, re, zlib
+
+from sqlalchemy import text
+
+
+# Words along with the whitespace after them, the units the deltas and diffs are formed of, so that a change within a long
+# paragraph costs the words changed rather than the whole line
+TOKEN = re.compile(r"\S+\s*|\s+")
+
+# Deltas applied at most to reach any version once flask compact-revisions has rebased the chains
+DEFAULT_MAX_CHAIN = 20
+
+# Rows of the revisions of a thread, which have no message, and of a message
+THREAD_CONDITION = "thread_id=:thread_id AND message_id IS NULL"
+MESSAGE_CONDITION = "message_id=:message_id"
+
+
+# The text versioned for a thread: its title on the first line and its content after it
+def thread_text(thread_name, content):
+
+    return thread_name + "\n" + content
+
+
+# Opcodes of difflib turning the tokens a into the tokens b. The common beginning and end are matched first,
+# so that an edit at one place of a long post compares only the tokens between them
+def opcodes(a, b):
+
+    limit = min(len(a), len(b))
+    prefix = 0
+    while prefix < limit and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+
+    codes = [("equal", 0, prefix, 0, prefix)] if prefix else []
+    matcher = difflib.SequenceMatcher(None, a[prefix:len(a) - suffix], b[prefix:len(b) - suffix], autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        codes.append((tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix))
+    if suffix:
+        codes.append(("equal", len(a) - suffix, len(a), len(b) - suffix, len(b)))
+
+    return codes
+
+
+# Encode the older version of a text against the newer one that replaces it. The delta is a list of the token ranges
+# copied from the newer text and the text in between, compressed; if a compressed copy of the whole text is no larger, that is stored instead.
+# Returns whether the data is a snapshot, and the data
+def encode(newerText, olderText):
+
+    newerTokens = TOKEN.findall(newerText)
+    olderTokens = TOKEN.findall(olderText)
+    delta = []
+    for tag, i1, i2, j1, j2 in opcodes(newerTokens, olderTokens):
+        if tag == "equal":
+            delta.append([i1, i2])
+        elif j2 > j1:
+            delta.append("".join(olderTokens[j1:j2]))
+
+    deltaData = zlib.compress(json.dumps(delta, separators=(",", ":")).encode())
+    snapshotData = zlib.compress(olderText.encode())
+    if len(snapshotData) <= len(deltaData):
+        return True, snapshotData
+
+    return False, deltaData
+
+
+# Decode the older version of a text out of its stored data and the newer version
+def decode(snapshot, data, newerText):
+
+    if snapshot:
+        return zlib.decompress(data).decode()
+
+    newerTokens = TOKEN.findall(newerText)
+    parts = []
+    for part in json.loads(zlib.decompress(data)):
+        if isinstance(part, str):
+            parts.append(part)
+        else:
+            parts.append("".join(newerTokens[part[0]:part[1]]))
+
+    return "".join(parts)
+
+
+# Store the version of a thread or message replaced by an edit of the user, numbered after the earlier ones.
+# Must be called within the transaction of the edit, after the row of the post has been locked by its update: the lock is what keeps
+# two edits from taking the same number, the unique index on the revisions only makes the later one fail if they still do
+def record(thread_id, message_id, olderText, newerText):
+
+    if olderText == newerText:
+        return
+
+    snapshot, data = encode(newerText, olderText)
+    condition = MESSAGE_CONDITION if message_id else THREAD_CONDITION
+    sql = "INSERT INTO revisions (thread_id, message_id, revision, user_id, snapshot, data)" \
+    " SELECT :thread_id, CAST(:message_id AS INTEGER), COALESCE(max(revision), 0) + 1, :user_id, :snapshot, :data FROM revisions WHERE " + condition
+    db.session.execute(sql, {"thread_id": thread_id, "message_id": message_id, "user_id": users.get_user_id(), "snapshot": snapshot, "data": data})
+
+
+# Current text of a thread or message, read from the archive if it has been moved there, None if there is no such post.
+# The lock keeps the post from being edited until the end of the transaction
+def _current_text(connection, thread_id, message_id, lock=False):
+
+    locking = " FOR SHARE" if lock else ""
+    if message_id:
+        for table in ["messages", "messages_archive"]:
+            sql = "SELECT content FROM " + table + " WHERE id=:message_id" + locking
+            message = connection.execute(text(sql), {"message_id": message_id}).fetchone()
+            if message:
+                return message.content
+    else:
+        for table in ["threads", "threads_archive"]:
+            sql = "SELECT thread_name, content FROM " + table + " WHERE id=:thread_id" + locking
+            thread = connection.execute(text(sql), {"thread_id": thread_id}).fetchone()
+            if thread:
+                return thread_text(thread.thread_name, thread.content)
+
+    return None
+
+
+# Word by word changes from the older text to the newer one, as a list of ("equal" | "delete" | "insert", text)
+def diff(olderText, newerText):
+
+    olderTokens = TOKEN.findall(olderText)
+    newerTokens = TOKEN.findall(newerText)
+    changes = []
+    for tag, i1, i2, j1, j2 in opcodes(olderTokens, newerTokens):
+        if tag == "equal":
+            changes.append(("equal", "".join(olderTokens[i1:i2])))
+            continue
+        if i2 > i1:
+            changes.append(("delete", "".join(olderTokens[i1:i2])))
+        if j2 > j1:
+            changes.append(("insert", "".join(newerTokens[j1:j2])))
+
+    return changes
+
+
+# The edit history of a thread, or of a message when message_id is given, for a moderator whose access to the section has been checked:
+# the list of the versions, the given revision (the current one if None), and its text and changes. The post is looked up along with
+# the thread and section it is in, from the archive if it has been moved there, and None is returned unless they are the ones given,
+# so that the section checked by the caller is the one the post is in. Also None if there is no such revision
+def get_history(section_id, thread_id, message_id, revision=None):
+
+    post = _find_post(thread_id, message_id)
+    if post is None or str(post.section_id) != str(section_id) or str(post.thread_id) != str(thread_id):
+        return None
+    currentText = post.content if message_id else thread_text(post.thread_name, post.content)
+
+    versions = _list_versions(thread_id, message_id)
+    if revision is None:
+        revision = versions[0]["revision"]
+    version = _get_version(thread_id, message_id, revision, currentText)
+    if version is None:
+        return None
+
+    return versions, revision, version
+
+
+# The thread and section of a thread or message and its current content, from the archive if it has been moved there. None if there is no such post
+def _find_post(thread_id, message_id):
+
+    if message_id:
+        sql = "SELECT M.thread_id, T.section_id, M.content FROM messages M JOIN threads T ON T.id = M.thread_id WHERE M.id=:message_id" \
+        " UNION ALL SELECT M.thread_id, T.section_id, M.content FROM messages_archive M" \
+        " JOIN (SELECT id, section_id FROM threads UNION ALL SELECT id, section_id FROM threads_archive) T ON T.id = M.thread_id WHERE M.id=:message_id"
+    else:
+        sql = "SELECT id AS thread_id, section_id, thread_name, content FROM threads WHERE id=:thread_id" \
+        " UNION ALL SELECT id AS thread_id, section_id, thread_name, content FROM threads_archive WHERE id=:thread_id"
+
+    return db.session.execute(sql, {"thread_id": thread_id, "message_id": message_id}).fetchone()
+
+
+# The versions of a thread or message, the current one first, each with the time and user of the edit that produced it. Only the list is read, not the texts
+def _list_versions(thread_id, message_id):
+
+    condition = MESSAGE_CONDITION if message_id else THREAD_CONDITION
+    sql = "SELECT R.revision, R.replaced_at, U.username FROM revisions R LEFT JOIN users U ON U.id = R.user_id" \
+    " WHERE " + condition + " ORDER BY R.revision DESC"
+    rows = db.session.execute(sql, {"thread_id": thread_id, "message_id": message_id}).fetchall()
+
+    # Each revision row is the version an edit replaced, so it holds the time and user of the edit of the version after it
+    versions = []
+    revision = rows[0].revision + 1 if rows else 1
+    for row in rows:
+        versions.append({"revision": revision, "edited_at": row.replaced_at, "editor": row.username})
+        revision = row.revision
+    versions.append({"revision": revision, "edited_at": None, "editor": None})
+
+    return versions
+
+
+# Text of a version of a thread or message and its changes from the version before it. Only the revisions between the version and
+# the nearest snapshot or the current text are read, which compaction keeps to a bounded number. Returns None if there is no such version
+def _get_version(thread_id, message_id, revision, currentText):
+
+    if revision < 1:
+        return None
+    condition = MESSAGE_CONDITION if message_id else THREAD_CONDITION
+    sql = "SELECT revision, snapshot, data FROM revisions WHERE " + condition + " AND revision >= :older" \
+    " AND revision <= (SELECT COALESCE(min(revision), 2147483647) FROM revisions WHERE " + condition + " AND snapshot AND revision >= :revision)" \
+    " ORDER BY revision DESC"
+    params = {"thread_id": thread_id, "message_id": message_id, "revision": revision, "older": max(revision - 1, 1)}
+    rows = db.session.execute(sql, params).fetchall()
+
+    texts = {}
+    newerText = currentText
+    for row in rows:
+        newerText = decode(row.snapshot, row.data, newerText)
+        texts[row.revision] = newerText
+
+    # Unless they end at a snapshot of the version or a later one, the rows reach the newest revision, after which comes the current text
+    if not rows or not (rows[0].snapshot and rows[0].revision >= revision):
+        texts[rows[0].revision + 1 if rows else 1] = currentText
+
+    if not revision in texts:
+        return None
+    if revision == 1:
+        return {"text": texts[1], "changes": [("equal", texts[1])]}
+
+    return {"text": texts[revision], "changes": diff(texts[revision - 1], texts[revision])}
+
+
+# Rebase a chain of revisions, given newest first as (id, snapshot, data) along with the current text, so that no version lies more than
+# max_chain deltas away from the current text or a snapshot. Returns the (id, data) of the revisions to be replaced with snapshots
+def rebase_chain(currentText, rows, max_chain):
+
+    snapshots = []
+    newerText = currentText
+    chain = 0
+    for row_id, snapshot, data in rows:
+        newerText = decode(snapshot, data, newerText)
+        chain = 0 if snapshot else chain + 1
+        if chain > max_chain:
+            snapshots.append((row_id, zlib.compress(newerText.encode())))
+            chain = 0
+
+    return snapshots
+
+
+# Rebase the chains of revisions with runs of more than max_chain deltas, each post in a transaction of its own during which it cannot be edited.
+# Returns the number of posts rebased, the snapshots written and the total size of the revision data before and after in bytes
+def compact(engine, max_chain=DEFAULT_MAX_CHAIN):
+
+    sizeSql = "SELECT COALESCE(sum(octet_length(data)), 0) FROM revisions"
+
+    # The runs of deltas are numbered by the snapshots before them, counted from the newest revision
+    sql = "SELECT DISTINCT thread_id, message_id FROM (SELECT thread_id, message_id, snapshot," \
+    " count(*) FILTER (WHERE snapshot) OVER (PARTITION BY thread_id, message_id ORDER BY revision DESC) AS run FROM revisions) R" \
+    " WHERE NOT snapshot GROUP BY thread_id, message_id, run HAVING count(*) > :max_chain"
+
+    postCount = 0
+    snapshotCount = 0
+    with engine.connect() as connection:
+        sizeBefore = connection.execute(text(sizeSql)).scalar()
+        posts = connection.execute(text(sql), {"max_chain": max_chain}).fetchall()
+
+        for post in posts:
+            with connection.begin():
+                currentText = _current_text(connection, post.thread_id, post.message_id, lock=True)
+                if currentText is None:
+                    continue
+
+                condition = MESSAGE_CONDITION if post.message_id else THREAD_CONDITION
+                sql = "SELECT id, snapshot, data FROM revisions WHERE " + condition + " ORDER BY revision DESC"
+                rows = connection.execute(text(sql), {"thread_id": post.thread_id, "message_id": post.message_id}).fetchall()
+
+                for row_id, data in rebase_chain(currentText, rows, max_chain):
+                    sql = "UPDATE revisions SET snapshot=true, data=:data WHERE id=:id"
+                    connection.execute(text(sql), {"id": row_id, "data": data})
+                    snapshotCount += 1
+                postCount += 1
+
+        sizeAfter = connection.execute(text(sizeSql)).scalar()
+
+    return postCount, snapshotCount, sizeBefore, sizeAfter
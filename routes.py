@@ -1,23 +1,32 @@
-from app import app
 from db import db
 
-import users, forum
+import users, forum, search, pagecache, live, rendering, ratelimit, admission, revisions
 
 #from flask import Flask
-from flask import abort
+from flask import Blueprint, abort, current_app
 from flask import redirect, render_template, request, session
+from flask import Response, stream_with_context, jsonify
 
 # For formatting time stamp printing
 from datetime import datetime
 
+# The pages of the forum, registered on the application by create_app
+blueprint = Blueprint("forum", __name__)
+
+# The page to return to after logging in or registering, only paths within the forum are accepted
+def next_url(url):
+
+    if url and url.startswith("/") and not url.startswith("//"):
+        return url
+    else:
+        return "/"
+
+
 # Root page
-@app.route("/")
+@blueprint.route("/")
+@pagecache.anonymous(lambda: ["index"])
 def index():
 
-    if not "username" in session:
-        # Set the session url in case the user is not yet logged in
-        session["url"] = "/"
-    
     # Check whether the user is a moderator
     isModerator = users.is_moderator()
 
@@ -28,23 +37,25 @@ def index():
 
 
 # User registration page
-@app.route("/register")
+@blueprint.route("/register")
 def register():
 
-	return render_template("register.html", error=  None, prevURL = session["url"])
+	return render_template("register.html", error=  None, prevURL = next_url(request.args.get("next")))
 
 
 # Account creation process
-@app.route("/createaccount", methods=["POST"])
+@blueprint.route("/createaccount", methods=["POST"])
+@ratelimit.limit("createaccount")
 def createaccount():
 
     username = request.form["username"]
     password = request.form["password"]
+    prevURL  = next_url(request.form.get("next"))
 
 	# Check that both the username and password are input
     if not username or not password:
         error = "Please type in both the username and password"
-        return render_template("register.html", error = error, prevURL = session["url"])
+        return render_template("register.html", error = error, prevURL = prevURL)
 
     if users.create_account(username, password):
         # Account creation successful
@@ -52,40 +63,39 @@ def createaccount():
     else:
         # Account creation unsuccesful, provide the user an error message
         error = "Username already in use"
-        return render_template("register.html", error = error, prevURL = session["url"])
+        return render_template("register.html", error = error, prevURL = prevURL)
 
 # Login page
-@app.route("/loginpage")
+@blueprint.route("/loginpage")
 def loginpage():
 
-	return render_template("loginpage.html", error = None, prevURL = session["url"])
+	return render_template("loginpage.html", error = None, prevURL = next_url(request.args.get("next")))
 
 
 # Log in information processing
-@app.route("/login", methods=['POST'])
+@blueprint.route("/login", methods=['POST'])
+@ratelimit.limit("login", lambda: request.form.get("username"))
 def login():
     username = request.form["username"]
     password = request.form["password"]
+    prevURL  = next_url(request.form.get("next"))
 
 	# Check if something has been input
     if not username or not password:
         error = "Please type in both the username and password"
-        return render_template("loginpage.html", error = error, prevURL = session["url"])
+        return render_template("loginpage.html", error = error, prevURL = prevURL)
 
     if users.login(username, password):
-        # Login successful
-        if "url" in session:
-            return redirect(session["url"])
-        else:
-            return redirect("/")
+        # Login successful, return to the page the user came from
+        return redirect(prevURL)
     else:
         # Login unsuccesful, provide the user an error message
         error = "Invalid username or password"
-        return render_template("loginpage.html", error = error, prevURL = session["url"])
+        return render_template("loginpage.html", error = error, prevURL = prevURL)
 
 
 # Log out processing
-@app.route("/logout")
+@blueprint.route("/logout")
 def logout():
 	
     users.logout()
@@ -94,11 +104,10 @@ def logout():
 
 
 # Pages for different sections
-@app.route("/section/<id>")
+@blueprint.route("/section/<id>")
+@pagecache.conditional(lambda id: forum.get_section_version(id))
+@pagecache.anonymous(lambda id: ["section:" + str(id)])
 def section(id):
-	# Set the session url in case the user is not yet logged in
-    if not "username" in session:
-        session["url"] = "/section/" + str(id)
 
     # Check if the user has access to the section
     hasAccess = users.check_section_access(id)
@@ -109,14 +118,20 @@ def section(id):
     sectionName = forum.get_section_name(id)
     isPrivate = forum.check_section_privacy(id)
 
-    # Fetch the threads within the section
-    threads = forum.list_threads(id)
+    # Threads are ordered either by their creation time or by their latest reply
+    sort = request.args.get("sort", "newest")
+    if sort not in forum.THREAD_SORT_KEYS:
+        sort = "newest"
+
+    # Fetch the page of threads within the section
+    threads, nextCursor, prevCursor = forum.list_threads(id, sort, request.args.get("after"), request.args.get("before"))
 	
-    return render_template("section.html", id = id, threads = threads, sectionName = sectionName, isPrivate = isPrivate, isModerator = isModerator, hasAccess = hasAccess)
+    return rendering.render_page("section.html", id = id, threads = threads, sectionName = sectionName, isPrivate = isPrivate, isModerator = isModerator, hasAccess = hasAccess,
+                           sort = sort, nextCursor = nextCursor, prevCursor = prevCursor)
 
 
 # Thread creation page
-@app.route("/section/<id>/createthread")
+@blueprint.route("/section/<id>/createthread")
 def createthread(id):
 	if not "username" in session:
         # User is not logged in, thread creation not possible
@@ -129,7 +144,8 @@ def createthread(id):
 
 
 # Posting the thread to the database
-@app.route("/section/<id>/post_thread", methods = ["POST"])
+@blueprint.route("/section/<id>/post_thread", methods = ["POST"])
+@ratelimit.limit("post_thread")
 def post_thread(id):
 
 	# Prevent CRSF vulnerability exploitation
@@ -151,26 +167,87 @@ def post_thread(id):
 
 
 # Pages for different threads
-@app.route("/section/<id>/<thread_id>")
+@blueprint.route("/section/<id>/<thread_id>")
+@pagecache.conditional(lambda id, thread_id: forum.get_thread_version(thread_id))
+@pagecache.anonymous(lambda id, thread_id: ["thread:" + str(thread_id)])
 def thread(id, thread_id):
-	# Set the session url in case the user is not yet logged in
-    if not "username" in session:
-        session["url"] = "/section/" + str(id) + "/" + str(thread_id)
 
     # Check if the user has access to the section
     hasAccess = users.check_section_access(id)
     # Check if the user is a moderator
     isModerator = users.is_moderator()
 
-    # Fetch the thread and messages within it
+    # Fetch the thread, the messages of an archived thread are read from the archive
     thread = forum.get_thread(thread_id)
-    messages = forum.get_messages(thread_id)
+    archived = thread is not None and thread.archived
+
+    if request.args.get("stream"):
+        # Streamed mode: the whole thread is rendered while the messages are read from a server-side cursor
+        messages = forum.stream_messages(thread_id, archived)
+        return rendering.stream_page("thread.html", messages = messages, id = id, thread_id = thread_id, thread = thread, isModerator = isModerator,
+                                     hasAccess = hasAccess, streamed = True)
 
-    return render_template("thread.html", messages = messages, id = id, thread_id = thread_id, thread = thread, isModerator = isModerator, hasAccess = hasAccess)
+    # Fetch the page of messages within the thread
+    page = request.args.get("page", type = int)
+    newest = bool(request.args.get("newest"))
+    messages, nextCursor, prevCursor = forum.get_messages(thread_id, request.args.get("after"), request.args.get("before"), page, newest, archived)
+
+    # The number of pages is needed for jumping to a page
+    pageSize = current_app.config["MESSAGES_PER_PAGE"]
+    messageCount = thread.message_count if thread is not None else 0
+    pageCount = max(1, (messageCount + pageSize - 1) // pageSize)
+
+    # The newest page follows the new messages of the thread
+    live = nextCursor is None and not archived
+    lastMessageId = messages[-1].id if messages else 0
+
+    return rendering.render_page("thread.html", messages = messages, id = id, thread_id = thread_id, thread = thread, isModerator = isModerator, hasAccess = hasAccess,
+                           nextCursor = nextCursor, prevCursor = prevCursor, pageCount = pageCount, streamed = False, live = live, lastMessageId = lastMessageId)
+
+
+# The message id the client has already seen, from the header sent by a reconnecting event stream or from the query string
+def since_id():
+
+    since = request.headers.get("Last-Event-ID") or request.args.get("since", "0")
+
+    return int(since) if since.isdigit() else 0
+
+
+# The new messages of a thread are only followed at the address of its section, by the users with access to that section.
+# Archived threads get no new messages, so they are not found
+def check_live_access(id, thread_id):
+
+    section_id = forum.get_thread_section(thread_id)
+    if section_id is None or str(section_id) != str(id):
+        abort(404)
+    if not users.check_section_access(section_id):
+        abort(403)
+
+
+# New messages of a thread as Server-Sent Events
+@blueprint.route("/section/<id>/<thread_id>/events")
+@admission.exempt
+def thread_events(id, thread_id):
+
+    check_live_access(id, thread_id)
+
+    stream = live.stream_messages(thread_id, since_id())
+
+    return Response(stream_with_context(stream), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# New messages of a thread as JSON, waiting for a while if there are none yet. Used by the browsers without Server-Sent Events
+@blueprint.route("/section/<id>/<thread_id>/messages")
+@admission.exempt
+def thread_messages(id, thread_id):
+
+    check_live_access(id, thread_id)
+
+    return jsonify(messages = live.wait_for_messages(thread_id, since_id()))
 
 
 # Page for writing a reply to a thread
-@app.route("/section/<id>/<thread_id>/reply")
+@blueprint.route("/section/<id>/<thread_id>/reply")
 def reply(id, thread_id):
 	if not "username" in session:
         # The user is not logged in, no permission to write replies
@@ -183,7 +260,8 @@ def reply(id, thread_id):
 
 
 # Processing of the reply written to a thread
-@app.route("/section/<id>/<thread_id>/post_reply", methods = ["POST"])
+@blueprint.route("/section/<id>/<thread_id>/post_reply", methods = ["POST"])
+@ratelimit.limit("post_reply")
 def post_reply(id, thread_id):
 
 	# Prevent CRSF vulnerability exploitation
@@ -197,14 +275,18 @@ def post_reply(id, thread_id):
         error = "Empty replies are not allowed"
         return render_template("reply.html", id = id, thread_id = thread_id, error = error, hasAccess = True)	
 
-    # Add the message to the database
-    forum.post_message(content, thread_id)
+    # Add the message to the database, unless the thread has been deleted meanwhile
+    try:
+        forum.post_message(content, thread_id)
+    except ValueError as error:
+        return render_template("reply.html", id = id, thread_id = thread_id, error = str(error), hasAccess = True)
 
-    return redirect("/section/" + str(id) + "/" + str(thread_id))
+    # Show the newest page of the thread, on which the reply is found
+    return redirect("/section/" + str(id) + "/" + str(thread_id) + "?newest=1")
 
 
 # Editing a thread
-@app.route("/section/<id>/<thread_id>/edit_thread")
+@blueprint.route("/section/<id>/<thread_id>/edit_thread")
 def edit_thread(id, thread_id):
 	
     if not "username" in session:
@@ -225,7 +307,7 @@ def edit_thread(id, thread_id):
 
 
 # Updating the thread database according to the edits
-@app.route("/section/<id>/<thread_id>/post_thread_edit", methods = ["POST"])
+@blueprint.route("/section/<id>/<thread_id>/post_thread_edit", methods = ["POST"])
 def post_thread_edit(id, thread_id):
 
     # Prevent CRSF vulnerability exploitation
@@ -248,7 +330,7 @@ def post_thread_edit(id, thread_id):
 
 
 # Editing a message in a thread
-@app.route("/section/<id>/<thread_id>/<message_id>/edit_message")
+@blueprint.route("/section/<id>/<thread_id>/<message_id>/edit_message")
 def edit_message(id, thread_id, message_id):
 
     if not "username" in session:
@@ -269,7 +351,7 @@ def edit_message(id, thread_id, message_id):
 
 
 # Updating the message database according to the edits
-@app.route("/section/<id>/<thread_id>/<message_id>/post_message_edit", methods = ["POST"])
+@blueprint.route("/section/<id>/<thread_id>/<message_id>/post_message_edit", methods = ["POST"])
 def post_message_edit(id, thread_id, message_id):
 
 	# Prevent CRSF vulnerability exploitation
@@ -290,7 +372,7 @@ def post_message_edit(id, thread_id, message_id):
 
 
 # Deleting a message in a thread
-@app.route("/section/<id>/<thread_id>/<message_id>/delete_message")
+@blueprint.route("/section/<id>/<thread_id>/<message_id>/delete_message")
 def delete_message(id, thread_id, message_id):
     if not "username" in session:
         # User is not logged in, no permission to delete messages
@@ -304,7 +386,7 @@ def delete_message(id, thread_id, message_id):
 
 
 # Deleting a thread and all its associated messages
-@app.route("/section/<id>/<thread_id>/delete_thread")
+@blueprint.route("/section/<id>/<thread_id>/delete_thread")
 def delete_thread(id, thread_id):
 	    
     if not "username" in session:
@@ -320,24 +402,60 @@ def delete_thread(id, thread_id):
             return redirect("/section/" + str(id) + "/" + str(thread_id))
 
 
-# Processing of search results 
-@app.route("/result", methods=["GET"])
+# Edit history of a thread or message: the list of its versions, and the version given in the query string
+# (the current one by default) with the changes made to it by its edit. Only shown to the moderators with access to the section
+def show_history(id, thread_id, message_id, kind):
+
+    if users.get_section(id) is None:
+        abort(404)
+    # The user needs to be a moderator and have access to the section
+    if not (users.check_section_access(id) and users.is_moderator()):
+        abort(403)
+
+    # Not found unless the post is in the thread and section of the address
+    history = revisions.get_history(id, thread_id, message_id, request.args.get("revision", type = int))
+    if history is None:
+        abort(404)
+    versions, revision, version = history
+
+    return render_template("history.html", id = id, thread_id = thread_id, message_id = message_id, kind = kind, versions = versions,
+                           revision = revision, version = version, isModerator = True)
+
+
+# Edit history of a thread
+@blueprint.route("/section/<id>/<thread_id>/history")
+def thread_history(id, thread_id):
+
+    return show_history(id, thread_id, None, "thread")
+
+
+# Edit history of a message
+@blueprint.route("/section/<id>/<thread_id>/<message_id>/history")
+def message_history(id, thread_id, message_id):
+
+    return show_history(id, thread_id, message_id, "message")
+
+
+# Processing of search results
+@blueprint.route("/result", methods=["GET"])
+@admission.expensive
+@ratelimit.limit("search")
 def result():
 
     # Store the previous url to enable returning to it
     prevURL = request.args["prevURL"]
 
-    # Set the query to lowercase to prevent case sensitivity
-    query = request.args["query"].lower()
+    query = request.args["query"]
+    page = max(1, request.args.get("page", 1, type = int))
 
-    # Fetch the threads and messages matching the query
-    messages, threads = forum.search_forum(query)
+    # Fetch the page of threads and messages matching the query
+    results, hasMore = search.search_forum(query, page)
 
-    return render_template("result.html", messages = messages, threads = threads, prevURL = prevURL)
+    return render_template("result.html", results = results, query = query, page = page, hasMore = hasMore, prevURL = prevURL)
 
 
 # Creation of sections
-@app.route("/createsection")
+@blueprint.route("/createsection")
 def createsection():
 
     # User with moderator status can create sections
@@ -346,7 +464,7 @@ def createsection():
     return render_template("createsection.html", error = None, hasAccess = hasAccess)
 
 # Adding the section to the database table
-@app.route("/post_section", methods=["POST"])
+@blueprint.route("/post_section", methods=["POST"])
 def post_section():
 
     # Prevent CRSF vulnerability exploitation
@@ -373,7 +491,7 @@ def post_section():
     return redirect("/")
 
 # Deleting a section
-@app.route("/deletesection/<section_id>")
+@blueprint.route("/deletesection/<section_id>")
 def deletesection(section_id):
 
     if "username" in session:
@@ -383,7 +501,7 @@ def deletesection(section_id):
     return redirect("/")
 
 # Granting a user moderator rights
-@app.route("/promoteuser")
+@blueprint.route("/promoteuser")
 def promoteuser():
 
     # The user has to be a moderator
@@ -394,7 +512,7 @@ def promoteuser():
 		
 
 # Applying the promotion to the user table
-@app.route("/applyPromotion", methods=["POST"])
+@blueprint.route("/applyPromotion", methods=["POST"])
 def applyPromotion():
 
     # Prevent CRSF vulnerability exploitation
@@ -416,7 +534,7 @@ def applyPromotion():
         return render_template("promoteuser.html", error = error)
 
 # Page for granting a user access to a private section
-@app.route("/<id>/grantuseraccess")
+@blueprint.route("/<id>/grantuseraccess")
 def grantuseraccess(id):
     
     if not "username" in session:
@@ -432,7 +550,7 @@ def grantuseraccess(id):
 
 
 # Applying the user access to the private section
-@app.route("/<id>/applyuseraccess", methods=["POST"])
+@blueprint.route("/<id>/applyuseraccess", methods=["POST"])
 def applyuseraccess(id):
 
     # Prevent CRSF vulnerability exploitation
@@ -2,9 +2,10 @@
 
 
 /* Table for storing users */
-CREATE TABLE users (id SERIAL PRIMARY KEY, username TEXT, password TEXT, moderator BOOLEAN DEFAULT false);
-INSERT INTO users (username, password, moderator) VALUES ('root', 'root', true);
-INSERT INTO users (username, password) VALUES ('tester', '123');
+CREATE TABLE users (id SERIAL PRIMARY KEY, username TEXT, password TEXT, moderator BOOLEAN DEFAULT false, section_access INTEGER[] NOT NULL DEFAULT '{}');
+/* Example accounts for testing purposes, with the passwords root and 123 */
+INSERT INTO users (username, password, moderator) VALUES ('root', 'pbkdf2:sha256:260000$BpmSaYWHny3n8GfH$926bcd611c73142ab87060602e970097a939f930d1b1f6788b7fb6e1171025f3', true);
+INSERT INTO users (username, password) VALUES ('tester', 'pbkdf2:sha256:260000$fCk4hb7DlDpqtjOJ$6f7d64fc9da944a0402f41244ab0245dc78dc64a8f0d7ed5f7f5e945b583bdf4');
 
 /* Table for sections */
 CREATE TABLE sections(id SERIAL PRIMARY KEY, section_name TEXT, private BOOLEAN DEFAULT false, visible BOOLEAN DEFAULT true);
@@ -15,7 +16,7 @@ INSERT INTO sections (section_name) VALUES ('Nalle-osio');
 CREATE TABLE user_privileges(id SERIAL PRIMARY KEY, user_id INTEGER REFERENCES users, section_id INTEGER REFERENCES sections);
 
 /* Table for threads within sections */
-CREATE TABLE threads(id SERIAL PRIMARY KEY,  posting_time TIMESTAMP, user_id INTEGER REFERENCES users, section_id INTEGER REFERENCES sections, thread_name TEXT, content TEXT, visible BOOLEAN DEFAULT true);
+CREATE TABLE threads(id SERIAL PRIMARY KEY,  posting_time TIMESTAMP, user_id INTEGER REFERENCES users, section_id INTEGER REFERENCES sections, thread_name TEXT, content TEXT, visible BOOLEAN DEFAULT true, last_activity TIMESTAMP DEFAULT NOW());
 /* Create some examples for testing purposes */
 INSERT INTO threads (posting_time, user_id, section_id, thread_name, content) VALUES (NOW(), 1, 1, 'Is this really a thread?', 'This does not seem like a thread. More like a sequence of ones and zeroes.');
 INSERT INTO threads (posting_time, user_id, section_id, thread_name, content) VALUES (NOW(), 2, 1, 'How fluffy is Luna, exactly?', 'Luna seems like a fluffy madame. What do you reckon, is she hecka fluffy?');
@@ -26,4 +27,18 @@ CREATE TABLE messages (id SERIAL PRIMARY KEY, posting_time TIMESTAMP, user_id IN
 INSERT INTO messages (posting_time, user_id, thread_id, content) VALUES (NOW(), 1, 1, 'This is a message');
 INSERT INTO messages (posting_time, user_id, thread_id, content) VALUES (NOW(), 2, 1, 'Another message!');
 INSERT INTO messages (posting_time, user_id, thread_id, content) VALUES (NOW(), 2, 2, 'WOW, new thread!');
-INSERT INTO messages (posting_time, user_id, thread_id, content) VALUES (NOW(), 1, 2, 'WOW, thread in another section!');
\ No newline at end of file
+INSERT INTO messages (posting_time, user_id, thread_id, content) VALUES (NOW(), 1, 2, 'WOW, thread in another section!');
+
+/* Table for the statistics of each section, kept up to date by the write operations */
+CREATE TABLE section_stats(section_id INTEGER PRIMARY KEY REFERENCES sections, thread_count INTEGER DEFAULT 0, message_count INTEGER DEFAULT 0, last_post TIMESTAMP);
+/* Statistics of the examples above */
+INSERT INTO section_stats (section_id, thread_count, message_count, last_post) VALUES (1, 2, 4, NOW());
+
+/* Table for the search index over thread titles, thread contents and messages */
+CREATE TABLE search_documents(id SERIAL PRIMARY KEY, thread_id INTEGER REFERENCES threads, message_id INTEGER REFERENCES messages, section_id INTEGER REFERENCES sections, visible BOOLEAN DEFAULT true, document TSVECTOR);
+CREATE INDEX search_documents_document_idx ON search_documents USING GIN (document) WHERE visible;
+CREATE UNIQUE INDEX search_documents_thread_idx ON search_documents (thread_id) WHERE message_id IS NULL;
+CREATE UNIQUE INDEX search_documents_message_idx ON search_documents (message_id);
+/* Index the examples above */
+INSERT INTO search_documents (thread_id, section_id, document) SELECT id, section_id, setweight(to_tsvector('simple', thread_name), 'A') || setweight(to_tsvector('simple', content), 'B') FROM threads;
+INSERT INTO search_documents (thread_id, message_id, section_id, document) SELECT M.thread_id, M.id, T.section_id, setweight(to_tsvector('simple', M.content), 'C') FROM messages M JOIN threads T ON T.id = M.thread_id;
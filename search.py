@@ -0,0 +1,183 @@
+from db import db, read, after_commit
+
+import users
+from pagecache import PageCache
+
+from flask import current_app
+
+# For the search results kept in the cache
+from collections import namedtuple
+
+
+# A thread or message matching a query
+SearchResult = namedtuple("SearchResult", ["thread_id", "message_id", "section_id", "thread_name", "content", "rank"])
+
+
+# Search document of a thread: its title is weighted above its content
+THREAD_DOCUMENT = "setweight(to_tsvector(CAST(:config AS regconfig), coalesce(T.thread_name, '')), 'A') || " \
+    "setweight(to_tsvector(CAST(:config AS regconfig), coalesce(T.content, '')), 'B')"
+
+# Search document of a message
+MESSAGE_DOCUMENT = "setweight(to_tsvector(CAST(:config AS regconfig), coalesce(M.content, '')), 'C')"
+
+
+# --- CACHE ---
+
+# The search result cache of the application, None if it is disabled
+def get_cache():
+
+    if not "searchcache" in current_app.extensions:
+        maxEntries = current_app.config["SEARCH_CACHE_MAX_ENTRIES"]
+        current_app.extensions["searchcache"] = PageCache(current_app.config["SEARCH_CACHE_MAX_BYTES"], current_app.config["SEARCH_CACHE_TTL"],
+                                                          maxEntries) if maxEntries > 0 else None
+
+    return current_app.extensions["searchcache"]
+
+
+# Cache tags of the results of a query run with access to the private sections given as an argument. Every result depends
+# on all the public sections, which share a single tag, and on each private section the user has access to
+def cache_tags(section_ids):
+
+    return ["search"] + ["search:" + str(section_id) for section_id in section_ids]
+
+
+# Drop the cached results that may include documents of the sections given as an argument, once the change is committed
+def invalidate_sections(section_ids):
+
+    cache = get_cache()
+    if cache is None:
+        return
+
+    tags = set()
+    for section_id in set(section_ids):
+        section = users.get_section(section_id)
+        tags.add("search:" + str(section_id) if section and section.private else "search")
+    if tags:
+        after_commit(lambda: cache.invalidate(tags))
+
+
+# Approximate memory use of a page of search results
+def results_size(results):
+
+    return sum(200 + len(result.thread_name or "") + len(result.content or "") for result in results)
+
+
+# --- INDEXING ---
+
+# Add or update the search document of the thread given as an argument
+def index_thread(thread_id):
+
+    sql = "INSERT INTO search_documents (thread_id, section_id, visible, document) " \
+    " SELECT T.id, T.section_id, T.visible, " + THREAD_DOCUMENT + " FROM threads T WHERE T.id=:thread_id" \
+    " ON CONFLICT (thread_id) WHERE message_id IS NULL DO UPDATE SET document=EXCLUDED.document, visible=EXCLUDED.visible RETURNING section_id"
+    result = db.session.execute(sql, {"thread_id": thread_id, "config": current_app.config["SEARCH_CONFIG"]})
+    invalidate_sections(document.section_id for document in result.fetchall())
+
+
+# Add or update the search document of the message given as an argument
+def index_message(message_id):
+
+    index_messages([message_id])
+
+
+# Add or update the search documents of the messages given as a list of ids
+def index_messages(message_ids):
+
+    sql = "INSERT INTO search_documents (thread_id, message_id, section_id, visible, document) " \
+    " SELECT M.thread_id, M.id, T.section_id, M.visible, " + MESSAGE_DOCUMENT + " FROM messages M JOIN threads T ON T.id = M.thread_id" \
+    " WHERE M.id = ANY(:message_ids) ON CONFLICT (message_id) DO UPDATE SET document=EXCLUDED.document, visible=EXCLUDED.visible RETURNING section_id"
+    result = db.session.execute(sql, {"message_ids": [int(message_id) for message_id in message_ids], "config": current_app.config["SEARCH_CONFIG"]})
+    invalidate_sections(document.section_id for document in result.fetchall())
+
+
+# Hide the documents of the thread given as an argument and of all the messages in it from the search results
+def hide_thread(thread_id):
+
+    sql = "UPDATE search_documents SET visible=false WHERE thread_id=:thread_id RETURNING section_id"
+    result = db.session.execute(sql, {"thread_id": thread_id})
+    invalidate_sections(document.section_id for document in result.fetchall())
+
+
+# Hide the document of the message given as an argument from the search results
+def hide_message(message_id):
+
+    sql = "UPDATE search_documents SET visible=false WHERE message_id=:message_id RETURNING section_id"
+    result = db.session.execute(sql, {"message_id": message_id})
+    invalidate_sections(document.section_id for document in result.fetchall())
+
+
+# Hide the documents of the section given as an argument from the search results
+def hide_section(section_id):
+
+    sql = "UPDATE search_documents SET visible=false WHERE section_id=:section_id"
+    db.session.execute(sql, {"section_id": section_id})
+    invalidate_sections([section_id])
+
+
+# Rebuild the whole search index from the threads and messages
+def reindex():
+
+    config = current_app.config["SEARCH_CONFIG"]
+
+    db.session.execute("DELETE FROM search_documents")
+
+    sql = "INSERT INTO search_documents (thread_id, section_id, visible, document) " \
+    " SELECT T.id, T.section_id, T.visible, " + THREAD_DOCUMENT + " FROM threads T"
+    result = db.session.execute(sql, {"config": config})
+    threadCount = result.rowcount
+
+    sql = "INSERT INTO search_documents (thread_id, message_id, section_id, visible, document) " \
+    " SELECT M.thread_id, M.id, T.section_id, M.visible AND T.visible, " + MESSAGE_DOCUMENT + " FROM messages M JOIN threads T ON T.id = M.thread_id"
+    result = db.session.execute(sql, {"config": config})
+    messageCount = result.rowcount
+
+    db.session.commit()
+
+    return threadCount, messageCount
+
+
+# --- QUERY ---
+
+# Fetch one page of the threads and messages matching the query, best matches first. At most SEARCH_MAX_RESULTS results are
+# returned over all the pages. Deleted posts and the private sections the user has no access to are filtered out within the index query.
+# The pages are cached by the normalised query and the private sections the user has access to
+def search_forum(query, page=1):
+
+    pageSize = current_app.config["SEARCH_RESULTS_PER_PAGE"]
+    maxResults = current_app.config["SEARCH_MAX_RESULTS"]
+    offset = (page - 1) * pageSize
+    if offset >= maxResults:
+        return [], False
+    limit = min(pageSize, maxResults - offset)
+
+    identity = users.get_identity()
+    section_ids = sorted(identity.sections) if identity else []
+
+    # Case and spacing do not change the meaning of the query
+    cache = get_cache()
+    if cache is not None:
+        key = (" ".join(query.lower().split()), page, tuple(section_ids))
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        tags = cache_tags(section_ids)
+        versions = cache.tag_versions(tags)
+
+    sql = "SELECT D.thread_id, D.message_id, D.section_id, T.thread_name," \
+    " CASE WHEN D.message_id IS NULL THEN T.content ELSE M.content END AS content, ts_rank_cd(D.document, Q.query) AS rank" \
+    " FROM websearch_to_tsquery(CAST(:config AS regconfig), :query) AS Q(query)" \
+    " JOIN search_documents D ON D.document @@ Q.query JOIN sections S ON S.id = D.section_id" \
+    " JOIN threads T ON T.id = D.thread_id LEFT JOIN messages M ON M.id = D.message_id" \
+    " WHERE D.visible=true AND S.visible=true AND (NOT S.private OR S.id = ANY(:section_ids))" \
+    " ORDER BY rank DESC, D.id DESC LIMIT :limit OFFSET :offset"
+    result = read(sql, {"config": current_app.config["SEARCH_CONFIG"], "query": query, "section_ids": section_ids,
+                        "limit": limit + 1, "offset": offset})
+    results = [SearchResult(*row) for row in result.fetchall()]
+
+    hasMore = len(results) > limit and offset + limit < maxResults
+    results = results[:limit]
+
+    if cache is not None:
+        cache.set(key, (results, hasMore), tags, versions, results_size(results))
+
+    return results, hasMore
@@ -0,0 +1,108 @@
+# Fixtures of the tests. They run against throwaway databases created on the PostgreSQL server of TEST_DATABASE_URL,
+# which is only used for creating and dropping them, and are skipped when it is not set.
+#
+#   TEST_DATABASE_URL=postgresql://postgres@localhost/postgres python -m pytest tests
+
+import sys, uuid
+
+from os import getenv, path
+
+import pytest
+
+from sqlalchemy import create_engine
+
+
+# The modules of the app are imported from the project folder
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Schema of the forum as it is now, and as it was before the migrations existed
+SCHEMA_FILE = path.join(ROOT, "schema.sql")
+BASELINE_SCHEMA_FILE = path.join(ROOT, "tests", "baseline_schema.sql")
+
+
+# Run the statements of an SQL file in the database
+def load_sql(url, filename):
+
+    engine = create_engine(url)
+    with engine.begin() as connection:
+        with open(filename) as sql:
+            connection.connection.cursor().execute(sql.read())
+    engine.dispose()
+
+
+# Create an empty database, yield its address and drop it afterwards
+def temporary_database():
+
+    serverUrl = getenv("TEST_DATABASE_URL")
+    if not serverUrl:
+        pytest.skip("Set TEST_DATABASE_URL to a PostgreSQL database on a server where the tests may create databases")
+
+    name = "forum_test_" + uuid.uuid4().hex[:12]
+    server = create_engine(serverUrl, isolation_level="AUTOCOMMIT")
+    with server.connect() as connection:
+        connection.execute("CREATE DATABASE " + name)
+
+    yield serverUrl.rsplit("/", 1)[0] + "/" + name
+
+    with server.connect() as connection:
+        connection.execute("DROP DATABASE " + name + " WITH (FORCE)")
+    server.dispose()
+
+
+# Address of an empty database of its own for the test, dropped afterwards
+@pytest.fixture
+def database_url():
+
+    yield from temporary_database()
+
+
+# Address of a second empty database, for the tests of apps on different databases
+@pytest.fixture
+def other_database_url():
+
+    yield from temporary_database()
+
+
+# Create the forum in the database from schema.sql with the migrations applied
+def create_forum(url):
+
+    import migrate
+
+    load_sql(url, SCHEMA_FILE)
+    engine = create_engine(url)
+    migrate.apply_migrations(engine)
+    engine.dispose()
+
+
+# Create the app against the database, with the rate limits off and their buckets in the temporary folder of the test
+def create_test_app(url, monkeypatch, tmp_path):
+
+    monkeypatch.setenv("DATABASE_URL", url)
+    monkeypatch.setenv("SECRET_KEY", "test")
+    monkeypatch.setenv("RATE_LIMITS", "")
+    monkeypatch.setenv("RATE_LIMIT_STORE", str(tmp_path / "buckets.sqlite3"))
+    monkeypatch.setenv("PAGE_CACHE_MAX_BYTES", "0")
+
+    from app import create_app
+
+    return create_app()
+
+
+# The app against a database created from schema.sql with the migrations applied
+@pytest.fixture
+def app(database_url, monkeypatch, tmp_path):
+
+    create_forum(database_url)
+
+    return create_test_app(database_url, monkeypatch, tmp_path)
+
+
+# Log the test client in as the user
+def log_in(client, username, password):
+
+    response = client.post("/login", data={"username": username, "password": password})
+    assert response.status_code == 302
+
+    with client.session_transaction() as session:
+        return session["crsf_token"]
@@ -0,0 +1,32 @@
+from sqlalchemy import create_engine
+
+import migrate
+
+from conftest import load_sql, create_test_app, SCHEMA_FILE
+
+
+# Number of statements of the front page request as reported in its Server-Timing header
+def count_queries(client):
+
+    timing = client.get("/").headers["Server-Timing"]
+
+    return int(timing.split('desc="')[1].split(" ")[0])
+
+
+# Creating more applications does not count the statements of a request more than once
+def test_statements_counted_once_per_app(database_url, monkeypatch, tmp_path):
+
+    load_sql(database_url, SCHEMA_FILE)
+    engine = create_engine(database_url)
+    migrate.apply_migrations(engine)
+    engine.dispose()
+
+    monkeypatch.setenv("INSTRUMENTATION", "1")
+    app = create_test_app(database_url, monkeypatch, tmp_path)
+    client = app.test_client()
+    client.get("/")
+    queries = count_queries(client)
+
+    create_test_app(database_url, monkeypatch, tmp_path)
+    create_test_app(database_url, monkeypatch, tmp_path)
+    assert count_queries(client) == queries
@@ -0,0 +1,50 @@
+import admission
+
+from conftest import log_in
+
+
+# The requests over the rate limit are answered with 429 and the seconds to wait, for each client address and each username tried
+def test_rate_limit(app):
+
+    app.config["RATE_LIMITS"] = {"login": (2, 60.0)}
+    client = app.test_client()
+    for i in range(2):
+        assert client.post("/login", data={"username": "root", "password": "wrong"}).status_code != 429
+
+    response = client.post("/login", data={"username": "root", "password": "wrong"})
+    assert response.status_code == 429
+    assert 0 < int(response.headers["Retry-After"]) <= 30
+    assert "try again in " + response.headers["Retry-After"] + " seconds" in response.get_data(as_text=True)
+
+    # Another client address is refused too, as the username has used up its own bucket
+    other = app.test_client()
+    response = other.post("/login", data={"username": "root", "password": "wrong"}, environ_base={"REMOTE_ADDR": "10.0.0.2"})
+    assert response.status_code == 429
+
+
+# Over the concurrency cap every request is shed with 503 and Retry-After, and the searches are shed first
+def test_admission_sheds_requests(app):
+
+    app.config["ADMISSION_MAX_CONCURRENCY"] = 2
+    app.config["ADMISSION_EXPENSIVE_CONCURRENCY"] = 0
+    client = app.test_client()
+    log_in(client, "tester", "123")
+    shed = dict(admission.shedCount)
+
+    response = client.get("/result?query=message&prevURL=/")
+    assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+    assert client.get("/section/1/1").status_code == 200
+
+    # Keep a request in progress while the next one arrives
+    app.config["ADMISSION_MAX_CONCURRENCY"] = 1
+    admission.inFlight["page"] += 1
+    try:
+        response = client.get("/section/1/1")
+        assert response.status_code == 503 and response.headers["Retry-After"] == "1"
+    finally:
+        admission.inFlight["page"] -= 1
+
+    assert client.get("/section/1/1").status_code == 200
+    assert admission.shedCount["expensive"] == shed["expensive"] + 1
+    assert admission.shedCount["page"] == shed["page"] + 1
+    assert admission.inFlight == {"page": 0, "expensive": 0}
@@ -0,0 +1,76 @@
+import threading
+
+from time import sleep, monotonic
+
+from db import db
+
+import live
+
+from conftest import create_test_app, create_forum, log_in
+
+
+# The new messages of a thread are only followed at the address of the section the thread is in, by the users with access to it
+def test_live_access_by_thread_section(app):
+
+    with app.app_context():
+        db.session.execute("INSERT INTO sections (id, section_name, private) VALUES (2, 'Secret', true)")
+        db.session.execute("INSERT INTO threads (id, posting_time, user_id, section_id, thread_name, content) VALUES (3, NOW(), 1, 2, 'Secret thread', 'Secret content')")
+        db.session.execute("INSERT INTO messages (id, posting_time, user_id, thread_id, content) VALUES (5, NOW(), 1, 3, 'Secret message')")
+        db.session.commit()
+    client = app.test_client()
+    log_in(client, "tester", "123")
+
+    # The private thread is not followed through a public section, nor in its own section without access
+    for url in ["/section/1/3/messages?since=0", "/section/1/3/events?since=0", "/section/1/999/messages?since=0"]:
+        response = client.get(url)
+        assert response.status_code == 404 and "Secret" not in response.get_data(as_text=True)
+    assert client.get("/section/2/3/messages?since=0").status_code == 403
+    assert client.get("/section/2/3/events?since=0").status_code == 403
+
+    response = client.get("/section/1/1/messages?since=0")
+    assert response.status_code == 200
+    assert [message["content"] for message in response.get_json()["messages"]] == ["This is a message", "Another message!"]
+
+
+# A notification between taking the generation and waiting is not missed, and only the clients of the thread are woken
+def test_hub_wait_after_notification():
+
+    hub = live.Hub()
+    generation = hub.generation(1)
+    otherGeneration = hub.generation(2)
+
+    hub.notify(1)
+    assert hub.wait(1, generation, 0)
+    assert not hub.wait(2, otherGeneration, 0)
+    assert not hub.wait(1, hub.generation(1), 0)
+
+    # After notifications may have been missed every client is woken
+    generation = hub.generation(2)
+    hub.notify_all()
+    assert hub.wait(2, generation, 0)
+
+
+# Each app listens for the notifications of its own database, so a long poll is woken by a reply posted to its app
+# even after another app has started listening on another database
+def test_listener_of_each_app(database_url, other_database_url, monkeypatch, tmp_path):
+
+    for url in [database_url, other_database_url]:
+        create_forum(url)
+    first = create_test_app(database_url, monkeypatch, tmp_path)
+    second = create_test_app(other_database_url, monkeypatch, tmp_path)
+    second.config["LIVE_POLL_SECONDS"] = 5
+    assert first.test_client().get("/section/1/1/messages?since=0").status_code == 200
+
+    def reply():
+        sleep(0.5)
+        client = second.test_client()
+        token = log_in(client, "root", "root")
+        client.post("/section/1/1/post_reply", data={"crsf_token": token, "content": "Live reply"})
+    replier = threading.Thread(target=reply)
+    replier.start()
+    start = monotonic()
+    messages = second.test_client().get("/section/1/1/messages?since=4").get_json()["messages"]
+    replier.join()
+
+    assert [message["content"] for message in messages] == ["Live reply"] and monotonic() - start < 4
+    assert first.extensions["live"] is not second.extensions["live"]
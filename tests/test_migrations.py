@@ -0,0 +1,73 @@
+from sqlalchemy import create_engine
+
+import migrate
+
+from conftest import load_sql, create_test_app, log_in, SCHEMA_FILE, BASELINE_SCHEMA_FILE
+
+
+# Columns of the tables of the database as (table, column, type)
+def list_columns(engine):
+
+    sql = "SELECT table_name, column_name, data_type FROM information_schema.columns WHERE table_schema='public' AND table_name <> 'schema_migrations'"
+    with engine.connect() as connection:
+        return set(tuple(row) for row in connection.execute(sql))
+
+
+# A database created from the original schema, before the migrations existed, is brought up to date by flask migrate
+def test_migrate_baseline_schema(database_url, monkeypatch, tmp_path):
+
+    load_sql(database_url, BASELINE_SCHEMA_FILE)
+    engine = create_engine(database_url)
+
+    applied = migrate.apply_migrations(engine)
+    assert applied == [(version, name) for version, name, filename in migrate.list_migrations()]
+    assert migrate.apply_migrations(engine) == []
+
+    with engine.connect() as connection:
+        assert connection.execute("SELECT count(*) FROM threads WHERE last_activity IS NULL").scalar() == 0
+        stats = connection.execute("SELECT thread_count, message_count FROM section_stats WHERE section_id=1").fetchone()
+        assert tuple(stats) == (2, 4)
+        assert connection.execute("SELECT count(*) FROM search_documents").scalar() == 6
+        assert [tuple(row) for row in connection.execute("SELECT id, message_count FROM threads ORDER BY id")] == [(1, 2), (2, 2)]
+    engine.dispose()
+
+    app = create_test_app(database_url, monkeypatch, tmp_path)
+    client = app.test_client()
+    log_in(client, "root", "root")
+    assert client.get("/").status_code == 200
+    assert client.get("/section/1?sort=activity").status_code == 200
+    assert "Luna" in client.get("/result?query=fluffy&prevURL=/").get_data(as_text=True)
+
+
+# Users registered twice under the same name before the names were unique are kept, the later ones renamed
+def test_migrate_duplicate_usernames(database_url):
+
+    load_sql(database_url, BASELINE_SCHEMA_FILE)
+    engine = create_engine(database_url)
+    with engine.begin() as connection:
+        connection.execute("INSERT INTO users (username, password) VALUES ('tester', 'x'), ('tester', 'y')")
+
+    migrate.apply_migrations(engine)
+    with engine.connect() as connection:
+        usernames = [row.username for row in connection.execute("SELECT username FROM users ORDER BY id")]
+    engine.dispose()
+
+    assert usernames == ["root", "tester", "tester_3", "tester_4"]
+
+
+# The migrated original schema has the same columns as the current schema with the migrations applied
+def test_baseline_schema_matches_current(database_url):
+
+    load_sql(database_url, BASELINE_SCHEMA_FILE)
+    engine = create_engine(database_url)
+    migrate.apply_migrations(engine)
+    migrated = list_columns(engine)
+
+    with engine.begin() as connection:
+        connection.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public")
+    load_sql(database_url, SCHEMA_FILE)
+    migrate.apply_migrations(engine)
+    current = list_columns(engine)
+    engine.dispose()
+
+    assert migrated == current
@@ -0,0 +1,77 @@
+from conftest import create_test_app, log_in
+
+
+# The app with the page cache on
+def create_caching_app(url, monkeypatch, tmp_path):
+
+    app = create_test_app(url, monkeypatch, tmp_path)
+    app.config["PAGE_CACHE_MAX_BYTES"] = 1000000
+
+    return app
+
+
+# A page cached by one worker is not served under the version of an edit made through another, whose invalidation it does not see
+def test_edit_through_another_app(app, database_url, monkeypatch, tmp_path):
+
+    first = create_caching_app(database_url, monkeypatch, tmp_path)
+    second = create_caching_app(database_url, monkeypatch, tmp_path)
+    visitor = first.test_client()
+
+    response = visitor.get("/section/1/1")
+    assert "Is this really a thread?" in response.get_data(as_text=True)
+    oldEtag = response.headers["ETag"]
+    assert visitor.get("/section/1/1").headers["ETag"] == oldEtag
+
+    editor = second.test_client()
+    token = log_in(editor, "root", "root")
+    editor.post("/section/1/1/post_thread_edit", data={"crsf_token": token, "threadTitle": "An edited thread", "content": "Edited"})
+
+    response = visitor.get("/section/1/1")
+    assert response.headers["ETag"] != oldEtag
+    assert "An edited thread" in response.get_data(as_text=True)
+    assert visitor.get("/section/1/1", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+# The pages cached for the visitors are dropped by the writes they show, and the logged in users get pages of their own
+def test_writes_invalidate_cached_pages(app):
+
+    app.config["PAGE_CACHE_MAX_BYTES"] = 1000000
+    visitor = app.test_client()
+    urls = ["/", "/section/1", "/section/1/1"]
+    pages = {url: visitor.get(url).get_data(as_text=True) for url in urls}
+    cache = app.extensions["pagecache"]
+    hits = cache.hits
+    assert {url: visitor.get(url).get_data(as_text=True) for url in urls} == pages
+    assert cache.hits == hits + len(urls)
+
+    writer = app.test_client()
+    token = log_in(writer, "root", "root")
+    assert "Edit thread" in writer.get("/section/1/1").get_data(as_text=True)
+    assert "Edit thread" not in visitor.get("/section/1/1").get_data(as_text=True)
+    writer.post("/section/1/post_thread", data={"crsf_token": token, "threadTitle": "A new thread", "content": "New"})
+    writer.post("/section/1/1/post_reply", data={"crsf_token": token, "content": "A new reply"})
+
+    assert visitor.get("/").get_data(as_text=True) != pages["/"]
+    assert "A new thread" in visitor.get("/section/1").get_data(as_text=True)
+    assert "A new reply" in visitor.get("/section/1/1").get_data(as_text=True)
+
+
+# The entity tag of a page always comes with the body of its version, whether the page is rendered or served from the cache
+def test_etag_matches_body(app):
+
+    app.config["PAGE_CACHE_MAX_BYTES"] = 1000000
+    visitor = app.test_client()
+    first = visitor.get("/section/1/1")
+    cached = visitor.get("/section/1/1")
+    assert cached.headers["ETag"] == first.headers["ETag"] and cached.get_data() == first.get_data()
+
+    writer = app.test_client()
+    token = log_in(writer, "root", "root")
+    writer.post("/section/1/1/post_reply", data={"crsf_token": token, "content": "A new reply"})
+
+    response = visitor.get("/section/1/1", headers={"If-None-Match": first.headers["ETag"]})
+    assert response.status_code == 200 and response.headers["ETag"] != first.headers["ETag"]
+    assert "A new reply" in response.get_data(as_text=True)
+    assert visitor.get("/section/1/1", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    cached = visitor.get("/section/1/1")
+    assert cached.headers["ETag"] == response.headers["ETag"] and cached.get_data() == response.get_data()
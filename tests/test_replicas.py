@@ -0,0 +1,34 @@
+from time import sleep
+
+from sqlalchemy import create_engine
+
+from conftest import create_test_app, create_forum, log_in
+
+
+# The page queries go to the replica, except for a user who has just written, who reads the primary until the sticky window has passed
+def test_reads_stay_on_primary_after_write(database_url, other_database_url, monkeypatch, tmp_path):
+
+    for url in [database_url, other_database_url]:
+        create_forum(url)
+    # The second database stands in for a replica that has not caught up, with a title of its own to tell the pages apart
+    engine = create_engine(other_database_url)
+    with engine.begin() as connection:
+        connection.execute("UPDATE threads SET thread_name='Replica thread' WHERE id=1")
+    engine.dispose()
+
+    monkeypatch.setenv("DATABASE_REPLICA_URLS", other_database_url)
+    app = create_test_app(database_url, monkeypatch, tmp_path)
+    app.config["DATABASE_REPLICA_STICKY_SECONDS"] = 1
+    visitor = app.test_client()
+    writer = app.test_client()
+    token = log_in(writer, "root", "root")
+    assert "Replica thread" in visitor.get("/section/1/1").get_data(as_text=True)
+
+    assert writer.post("/section/1/1/post_reply", data={"crsf_token": token, "content": "A fresh reply"}).status_code == 302
+    page = writer.get("/section/1/1?newest=1").get_data(as_text=True)
+    assert "A fresh reply" in page and "Replica thread" not in page
+    page = visitor.get("/section/1/1?newest=1").get_data(as_text=True)
+    assert "A fresh reply" not in page and "Replica thread" in page
+
+    sleep(1.1)
+    assert "Replica thread" in writer.get("/section/1/1").get_data(as_text=True)
@@ -0,0 +1,58 @@
+import zlib
+
+import pytest
+
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+
+import users
+
+from conftest import log_in
+
+
+# The edit history of a post in a private section is only shown to the moderators with access to the section,
+# and only at the address of the thread and section the post is in
+def test_history_of_private_section(app):
+
+    with app.app_context():
+        db.session.execute("INSERT INTO sections (id, section_name, private) VALUES (2, 'Secret', true)")
+        db.session.execute("INSERT INTO threads (id, posting_time, user_id, section_id, thread_name, content) VALUES (3, NOW(), 1, 2, 'Secret thread', 'Secret content')")
+        db.session.execute("INSERT INTO messages (id, posting_time, user_id, thread_id, content) VALUES (5, NOW(), 1, 3, 'Secret message')")
+        db.session.execute("INSERT INTO revisions (thread_id, message_id, revision, user_id, snapshot, data) VALUES (3, 5, 1, 1, true, :data)",
+                           {"data": zlib.compress(b"Secret draft")})
+        db.session.commit()
+    client = app.test_client()
+    log_in(client, "root", "root")
+
+    # A moderator without access to the section is refused, whichever thread and section the address names
+    for url in ["/section/2/3/history", "/section/2/3/5/history", "/section/2/3/5/history?revision=1"]:
+        assert client.get(url).status_code == 403
+    for url in ["/section/1/3/history", "/section/1/1/5/history", "/section/1/3/5/history?revision=1"]:
+        response = client.get(url)
+        assert response.status_code == 404 and "Secret" not in response.get_data(as_text=True)
+
+    # Posts of another thread or section are not found at the address
+    assert client.get("/section/1/2/1/history").status_code == 404
+    assert client.get("/section/3/1/history").status_code == 404
+
+    with app.app_context():
+        db.session.execute("INSERT INTO user_privileges (user_id, section_id) VALUES (1, 2)")
+        db.session.commit()
+        users.rebuild_section_access()
+
+    assert "Secret draft" in client.get("/section/2/3/5/history?revision=1").get_data(as_text=True)
+    assert "Secret thread" in client.get("/section/2/3/history").get_data(as_text=True)
+    assert client.get("/section/1/3/5/history").status_code == 404
+
+
+# Two versions of a post cannot be stored under the same number, for threads, whose revisions have no message, as well as for messages
+def test_revision_numbers_are_unique(app):
+
+    sql = "INSERT INTO revisions (thread_id, message_id, revision, snapshot, data) VALUES (:thread_id, :message_id, 1, true, '')"
+    for thread_id, message_id in [(1, None), (1, 1)]:
+        with app.app_context():
+            db.session.execute(sql, {"thread_id": thread_id, "message_id": message_id})
+            with pytest.raises(IntegrityError):
+                db.session.execute(sql, {"thread_id": thread_id, "message_id": message_id})
+            db.session.rollback()
@@ -0,0 +1,41 @@
+from db import db
+
+import search, users
+
+from conftest import log_in
+
+
+# Page of the search results for the query as the client
+def search_page(client, query):
+
+    return client.get("/result", query_string={"query": query, "prevURL": "/"}).get_data(as_text=True)
+
+
+# The cached results are kept apart by the private sections the user has access to, and shared by the queries that differ only in case and spacing
+def test_search_cache_by_section_access(app):
+
+    with app.app_context():
+        db.session.execute("INSERT INTO sections (id, section_name, private) VALUES (2, 'Secret', true)")
+        db.session.execute("INSERT INTO threads (id, posting_time, user_id, section_id, thread_name, content) VALUES (3, NOW(), 1, 2, 'Secret thread', 'Fluffy secrets')")
+        search.index_thread(3)
+        db.session.execute("INSERT INTO user_privileges (user_id, section_id) VALUES (1, 2)")
+        db.session.commit()
+        users.rebuild_section_access()
+
+    tester = app.test_client()
+    log_in(tester, "tester", "123")
+    moderator = app.test_client()
+    token = log_in(moderator, "root", "root")
+
+    page = search_page(tester, "fluffy")
+    assert "Luna" in page and "Secret thread" not in page
+    assert "Secret thread" in search_page(moderator, " Fluffy ")
+    assert "Secret thread" not in search_page(tester, "FLUFFY")
+
+    cache = app.extensions["searchcache"]
+    assert sorted(key[2] for key in cache.pages) == [(), (2,)]
+    assert cache.hits == 1
+
+    # A new post drops the cached results it may belong to
+    moderator.post("/section/1/1/post_reply", data={"crsf_token": token, "content": "Fluffy kittens"})
+    assert "Fluffy kittens" in search_page(tester, "fluffy")
@@ -0,0 +1,50 @@
+import pytest
+
+from db import db
+
+import forum
+
+from conftest import log_in
+
+
+# Post a reply to the thread as the logged in client
+def post_reply(client, token, thread_id, content):
+
+    return client.post("/section/1/%d/post_reply" % thread_id, data={"crsf_token": token, "content": content})
+
+
+# The stored message counts of the threads follow the replies and deletions, and give the number of pages of the thread
+def test_thread_message_counts(app):
+
+    app.config["MESSAGES_PER_PAGE"] = 1
+    client = app.test_client()
+    token = log_in(client, "root", "root")
+
+    for content in ["First reply", "Second reply"]:
+        assert post_reply(client, token, 1, content).status_code == 302
+    client.get("/section/1/1/1/delete_message")
+    assert "of 3" in client.get("/section/1/1").get_data(as_text=True)
+    assert "Number of replies: 3" in client.get("/section/1").get_data(as_text=True)
+
+    client.get("/section/1/1/delete_thread")
+    assert "Is this really a thread?" not in client.get("/section/1").get_data(as_text=True)
+    with app.app_context():
+        assert forum.verify_thread_counts() == []
+        assert forum.verify_section_stats() == []
+
+
+# A reply to a deleted thread is refused, leaving the statistics and the search index as they were, whether written directly or in batches
+@pytest.mark.parametrize("mode", ["direct", "buffered"])
+def test_reply_to_deleted_thread(app, mode):
+
+    app.config["REPLY_WRITE_MODE"] = mode
+    client = app.test_client()
+    token = log_in(client, "root", "root")
+    client.get("/section/1/1/delete_thread")
+
+    response = post_reply(client, token, 1, "Too late")
+    assert response.status_code == 200 and "The thread has been deleted" in response.get_data(as_text=True)
+    with app.app_context():
+        assert db.session.execute("SELECT count(*) FROM messages WHERE content='Too late'").scalar() == 0
+        assert db.session.execute("SELECT count(*) FROM search_documents WHERE visible AND thread_id=1").scalar() == 0
+        assert forum.verify_section_stats() == []
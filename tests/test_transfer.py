@@ -0,0 +1,59 @@
+import pytest
+
+from db import db
+
+import transfer
+
+from conftest import log_in
+
+
+# Rows of each exported table, in the order of their ids
+def dump_tables(app):
+
+    with app.app_context():
+        return {table: [tuple(row) for row in db.session.execute("SELECT " + ", ".join(columns) + " FROM " + table + " ORDER BY id")]
+                for table, columns in transfer.TABLES}
+
+
+# An export imported over the contents of the forum brings back every exported table as it was, archived rows and edit history included
+@pytest.mark.parametrize("fileFormat", transfer.FORMATS)
+def test_export_and_replace(app, tmp_path, fileFormat):
+
+    with app.app_context():
+        db.session.execute("INSERT INTO threads_archive (id, posting_time, user_id, section_id, thread_name, content, visible, last_activity)" \
+                           " VALUES (100, NOW(), 1, 1, 'Archived', 'An archived thread', false, NOW())")
+        db.session.execute("INSERT INTO messages_archive (id, posting_time, user_id, thread_id, content, visible) VALUES (100, NOW(), 2, 100, 'Archived reply', false)")
+        db.session.commit()
+        engine = db.engine
+    client = app.test_client()
+    token = log_in(client, "root", "root")
+    client.post("/section/1/1/1/post_message_edit", data={"crsf_token": token, "content": "An edited message"})
+    exported = dump_tables(app)
+
+    counts = transfer.export_forum(engine, str(tmp_path / "export"), fileFormat)
+    assert counts["threads_archive"] == 1 and counts["messages_archive"] == 1 and counts["revisions"] == 1
+
+    # Rows added after the export are gone after the import
+    with app.app_context():
+        db.session.execute("INSERT INTO messages_archive (id, posting_time, user_id, thread_id, content, visible) VALUES (101, NOW(), 2, 100, 'Later', false)")
+        db.session.commit()
+    client.post("/section/1/1/1/post_message_edit", data={"crsf_token": token, "content": "Edited again"})
+
+    assert transfer.import_forum(engine, str(tmp_path / "export"), replace=True) == counts
+    assert dump_tables(app) == exported
+
+    # The imported edit history reads back, and the next edit is numbered after it
+    client.post("/section/1/1/1/post_message_edit", data={"crsf_token": token, "content": "Edited after the import"})
+    assert "This is a message" in client.get("/section/1/1/1/history?revision=1").get_data(as_text=True)
+    assert "Version 3 (current)" in client.get("/section/1/1/1/history").get_data(as_text=True)
+
+
+# Importing into a forum that has contents is refused without replace
+def test_import_into_nonempty_forum(app, tmp_path):
+
+    with app.app_context():
+        engine = db.engine
+    transfer.export_forum(engine, str(tmp_path / "export"), "jsonl")
+
+    with pytest.raises(ValueError):
+        transfer.import_forum(engine, str(tmp_path / "export"))
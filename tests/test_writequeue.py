@@ -0,0 +1,95 @@
+import threading
+
+from time import sleep
+
+from sqlalchemy import create_engine
+
+import writequeue
+
+from conftest import create_test_app, create_forum, log_in
+
+
+# The app writing the replies through the writer thread
+def create_buffered_app(url, monkeypatch, tmp_path):
+
+    app = create_test_app(url, monkeypatch, tmp_path)
+    app.config["REPLY_WRITE_MODE"] = "buffered"
+
+    return app
+
+
+# Contents of the messages of the thread in the database
+def thread_messages(url, thread_id):
+
+    engine = create_engine(url)
+    with engine.connect() as connection:
+        contents = [row.content for row in connection.execute("SELECT content FROM messages WHERE thread_id=%s ORDER BY id", thread_id)]
+    engine.dispose()
+
+    return contents
+
+
+# Post a reply to the thread as the logged in client
+def post_reply(client, token, thread_id, content):
+
+    return client.post("/section/1/%d/post_reply" % thread_id, data={"crsf_token": token, "content": content})
+
+
+# Each app writes the replies posted to it into its own database
+def test_writer_of_each_app(database_url, other_database_url, monkeypatch, tmp_path):
+
+    for url in [database_url, other_database_url]:
+        create_forum(url)
+    first = create_buffered_app(database_url, monkeypatch, tmp_path)
+    second = create_buffered_app(other_database_url, monkeypatch, tmp_path)
+
+    for app, content in [(first, "To the first forum"), (second, "To the second forum")]:
+        client = app.test_client()
+        assert post_reply(client, log_in(client, "root", "root"), 2, content).status_code == 302
+
+    assert thread_messages(database_url, 2)[-1] == "To the first forum"
+    assert thread_messages(other_database_url, 2)[-1] == "To the second forum"
+
+
+# A reply that times out waiting for the writer fails and is never written, while the reply the writer was busy with is written
+# and acknowledged once the writer gets through
+def test_timed_out_reply_is_not_written(app, database_url):
+
+    app.config["REPLY_WRITE_MODE"] = "buffered"
+    app.config["REPLY_ACK_TIMEOUT"] = 0.5
+    app.config["REPLY_FLUSH_INTERVAL"] = 0
+    firstClient = app.test_client()
+    firstToken = log_in(firstClient, "root", "root")
+    secondClient = app.test_client()
+    secondToken = log_in(secondClient, "tester", "123")
+
+    # The writer gets stuck on the lock of the thread while writing the first reply, and the second waits in the queue behind it
+    engine = create_engine(database_url)
+    locker = engine.connect()
+    transaction = locker.begin()
+    locker.execute("SELECT id FROM threads WHERE id=2 FOR UPDATE")
+    statuses = {}
+    first = threading.Thread(target=lambda: statuses.update(first=post_reply(firstClient, firstToken, 2, "Written").status_code))
+    first.start()
+    sleep(0.2)
+    statuses["second"] = post_reply(secondClient, secondToken, 2, "Given up").status_code
+    transaction.commit()
+    locker.close()
+    first.join()
+    engine.dispose()
+
+    assert statuses == {"first": 302, "second": 500}
+    assert post_reply(secondClient, secondToken, 2, "After").status_code == 302
+    assert thread_messages(database_url, 2)[-2:] == ["Written", "After"]
+
+
+# A batch that fails is written reply by reply, so that only the bad reply fails
+def test_failed_batch_is_written_one_by_one(app, database_url):
+
+    batch = [writequeue.PendingReply((1, 2, "First")), writequeue.PendingReply((1, 999, "No such thread")), writequeue.PendingReply((1, 2, "Last"))]
+    with app.app_context():
+        writequeue.write_batch(batch)
+
+    assert batch[0].message_id and batch[2].message_id and batch[1].message_id is None
+    assert batch[1].error is not None and batch[0].error is None and batch[2].error is None
+    assert thread_messages(database_url, 2)[-2:] == ["First", "Last"]
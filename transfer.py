@@ -0,0 +1,146 @@
+# For reading and writing the export files
+import json
+from os import makedirs, path
+
+# For inserting the rows of the JSON files in batches
+from psycopg2.extras import execute_values
+
+
+# Exported tables in an order that satisfies their foreign keys, with their columns. The archive tables and the edit history have no foreign keys and come last.
+# The access sets of the users, the section statistics and the search index are derived from these and rebuilt after an import
+TABLES = [
+    ("users", ["id", "username", "password", "moderator"]),
+    ("sections", ["id", "section_name", "private", "visible"]),
+    ("user_privileges", ["id", "user_id", "section_id"]),
+    ("threads", ["id", "posting_time", "user_id", "section_id", "thread_name", "content", "visible", "last_activity"]),
+    ("messages", ["id", "posting_time", "user_id", "thread_id", "content", "visible"]),
+    ("threads_archive", ["id", "posting_time", "user_id", "section_id", "thread_name", "content", "visible", "last_activity", "archived_at"]),
+    ("messages_archive", ["id", "posting_time", "user_id", "thread_id", "content", "visible", "archived_at"]),
+    ("revisions", ["id", "thread_id", "message_id", "revision", "user_id", "replaced_at", "snapshot", "data"]),
+]
+
+FORMATS = ["jsonl", "csv"]
+
+# Rows fetched from the server-side cursor and rows inserted per statement with the JSON format
+BATCH_SIZE = 10000
+
+# File describing an export: its format and the number of rows in each table
+MANIFEST = "manifest.json"
+
+
+# Turn the time stamps and the binary data of a row into text for JSON. The binary data is written in the hex format of PostgreSQL,
+# as COPY writes it into the CSV files, which the database reads back when it is inserted
+def encode_value(value):
+
+    if isinstance(value, memoryview):
+        return "\\x" + value.hex()
+
+    return value.isoformat()
+
+
+# Write every table into its own file in the directory, one row per line. All the tables are read from a single snapshot,
+# and the rows are streamed from the database to the file so the memory use does not depend on the size of the tables.
+# Returns the number of rows of each table
+def export_forum(engine, directory, fileFormat):
+
+    makedirs(directory, exist_ok=True)
+    counts = {}
+
+    connection = engine.raw_connection()
+    try:
+        connection.cursor().execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        for table, columns in TABLES:
+            sql = "SELECT " + ", ".join(columns) + " FROM " + table + " ORDER BY id"
+            filename = path.join(directory, table + "." + fileFormat)
+
+            with open(filename, "w", newline="") as output:
+                if fileFormat == "csv":
+                    cursor = connection.cursor()
+                    cursor.copy_expert("COPY (" + sql + ") TO STDOUT WITH (FORMAT csv, HEADER)", output)
+                    counts[table] = cursor.rowcount
+                else:
+                    # A named cursor is kept on the server and fetched from in batches
+                    cursor = connection.cursor(name="export_" + table)
+                    cursor.itersize = BATCH_SIZE
+                    cursor.execute(sql)
+                    rowCount = 0
+                    for row in cursor:
+                        output.write(json.dumps(dict(zip(columns, row)), default=encode_value) + "\n")
+                        rowCount += 1
+                    counts[table] = rowCount
+                cursor.close()
+
+        connection.rollback()
+    finally:
+        connection.close()
+
+    with open(path.join(directory, MANIFEST), "w") as manifest:
+        json.dump({"format": fileFormat, "tables": counts}, manifest, indent=2)
+
+    return counts
+
+
+# Read the rows of a JSON lines file as tuples in the order of the columns
+def read_json_rows(jsonFile, columns):
+
+    for line in jsonFile:
+        if line.strip():
+            row = json.loads(line)
+            yield tuple(row[column] for column in columns)
+
+
+# Load an export made by export_forum into the database within a single transaction. The CSV files are loaded with COPY
+# and the JSON files with batched inserts, both read from the file as they go. The id sequences are moved past the imported ids,
+# and the row counts are compared with the manifest before committing. With replace the existing contents are deleted first,
+# otherwise the tables have to be empty. Returns the number of rows of each table
+def import_forum(engine, directory, replace=False):
+
+    with open(path.join(directory, MANIFEST)) as manifest:
+        manifest = json.load(manifest)
+    fileFormat = manifest["format"]
+    tables = [table for table, columns in TABLES]
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        if replace:
+            cursor.execute("TRUNCATE " + ", ".join(tables) + " RESTART IDENTITY CASCADE")
+        else:
+            for table in tables:
+                cursor.execute("SELECT EXISTS (SELECT 1 FROM " + table + ")")
+                if cursor.fetchone()[0]:
+                    raise ValueError("Table %s is not empty, import with --replace to delete its contents" % table)
+
+        # The section statistics and search index are rebuilt from the imported rows
+        cursor.execute("TRUNCATE section_stats, search_documents")
+
+        for table, columns in TABLES:
+            # An export made before the table existed has no file for it, the table is left empty
+            if not table in manifest["tables"]:
+                continue
+
+            filename = path.join(directory, table + "." + fileFormat)
+            with open(filename, newline="") as data:
+                if fileFormat == "csv":
+                    cursor.copy_expert("COPY " + table + " (" + ", ".join(columns) + ") FROM STDIN WITH (FORMAT csv, HEADER)", data)
+                else:
+                    sql = "INSERT INTO " + table + " (" + ", ".join(columns) + ") VALUES %s"
+                    execute_values(cursor, sql, read_json_rows(data, columns), page_size=BATCH_SIZE)
+
+            cursor.execute("SELECT setval(pg_get_serial_sequence('" + table + "', 'id'), COALESCE(max(id), 0) + 1, false) FROM " + table)
+
+        counts = {}
+        for table in tables:
+            cursor.execute("SELECT count(*) FROM " + table)
+            counts[table] = cursor.fetchone()[0]
+            if counts[table] != manifest["tables"].get(table, 0):
+                raise ValueError("Table %s has %d rows after the import, the export has %d" % (table, counts[table], manifest["tables"].get(table, 0)))
+
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    return counts
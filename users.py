@@ -1,6 +1,11 @@
-from db import db
+from db import db, execute_prepared
 
-from flask import session
+import pagecache
+
+from flask import session, g, current_app
+
+# For the request-scoped identity of the user
+from collections import namedtuple
 
 # For hashing the passwords
 from werkzeug.security import check_password_hash, generate_password_hash
@@ -8,29 +13,93 @@ from werkzeug.security import check_password_hash, generate_password_hash
 # For generating crsf tokens
 import secrets
 
+# For hashing the passwords outside of the event loop of the gevent workers
+from gevent import monkey, get_hub
+
+
+# Identity of the logged in user: user id, moderator status and the private sections the user has access to
+Identity = namedtuple("Identity", ["username", "id", "moderator", "sections"])
+
+
+# Load the identity of the logged in user, at most once per request. None if the user is not logged in
+def get_identity():
+    if not "username" in session:
+        return None
+
+    identity = g.get("identity")
+    if identity is None or identity.username != session["username"]:
+        # The private sections the user has access to are kept precomputed with the user
+        sql = "SELECT id, moderator, section_access AS sections FROM users WHERE username=:username"
+        result = execute_prepared(sql, {"username": session["username"]})
+        user = result.fetchone()
+        if not user:
+            return None
+
+        identity = Identity(session["username"], user.id, user.moderator, frozenset(user.sections))
+        g.identity = identity
+
+    return identity
+
+
+# Forget the identity loaded for this request, so that it is reloaded after a change in the user rights
+def reset_identity():
+
+    g.pop("identity", None)
+
+
+# Fetch the name and privacy of the section given as an argument, at most once per request
+def get_section(section_id):
+
+    if not "sections" in g:
+        g.sections = {}
+
+    key = str(section_id)
+    if not key in g.sections:
+        sql = "SELECT id, section_name, private FROM sections WHERE id=:section_id"
+        result = execute_prepared(sql, {"section_id": section_id})
+        g.sections[key] = result.fetchone()
+
+    return g.sections[key]
+
+
+# Run a CPU-bound function in a native thread when the worker serves its requests in greenlets, so that hashing a password
+# does not stall the other requests of the worker. The hash functions release the GIL, so the greenlets keep running meanwhile
+def run_blocking(function, *args, **kwargs):
+
+    if monkey.is_module_patched("threading"):
+        return get_hub().threadpool.apply(function, args, kwargs)
+
+    return function(*args, **kwargs)
+
+
+# Hash a password with the configured parameters
+def hash_password(password):
+
+    return run_blocking(generate_password_hash, password, method=current_app.config["PASSWORD_HASH_METHOD"],
+                        salt_length=current_app.config["PASSWORD_SALT_LENGTH"])
+
+
+# Check whether the password hash given as an argument was made with other than the configured parameters
+def needs_rehash(password_hash):
+
+    method, salt, hashValue = password_hash.split("$", 2)
+
+    return method != current_app.config["PASSWORD_HASH_METHOD"] or len(salt) != current_app.config["PASSWORD_SALT_LENGTH"]
+
 
 # Add an account with the username and password as given in the arguments
 def create_account(username, password):
 
     # generate the hash for the password
-	password = generate_password_hash(password)
+	password = hash_password(password)
 
-	# Check if the username is already in use
-	sql = "SELECT count(*) FROM users WHERE username = :username"
-	result = db.session.execute(sql, {"username":username})
-	usernameAvailable = (result.fetchone()["count"] == 0)
+	# Insert the new user into the appropriate database table, unless the username is already in use
+	sql = "INSERT INTO users (username, password) VALUES (:username, :password) ON CONFLICT (username) DO NOTHING RETURNING id"
+	result = db.session.execute(sql, {"username":username, "password":password})
+	usernameAvailable = result.fetchone() is not None
 
-	if usernameAvailable:
-		# Insert the new user into the appropriate database table
-		sql = "INSERT INTO users (username, password) VALUES (:username, :password)"
-		db.session.execute(sql, {"username":username, "password":password})
-		db.session.commit()
-
-		# Registration successful
-		return True
-	else:
-        # Registration failed, username in use
-		return False
+	# Registration successful if the username was available
+	return usernameAvailable
 
 
 # Login and enter a session
@@ -38,28 +107,23 @@ def login(username, password):
 
     # Check the validity of the input
 	sql = "SELECT id, password FROM users WHERE username =:username"
-	result = db.session.execute(sql, {"username": username})
+	result = execute_prepared(sql, {"username": username})
 	user = result.fetchone()
 	# Check that an account with the input username is found
 	if not user:
 		#error = "Invalid username or password"
 		return False
 
-	# Note: the two premade accounts here are merely for testing,
-    # and under realistic application development they would not be here
-	# -------------------------------------------------------------
-	if username == "root":
-		user_password = generate_password_hash("root")
-	elif username == "tester":
-		user_password = generate_password_hash("123")
-	else:
-		user_password = user.password
-	# -------------------------------------------------------------
-
 	# Check the correctness of password
-	if check_password_hash(user_password, password):
+	if run_blocking(check_password_hash, user.password, password):
+		# Hash the password again if it was hashed with out-of-date parameters
+		if needs_rehash(user.password):
+			sql = "UPDATE users SET password=:password WHERE id=:user_id"
+			db.session.execute(sql, {"password": hash_password(password), "user_id": user.id})
+
 		# Set the session username
 		session["username"] = username
+		reset_identity()
 		# Set a crsf_token for the user to prevent exploitation of CRSF vulnerability
 		session["crsf_token"] = secrets.token_hex(16)
 		# Login successful
@@ -73,20 +137,16 @@ def login(username, password):
 def logout():
 
     del session["username"]
+    reset_identity()
 
 
 # Check if the user is a moderator
 def is_moderator():
-    if not "username" in session:
+    identity = get_identity()
+    if not identity:
         return False
     else:
-        sql = "SELECT moderator FROM users WHERE username=:username"
-        result = db.session.execute(sql, {"username": session["username"]})
-        isModerator = result.fetchone().moderator
-        if isModerator:
-            return True
-        else:
-            return False
+        return identity.moderator
 
 
 # Check that the crsf token is valid
@@ -112,7 +172,7 @@ def promote_user(username):
     # A valid username is input, promote
     sql = "UPDATE users SET moderator=true WHERE id=:user_id"
     db.session.execute(sql, {"user_id": user.id})
-    db.session.commit()
+    reset_identity()
 
     return True
 
@@ -120,24 +180,15 @@ def promote_user(username):
 # Check that the user has access to the section given as an argument
 def check_section_access(section_id):
 
-    sql = "SELECT private FROM sections WHERE id=:section_id"
-    result = db.session.execute(sql, {"section_id": section_id})
-    isPrivate = result.fetchone().private
+    isPrivate = get_section(section_id).private
 
     if isPrivate:
-        if not "username" in session:
+        identity = get_identity()
+        if not identity:
             # The section is private but the user is not logged in, no access
             return False
         # The section is private and the user is logged in, access privileges have to be checked
-        user_id = get_user_id()
-
-        sql = "SELECT id FROM user_privileges WHERE section_id=:section_id AND user_id=:user_id"
-        result = db.session.execute(sql, {"section_id":section_id, "user_id":user_id})
-        hasAccess = result.fetchone()
-        if hasAccess:
-            return True
-        else:
-            return False
+        return int(section_id) in identity.sections
     else:
         # The section is not private, access is granted
         return True
@@ -156,20 +207,43 @@ def is_existing_username(username):
     else:
         return False
 
+# Recompute the access sets of the private sections of the users from their privileges
+SECTION_ACCESS_UPDATE = "UPDATE users U SET section_access = COALESCE((SELECT array_agg(DISTINCT P.section_id ORDER BY P.section_id)" \
+    " FROM user_privileges P JOIN sections S ON S.id = P.section_id WHERE P.user_id = U.id AND S.visible=true), '{}')"
+
+
+# Recompute the access set of every user, after the privileges have been loaded in bulk
+def rebuild_section_access():
+
+    db.session.execute(SECTION_ACCESS_UPDATE)
+    db.session.commit()
+
+
+# Remove the section given as an argument from the access sets of the users
+def revoke_section_access(section_id):
+
+    sql = "UPDATE users SET section_access = array_remove(section_access, :section_id) WHERE :section_id = ANY(section_access)"
+    db.session.execute(sql, {"section_id": int(section_id)})
+    reset_identity()
+
+
 # Give the user given as an argument access to private section given as the second argument
 def grant_private_section_access(username, section_id):
 
     user_id = get_user_id(username)
-    sql = "INSERT INTO user_privileges (user_id, section_id) VALUES (:user_id, :section_id)"
+    sql = "INSERT INTO user_privileges (user_id, section_id) VALUES (:user_id, :section_id) ON CONFLICT (user_id, section_id) DO NOTHING"
     db.session.execute(sql, {"user_id":user_id, "section_id": section_id})
-    db.session.commit()
+    db.session.execute(SECTION_ACCESS_UPDATE + " WHERE U.id=:user_id", {"user_id": user_id})
+    reset_identity()
+    pagecache.invalidate("section:" + str(section_id))
 
 # Fetch the user id based on the username either given as an argument or based on the session
 def get_user_id(username = None):
     if not username:
-        if not "username" in session:
+        identity = get_identity()
+        if not identity:
             return 0
-        username = session["username"]
+        return identity.id
 
     sql = "SELECT id FROM users WHERE username=:username"
     result = db.session.execute(sql, {"username":username})
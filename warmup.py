@@ -0,0 +1,49 @@
+from flask import session
+
+from db import db
+
+import users, forum, rendering
+
+# For timing the phases of the warm-up
+from time import perf_counter
+
+
+# Warm up a worker before it serves requests, so that its first requests do not pay for it: load the templates, run the hot-path
+# queries once so that they are known as prepared statements, and open the connection pools, whose new connections prepare them as they connect.
+# Returns the time of each phase in milliseconds
+def warm_up(app):
+
+    timings = {}
+
+    start = perf_counter()
+    rendering.compile_templates(app)
+    timings["templates"] = (perf_counter() - start) * 1000
+
+    start = perf_counter()
+    with app.test_request_context():
+        # A username no one has, so that the lookups of a logged in user are run without finding anyone
+        session["username"] = ""
+        users.get_identity()
+        users.get_section(0)
+        forum.list_sections()
+        for sort in forum.THREAD_SORT_KEYS:
+            forum.list_threads(0, sort)
+        forum.get_section_version(0)
+        forum.get_thread_version(0)
+        forum.get_thread(0)
+        forum.get_messages(0)
+        forum.get_messages(0, newest=True)
+        db.session.rollback()
+    timings["statements"] = (perf_counter() - start) * 1000
+
+    start = perf_counter()
+    with app.app_context():
+        for engine in [db.engine] + app.extensions["replicas"]:
+            connections = [engine.connect() for i in range(engine.pool.size())]
+            for connection in connections:
+                connection.close()
+    timings["pool"] = (perf_counter() - start) * 1000
+
+    app.extensions["warmup"] = timings
+
+    return timings
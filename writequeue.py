@@ -0,0 +1,145 @@
+from db import db, commit_session
+
+from flask import current_app, g
+
+# For the writer thread and the queue of replies waiting for it
+import threading, queue
+
+# For timing the flushes
+from time import monotonic
+
+
+# Reply waiting in the queue, along with the outcome of writing it. The reply is either claimed by the writer
+# or abandoned by its request when the request stops waiting, whichever comes first, so that an abandoned reply is never written
+class PendingReply:
+
+    def __init__(self, row):
+        self.row = row
+        self.done = threading.Event()
+        self.message_id = None
+        self.error = None
+        self.state = None
+        self.lock = threading.Lock()
+
+    # Take the reply for writing, unless it has been abandoned. Returns whether it was taken
+    def claim(self):
+        with self.lock:
+            if self.state is None:
+                self.state = "claimed"
+            return self.state == "claimed"
+
+    # Give up the reply, unless the writer has taken it already. Returns whether it was given up
+    def abandon(self):
+        with self.lock:
+            if self.state is None:
+                self.state = "abandoned"
+            return self.state == "abandoned"
+
+
+# Queue of the replies of an app and the thread writing them. Each app has its own, kept in its extensions,
+# so that the replies are written to the database of the app they were posted to
+class Writer:
+
+    def __init__(self, app):
+        self.app = app
+        self.replies = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    # Start the writer thread, unless it is already running
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=write_replies, args=(self.app, self.replies), name="reply-writer", daemon=True)
+                self.thread.start()
+
+
+writersLock = threading.Lock()
+
+
+# Queue a reply for the writer thread and wait until the transaction containing it has been committed.
+# If the writer has not taken the reply within REPLY_ACK_TIMEOUT seconds, the reply is given up and an error raised,
+# so that the reply is not written after its request has failed. A reply the writer has taken is waited for until it is written.
+# Returns the id of the message
+def submit(user_id, thread_id, content):
+
+    app = current_app._get_current_object()
+    writer = get_writer(app)
+
+    reply = PendingReply((user_id, thread_id, content))
+    writer.replies.put(reply)
+
+    if not reply.done.wait(app.config["REPLY_ACK_TIMEOUT"]):
+        if reply.abandon():
+            raise RuntimeError("The reply was not taken for writing within %s seconds and was not written" % app.config["REPLY_ACK_TIMEOUT"])
+        reply.done.wait()
+    if reply.error is not None:
+        raise reply.error
+
+    return reply.message_id
+
+
+# The reply writer of the app in this process, with its thread started unless it is already running
+def get_writer(app):
+
+    with writersLock:
+        if not "writequeue" in app.extensions:
+            app.extensions["writequeue"] = Writer(app)
+    writer = app.extensions["writequeue"]
+    writer.start()
+
+    return writer
+
+
+# Collect the queued replies into batches of at most REPLY_BATCH_SIZE, waiting at most REPLY_FLUSH_INTERVAL seconds
+# after the first reply of a batch, and write each batch in one transaction. The replies abandoned by their requests are skipped
+def write_replies(app, replies):
+
+    batchSize = app.config["REPLY_BATCH_SIZE"]
+    interval = app.config["REPLY_FLUSH_INTERVAL"]
+
+    while True:
+        batch = [replies.get()]
+        deadline = monotonic() + interval
+        while len(batch) < batchSize:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(replies.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        batch = [reply for reply in batch if reply.claim()]
+        if not batch:
+            continue
+
+        with app.app_context():
+            write_batch(batch)
+
+        for reply in batch:
+            reply.done.set()
+
+
+# Write a batch of replies. If the batch fails, its replies are written one by one, so that one bad reply fails alone
+def write_batch(batch):
+
+    import forum
+
+    try:
+        message_ids = forum.insert_messages([reply.row for reply in batch])
+        commit_session()
+        for reply, message_id in zip(batch, message_ids):
+            reply.message_id = message_id
+        return
+    except Exception as error:
+        db.session.rollback()
+        g.pop("after_commit", None)
+        if len(batch) == 1:
+            batch[0].error = error
+            return
+    finally:
+        db.session.remove()
+
+    for reply in batch:
+        write_batch([reply])